@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Measures the cost of the control sequence -> notification hot path, using the same iterm2 stub as the CI.
+
+    python benchmarks/hotpath.py --sessions 1,10,100,1000 --json results.json
+    python benchmarks/hotpath.py --compare results.json
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+try:
+    import iterm2  # noqa: F401
+except ImportError:
+    sys.path.insert(0, str(ROOT.joinpath('.github', 'workflows')))
+
+from notify import build_dispatcher  # noqa: E402
+from notify import backends, config, osc, routing, strategies, wire  # noqa: E402
+from notify.commands import Command  # noqa: E402
+from notify.notifications import Factory, Notification  # noqa: E402
+from notify.state import SessionState, StaticServices  # noqa: E402
+
+
+class FakeExecutor(backends.Executor):
+    def __init__(self):
+        super().__init__(logging.getLogger('bench'))
+        self.executed = 0
+
+    def execute(self, cmd: list):
+        self.executed += 1
+
+
+def quiet_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.handlers = [logging.NullHandler()]
+    logger.propagate = False
+    return logger
+
+
+def measure(name: str, sessions: int, iterations: int, op: Callable[[int], None]) -> Dict:
+    samples: List[float] = []
+
+    started = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        op(i)
+        samples.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+
+    samples.sort()
+
+    def percentile(p: float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1e6
+
+    return {
+        'name': name,
+        'sessions': sessions,
+        'iterations': iterations,
+        'ops_per_sec': iterations / elapsed,
+        'mean_us': statistics.mean(samples) * 1e6,
+        'p50_us': percentile(0.50),
+        'p90_us': percentile(0.90),
+        'p99_us': percentile(0.99),
+        'max_us': samples[-1] * 1e6,
+    }
+
+
+def create_dispatchers(n: int, executor: FakeExecutor, manager: config.SessionManager = None):
+    dispatchers = []
+
+    for i in range(n):
+        session_id = "session-{}".format(i)
+        stack = config.Stack([config.create_default(session_id)])
+        if manager is not None:
+            stack = manager.initialize_session_stack(session_id, stack)
+
+        logger = quiet_logger(session_id)
+
+        strategy_factory = strategies.StrategyFactory({
+            'when-inactive': strategies.WhenSlow.create_factory(),
+            'when-slow': strategies.WhenSlow.create_factory(),
+        })
+
+        backend_factory = backends.BackendFactory({
+            'osascript': backends.OsaScript.create_factory(logger=logger, executor=executor),
+        })
+
+        dispatchers.append(build_dispatcher(stack, strategy_factory, backend_factory, logger=logger))
+
+    return dispatchers
+
+
+def bench_dispatch(sessions: int, iterations: int) -> Dict:
+    executor = FakeExecutor()
+    dispatchers = create_dispatchers(sessions, executor)
+
+    def op(i: int):
+        d = dispatchers[i % sessions]
+        d.dispatch('before-command', ['make -j8 all'])
+        # fails, so that every pair goes all the way to the backend
+        d.dispatch('after-command', ['1'])
+
+    return measure('dispatch before/after-command', sessions, iterations, op)
+
+
+def bench_new_session(sessions: int, iterations: int) -> Dict:
+    # what the daemon does for the first event of a new session, with factories shared like its own
+    logger = quiet_logger('bench-new-session')
+    services = StaticServices(
+        strategies.StrategyFactory({'when-slow': strategies.WhenSlow.create_factory()}),
+        backends.BackendFactory({'osascript': backends.OsaScript.create_factory(logger=logger,
+                                                                                executor=FakeExecutor())}))
+
+    def op(i: int):
+        session_id = "session-{}".format(i)
+        routing.bind(SessionState(session_id, config.Stack([config.create_default(session_id)]), logger, services))
+
+    return measure('new session dispatcher', sessions, iterations, op)
+
+
+def bench_stack(sessions: int, iterations: int) -> Dict:
+    stacks = [config.Stack([config.create_default("session-{}".format(i))]) for i in range(sessions)]
+
+    def op(i: int):
+        s = stacks[i % sessions]
+        s.push()
+        s.pop()
+
+    return measure('Stack.push/pop', sessions, iterations, op)
+
+
+def bench_persistence(sessions: int, iterations: int, journal: bool) -> Dict:
+    with TemporaryDirectory() as d:
+        logger = quiet_logger('bench-persistence')
+
+        if journal:
+            storage = config.JournalStorage(Path(d).joinpath('journal.jsonl'), logger=logger)
+        else:
+            storage = config.FileStorage(Path(d).joinpath('state.json'), logger=logger)
+
+        manager = config.SessionManager(storage, logger=logger)
+        manager.load_and_prune([])
+
+        stacks = [manager.initialize_session_stack("session-{}".format(i),
+                                                   config.Stack([config.create_default("session-{}".format(i))]))
+                  for i in range(sessions)]
+
+        def op(i: int):
+            s = stacks[i % sessions]
+            s.push()
+            s.pop()
+
+        result = measure('SessionManager push/pop ({})'.format('journal' if journal else 'file'), sessions,
+                         iterations, op)
+        result['bytes_written'] = manager.stats.bytes_written
+        manager.close()
+
+        return result
+
+
+def bench_templates(sessions: int, iterations: int) -> Dict:
+    stack = config.Stack([config.create_default("session")])
+    factory = Factory(stack)
+    started_at = datetime.now()
+    commands = [Command(started_at, "make -j8 target-{}".format(i)).complete(i % 2, started_at + timedelta(seconds=i))
+                for i in range(sessions)]
+
+    return measure('Factory.from_command', sessions, iterations, lambda i: factory.from_command(commands[i % sessions]))
+
+
+def bench_backends(sessions: int, iterations: int) -> Dict:
+    executor = FakeExecutor()
+    logger = quiet_logger('bench-backends')
+    notifiers = [
+        backends.OsaScript(logger=logger, executor=executor),
+        backends.TerminalNotifier(logger=logger, executor=executor, path='terminal-notifier'),
+    ]
+    n = Notification(title="#fail (0:00:42)", message="make -j8 all", icon="fail.png", sound="Basso")
+
+    return measure('Backend.notify (fake executor)', sessions, iterations,
+                   lambda i: notifiers[i % len(notifiers)].notify(n))
+
+
+def bench_wire(sessions: int, iterations: int, version: int) -> Dict:
+    payloads = [wire.encode('before-command', ['make -j8 target-{}'.format(i)], version=version)
+                for i in range(sessions)]
+
+    return measure('wire.decode (v{})'.format(version), sessions, iterations,
+                   lambda i: wire.decode(payloads[i % sessions]))
+
+
+def bench_osc(sessions: int, iterations: int) -> Dict:
+    # a chunk of terminal output per session, with a before-command and an after-command sequence in it
+    chunks = []
+    for i in range(sessions):
+        output = "$ make -j8 target-{}\r\n".format(i) + "\x1b[32mbuilding\x1b[0m\r\n" * 50
+        chunks.append("\x1b]1337;Custom=id=ID:{}\a{}\x1b]1337;Custom=id=ID:{}\a".format(
+            wire.encode('before-command', ['make -j8 target-{}'.format(i)]), output,
+            wire.encode('after-command', ['0'])).encode('utf-8'))
+
+    parsers = [osc.Parser('ID') for _ in range(sessions)]
+
+    return measure('osc.Parser.feed', sessions, iterations, lambda i: parsers[i % sessions].feed(chunks[i % sessions]))
+
+
+def run(session_counts: List[int], iterations: int) -> List[Dict]:
+    results = []
+
+    for sessions in session_counts:
+        results.append(bench_dispatch(sessions, iterations))
+        results.append(bench_new_session(sessions, iterations))
+        results.append(bench_stack(sessions, iterations))
+        results.append(bench_persistence(sessions, iterations, journal=False))
+        results.append(bench_persistence(sessions, iterations, journal=True))
+        results.append(bench_templates(sessions, iterations))
+        results.append(bench_backends(sessions, iterations))
+        results.append(bench_wire(sessions, iterations, version=1))
+        results.append(bench_wire(sessions, iterations, version=2))
+        results.append(bench_osc(sessions, iterations))
+
+    return results
+
+
+def print_results(results: List[Dict], baseline: Dict = None):
+    header = "{:<36} {:>8} {:>12} {:>10} {:>10} {:>10} {:>10}".format(
+        "benchmark", "sessions", "ops/s", "p50 us", "p90 us", "p99 us", "max us")
+    if baseline is not None:
+        header += " {:>9}".format("vs base")
+
+    print(header)
+
+    for r in results:
+        line = "{:<36} {:>8} {:>12.0f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            r['name'], r['sessions'], r['ops_per_sec'], r['p50_us'], r['p90_us'], r['p99_us'], r['max_us'])
+
+        if baseline is not None:
+            base = baseline.get((r['name'], r['sessions']))
+            line += " {:>8.2f}x".format(r['ops_per_sec'] / base['ops_per_sec']) if base else " {:>9}".format("-")
+
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', default='1,10,100,1000',
+                        help='comma separated list of session counts (default: %(default)s)')
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='operations per benchmark (default: %(default)s)')
+    parser.add_argument('--json', metavar='FILE', help='also write the results to FILE as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='compare throughput with results previously saved by --json')
+    args = parser.parse_args()
+
+    results = run([int(n) for n in args.sessions.split(',')], args.iterations)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r['name'], r['sessions']): r for r in json.load(f)['results']}
+
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version, 'iterations': args.iterations, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Measures the latency the shell integration adds around every command, timing the preexec/precmd hooks from init.sh
+inside the shell itself (so shell startup is not counted).
+
+    python benchmarks/shell_hooks.py --shells bash,zsh --iterations 500
+    git show HEAD~1:init.sh > /tmp/init-old.sh && python benchmarks/shell_hooks.py --init /tmp/init-old.sh
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# runs both hooks once per iteration, writing "start end" timestamps to fd 3; the control sequences go to /dev/null
+SCRIPT = r'''
+[[ -n "$ZSH_VERSION" ]] && zmodload zsh/datetime
+source "$1"
+exec 3>"$2"
+
+for (( i = 0; i < $3; i++ )); do
+  t0=$EPOCHREALTIME
+  _iterm_notify_before_command_hook "$4" >/dev/null
+  _iterm_notify_after_command_hook >/dev/null
+  t1=$EPOCHREALTIME
+  printf '%s %s\n' "$t0" "$t1" >&3
+done
+'''
+
+
+def measure(shell: str, init_file: Path, iterations: int, command_line: str) -> Dict:
+    with TemporaryDirectory() as tmp:
+        identity_file = Path(tmp, 'identity')
+        identity_file.write_text("BENCH_ID\n")
+        out_file = Path(tmp, 'timings')
+
+        env = os.environ.copy()
+        env.pop('TMUX', None)
+        env['ITERM_NOTIFY_IDENTITY_FILE'] = str(identity_file)
+        # EPOCHREALTIME uses the locale's decimal separator
+        env['LC_ALL'] = 'C'
+
+        subprocess.run([shell, '-c', SCRIPT, shell, str(init_file), str(out_file), str(iterations), command_line],
+                       env=env, check=True)
+
+        samples: List[float] = []
+        for line in out_file.read_text().splitlines():
+            start, end = line.split()
+            samples.append(float(end) - float(start))
+
+    samples.sort()
+
+    def percentile(p: float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1e6
+
+    return {
+        'shell': shell,
+        'iterations': len(samples),
+        'mean_us': statistics.mean(samples) * 1e6,
+        'p50_us': percentile(0.50),
+        'p90_us': percentile(0.90),
+        'p99_us': percentile(0.99),
+        'max_us': samples[-1] * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shells', default='bash,zsh',
+                        help='comma separated list of shells, missing ones are skipped (default: %(default)s)')
+    parser.add_argument('--iterations', type=int, default=500,
+                        help='before/after hook pairs per shell (default: %(default)s)')
+    parser.add_argument('--init', metavar='FILE', default=str(ROOT.joinpath('init.sh')),
+                        help='shell integration to measure (default: %(default)s)')
+    parser.add_argument('--command-line', default='make -j8 all',
+                        help='command line passed to the before-command hook (default: %(default)s)')
+    args = parser.parse_args()
+
+    print("{:<8} {:>10} {:>10} {:>10} {:>10} {:>10}".format("shell", "mean us", "p50 us", "p90 us", "p99 us",
+                                                            "max us"))
+
+    for shell in args.shells.split(','):
+        if shutil.which(shell) is None:
+            print("{:<8} not found, skipped".format(shell))
+            continue
+
+        r = measure(shell, Path(args.init), args.iterations, args.command_line)
+        print("{:<8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            r['shell'], r['mean_us'], r['p50_us'], r['p90_us'], r['p99_us'], r['max_us']))
+
+
+if __name__ == '__main__':
+    main()
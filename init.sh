@@ -1,11 +1,131 @@
+# The hooks run around every command: nothing below should fork a process or spawn a subshell on the way to printing
+# the control sequence.
+
+# Reads the identity once per shell (and again only if ITERM_NOTIFY_IDENTITY_FILE changes). Unset
+# iterm_notify_identity to force a reload.
+_iterm_notify_load_identity() {
+  local file line
+
+  file="${ITERM_NOTIFY_IDENTITY_FILE:-$HOME/.iterm-notify-identity}"
+
+  if [[ -n "$iterm_notify_identity" && "$file" == "$iterm_notify_identity_file" ]]; then
+    return 0
+  fi
+
+  iterm_notify_identity_file="$file"
+  iterm_notify_identity=""
+
+  if [[ -s "$file" ]]; then
+    IFS= read -r line <"$file"
+    line="${line#"${line%%[![:space:]]*}"}"
+    line="${line%"${line##*[![:space:]]}"}"
+    iterm_notify_identity="$line"
+  fi
+
+  [[ -n "$iterm_notify_identity" ]]
+}
+
+# Base64-encodes the bytes of $1 into $REPLY.
+_iterm_notify_base64() {
+  local LC_ALL=C
+  [[ -n "$ZSH_VERSION" ]] && setopt localoptions no_multibyte
+
+  local s="$1" alphabet="ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+  local -i i=0 len=${#1} b0 b1 b2 n
+
+  REPLY=""
+
+  while (( i < len )); do
+    b1=0
+    b2=0
+
+    printf -v b0 '%d' "'${s:$i:1}"
+    (( i + 1 < len )) && printf -v b1 '%d' "'${s:$((i + 1)):1}"
+    (( i + 2 < len )) && printf -v b2 '%d' "'${s:$((i + 2)):1}"
+    (( n = ((b0 & 255) << 16) | ((b1 & 255) << 8) | (b2 & 255) ))
+
+    REPLY+="${alphabet:$(( (n >> 18) & 63 )):1}${alphabet:$(( (n >> 12) & 63 )):1}"
+
+    if (( i + 1 < len )); then REPLY+="${alphabet:$(( (n >> 6) & 63 )):1}"; else REPLY+="="; fi
+    if (( i + 2 < len )); then REPLY+="${alphabet:$(( n & 63 )):1}"; else REPLY+="="; fi
+
+    (( i += 3 ))
+  done
+}
+
+# Percent-encodes the bytes of $1 that aren't printable ASCII, and %, into $REPLY.
+_iterm_notify_percent_encode() {
+  local LC_ALL=C
+  [[ -n "$ZSH_VERSION" ]] && setopt localoptions no_multibyte
+
+  local s="$1" c
+  local -i i=0 len=${#1} b
+
+  if [[ "$s" != *[!\ -\~]* ]]; then
+    REPLY="${s//'%'/%25}"
+    return
+  fi
+
+  REPLY=""
+
+  while (( i < len )); do
+    c="${s:$i:1}"
+
+    if [[ "$c" == [\ -\~] && "$c" != '%' ]]; then
+      REPLY+="$c"
+    else
+      printf -v b '%d' "'$c"
+      printf -v c '%%%02X' $(( b & 255 ))
+      REPLY+="$c"
+    fi
+
+    (( i += 1 ))
+  done
+}
+
+# Sets $REPLY to the current time in seconds since the epoch, or to nothing when the shell can't tell precisely without
+# forking (then the daemon uses the time it received the control sequence: closer than a time in whole seconds).
+_iterm_notify_now() {
+  if [[ -n "$EPOCHREALTIME" ]]; then
+    REPLY="${EPOCHREALTIME/,/.}"
+  else
+    REPLY=""
+  fi
+}
+
+# Prints the control sequence for selector $2 with arguments $3..., using the printf-like command $1. Version 1 of
+# the payload is understood by every daemon; version 2 (see notify/wire.py) is sent with ITERM_NOTIFY_WIRE=2, once
+# notify.py is new enough to understand it.
+_iterm_notify_send() {
+  local printf="$1" selector="$2" payload arg
+  shift 2
+
+  if [[ "$ITERM_NOTIFY_WIRE" == 2 ]]; then
+    _iterm_notify_percent_encode "$selector"
+    payload="@2,${#REPLY}:${REPLY}"
+
+    _iterm_notify_now
+    payload+="${#REPLY}:${REPLY}"
+
+    for arg in "$@"; do
+      _iterm_notify_percent_encode "$arg"
+      payload+="${#REPLY}:${REPLY}"
+    done
+  else
+    payload="$selector"
+
+    for arg in "$@"; do
+      _iterm_notify_base64 "$arg"
+      payload+=",${REPLY}"
+    done
+  fi
+
+  $printf "\033]1337;Custom=id=%s:%s\a" "$iterm_notify_identity" "$payload"
+}
+
 iterm-notify() {
   local printf cmd
 
-  _base64() {
-    # some base64 wrap the output
-    cat | command base64 | tr -d '\n'
-  }
-
   tmux-printf() {
     local pattern
     pattern="$1"
@@ -32,45 +152,50 @@ iterm-notify() {
     printf="printf"
   fi
 
-  if [[ -n "$ITERM_NOTIFY_IDENTITY_FILE" ]]; then
-    iterm_notify_identity_file="$ITERM_NOTIFY_IDENTITY_FILE"
-  else
-    iterm_notify_identity_file="$HOME/.iterm-notify-identity"
-  fi
-
-  if [[ -s "$iterm_notify_identity_file" ]]; then
-    iterm_notify_identity=$(head -n1 "$iterm_notify_identity_file" 2>/dev/null | sed 's/^\ *//' | sed 's/\ *$//')
-  fi
-
-  if [[ -z "$iterm_notify_identity" ]]; then
+  if ! _iterm_notify_load_identity; then
     echo "${iterm_notify_identity_file} does not exist or is empty" | log
     return 1
   fi
 
   case $cmd in
   before-command)
-    $printf "\033]1337;Custom=id=%s:%s,%s\a" "$iterm_notify_identity" "before-command" "$(echo -n "$1" | _base64)"
+    _iterm_notify_send "$printf" before-command "$1"
     ;;
   after-command)
-    $printf "\033]1337;Custom=id=%s:%s,%s\a" "$iterm_notify_identity" "after-command" "$(echo -n "$1" | _base64)"
+    _iterm_notify_send "$printf" after-command "$1"
     ;;
   config-set)
     local key
 
+    if [[ "$1" == "-" ]]; then
+      local line
+      local -a settings
+
+      # one NAME VALUE per line, all applied at once
+      while IFS= read -r line || [[ -n "$line" ]]; do
+        [[ -z "$line" ]] && continue
+        settings+=("$line")
+      done
+
+      if [[ ${#settings[@]} == 0 ]]; then
+        echo usage: echo NAME VALUE \| iterm-notify config-set - | log
+        return 1
+      fi
+
+      _iterm_notify_send "$printf" set-many "${settings[@]}"
+      return
+    fi
+
     if [[ $# -lt 2 ]]; then
       echo usage: iterm-notify config-set NAME VALUE | log
+      echo usage: iterm-notify config-set - \< FILE | log
       return 1
     fi
 
     key="$1"
     shift
 
-    # shellcheck disable=SC2046
-    $printf "\033]1337;Custom=id=%s:%s%s\a" "$iterm_notify_identity" set-"$key" \
-      $(for v in $@; do
-        echo -n ','
-        echo -n "$v" | _base64
-      done)
+    _iterm_notify_send "$printf" set-"$key" "$@"
     ;;
   send)
     local message title
@@ -94,9 +219,7 @@ iterm-notify() {
       return 1
     fi
 
-    $printf "\033]1337;Custom=id=%s:%s,%s,%s\a" "$iterm_notify_identity" "notify" \
-      "$(echo -n "$message" | _base64)" \
-      "$(echo -n "$title" | _base64)"
+    _iterm_notify_send "$printf" notify "$message" "$title"
     ;;
   *)
     echo "unknown subcommand ${cmd}" | log
@@ -119,6 +242,7 @@ _iterm_notify_after_command_hook() {
 }
 
 if [[ -n "$ZSH_VERSION" ]]; then
+  zmodload zsh/datetime 2>/dev/null
   autoload add-zsh-hook
   add-zsh-hook preexec _iterm_notify_before_command_hook
   add-zsh-hook precmd _iterm_notify_after_command_hook
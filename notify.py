@@ -1,7 +1,41 @@
 #!/usr/bin/env python3.8
 
-import iterm2
-import notify
-from notify import identity
+import time
 
-iterm2.run_forever(notify.Monitor(identity.load_from_default_path()).attach_sessions_monitor)
+started_at = time.perf_counter()
+
+import os  # noqa: E402
+import signal  # noqa: E402
+import sys  # noqa: E402
+
+import iterm2  # noqa: E402
+import notify  # noqa: E402
+from notify import identity  # noqa: E402
+from notify.timing import StartupTimer  # noqa: E402
+
+timer = StartupTimer(started_at)
+timer.mark("imports")
+
+notify.configure_logging(json_lines=os.environ.get('ITERM_NOTIFY_LOG_FORMAT') == 'json')
+
+# turn SIGTERM into a regular exit, so that atexit hooks (eg. the final flush of the sessions state) get to run
+signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+try:
+    monitor = notify.Monitor(
+        identity.load_from_default_path(),
+        journal=os.environ.get('ITERM_NOTIFY_STORAGE') == 'journal',
+        multiplex=os.environ.get('ITERM_NOTIFY_MULTIPLEX') == '1',
+        timer=timer,
+        metrics_socket=os.environ.get('ITERM_NOTIFY_METRICS_SOCKET') or None,
+        metrics_port=int(os.environ['ITERM_NOTIFY_METRICS_PORT']) if os.environ.get('ITERM_NOTIFY_METRICS_PORT')
+        else None,
+        ingest_socket=os.environ.get('ITERM_NOTIFY_SOCKET') or None,
+        record=os.environ.get('ITERM_NOTIFY_RECORD') or None,
+        overflow=os.environ.get('ITERM_NOTIFY_OVERFLOW') or 'block'
+    )
+except ValueError as e:
+    # eg. ITERM_NOTIFY_OVERFLOW or ITERM_NOTIFY_METRICS_PORT
+    sys.exit("invalid configuration: {}".format(e))
+
+iterm2.run_forever(monitor.attach_sessions_monitor)
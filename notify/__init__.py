@@ -1,175 +1,277 @@
 import asyncio
+import atexit
 import logging
-from base64 import b64decode
 from pathlib import Path
 from sys import stderr
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-import iterm2
-
-from notify import config, handlers
-from notify.backends import BackendFactory, Executor
+from notify import actors, config, ingest, logs, metrics, routing, wire
+from notify.actors import SessionActor
+from notify.backends import AsyncExecutor, BackendFactory, OsaScriptWorker, SubprocessPool
+from notify.commands import ShellClock
 from notify.config import Stack
+from notify.delivery import DeliveryQueue
 from notify.dispatcher import Dispatcher
-from notify.notifications import Factory, Notification
-from notify.strategies import StrategyFactory, iTermAppAdapter
-
-formatter = logging.Formatter('%(name)s: %(levelname)s %(message)s')
-console_handler = logging.StreamHandler(stderr)
-main_logger = logging.getLogger(__name__)
-
-console_handler.setFormatter(formatter)
-
-main_logger.addHandler(console_handler)
-main_logger.setLevel(logging.DEBUG)
+from notify.logs import lazy
+from notify.profiling import Profiler
+from notify.replay import Recorder
+from notify.sessions import LiveSession, SessionRegistry, SessionsReport
+from notify.state import SessionState, StaticServices
+from notify.strategies import App, FocusTracker, StrategyFactory, iTermAppAdapter
+from notify.timing import StartupTimer
 
+if TYPE_CHECKING:
+    import iterm2
 
-def build_dispatcher(stack: config.Stack,
-                     strategy_factory: StrategyFactory,
-                     backend_factory: BackendFactory,
-                     logger: Optional[logging.Logger] = None) -> Dispatcher:
-    success_template = Notification(
-        title=stack.success_title,
-        message=stack.success_message
-    )
-
-    failure_template = Notification(
-        title=stack.failure_title,
-        message=stack.failure_message
-    )
+main_logger = logging.getLogger(__name__)
 
-    factory = Factory(
-        stack=stack,
-    )
+LIVE_SESSIONS = metrics.REGISTRY.gauge('iterm_notify_live_sessions', 'Sessions with a live state')
+DISPATCHERS = metrics.REGISTRY.gauge('iterm_notify_dispatchers', 'Sessions with a dispatcher')
+DELIVERY_QUEUE_DEPTH = metrics.REGISTRY.gauge('iterm_notify_delivery_queue_depth', 'Notifications waiting for delivery')
 
-    command_complete_handler = handlers.NotifyCommandComplete(
-        stack=stack,
-        strategy_factory=strategy_factory,
-        notification_factory=factory,
-        backend_factory=backend_factory
-    )
+# shared by the main and the per-session loggers, replaced by configure_logging()
+console_handler: logging.Handler = logging.NullHandler()
 
-    notify_handler = handlers.Notify(stack=stack, backend_factory=backend_factory,
-                                     notification_factory=factory)
 
-    cfg_handler = handlers.MaintainConfig(
-        stack=stack,
-        logger=logger,
-        success_template=success_template,
-        failure_template=failure_template,
-    )
+def configure_logging(stream=stderr, json_lines: bool = False) -> logging.Handler:
+    global console_handler
 
-    dsp = Dispatcher(logger)
+    console_handler = logs.configure(stream, json_lines=json_lines)
 
-    dsp.register_handler("before-command", command_complete_handler.before_command)
-    dsp.register_handler("after-command", command_complete_handler.after_command)
-    dsp.register_handler("notify", notify_handler.notify)
+    main_logger.addHandler(console_handler)
+    main_logger.setLevel(logging.DEBUG)
 
-    dsp.register_handler("set-command-complete-timeout", cfg_handler.command_complete_timeout_handler)
+    return console_handler
 
-    dsp.register_handler("set-success-title", cfg_handler.success_title_handler)
-    dsp.register_handler("set-success-icon", cfg_handler.success_icon_handler)
-    dsp.register_handler("set-success-sound", cfg_handler.success_sound_handler)
 
-    dsp.register_handler("set-failure-title", cfg_handler.failure_title_handler)
-    dsp.register_handler("set-failure-icon", cfg_handler.failure_icon_handler)
-    dsp.register_handler("set-failure-sound", cfg_handler.failure_sound_handler)
+# seconds to wait for more changes before writing the sessions state file
+PERSISTENCE_COALESCE_WINDOW = 1.0
 
-    dsp.register_handler("set-notifications-backend", cfg_handler.notifications_backend_handler)
 
-    dsp.register_handler('set-logger-name', cfg_handler.logging_name_handler)
-    dsp.register_handler('set-logger-level', cfg_handler.logging_level_handler)
+def build_dispatcher(stack: config.Stack,
+                     strategy_factory: StrategyFactory,
+                     backend_factory: BackendFactory,
+                     logger: Optional[logging.Logger] = None,
+                     profiler: Optional[Profiler] = None,
+                     clock: Optional[ShellClock] = None,
+                     session_id: str = '') -> Dispatcher:
+    """Returns a dispatcher for a session whose factories are shared with others, or that only has its own."""
+    state = SessionState(session_id, stack, logger, StaticServices(strategy_factory, backend_factory),
+                         profiler=profiler, clock=clock)
 
-    return dsp
+    return routing.bind(state, tracer=profiler.trace if profiler is not None else None)
 
 
 class SessionsMonitor:
-    def __init__(self, identity: str, app: iterm2.App, conn: iterm2.Connection,
-                 config_manager: config.SessionManager):
+    def __init__(self, identity: str, app: 'iterm2.App', conn: 'iterm2.Connection',
+                 config_manager: config.SessionManager, focus: Optional[App] = None,
+                 ready: Optional[asyncio.Event] = None, recorder: Optional[Recorder] = None,
+                 inbox_size: int = actors.INBOX_SIZE, overflow: str = actors.BLOCK):
+        # checked now rather than when the first event arrives, where nothing would stop monitoring from failing
+        actors.check_policy(overflow)
+
         self.__identity = identity
+        # set once the sessions state is loaded, events received before then wait for it
+        self.__ready = ready
         self.__app = app
+        self.__focus = focus if focus is not None else iTermAppAdapter(app)
         self.__conn = conn
-        self.__dispatchers = {}
+        self.__sessions = SessionRegistry()
+        self.__monitor_tasks: Dict[str, asyncio.Task] = {}
         self.__session_manager = config_manager
-
-    def __get_session_by_id(self, session_id: str, logger: logging.Logger) -> Optional[iterm2.Session]:
+        self.__subprocesses = SubprocessPool()
+        self.__osascript_worker = OsaScriptWorker(main_logger)
+        self.__delivery = DeliveryQueue(main_logger)
+        self.__profiler = Profiler(main_logger)
+        self.__recorder = recorder
+        self.__inbox_size = inbox_size
+        self.__overflow = overflow
+        atexit.register(self.__osascript_worker.stop)
+
+        LIVE_SESSIONS.set_function(lambda: self.report().live_sessions)
+        DISPATCHERS.set_function(lambda: self.report().dispatchers)
+        DELIVERY_QUEUE_DEPTH.set_function(lambda: self.__delivery.depth)
+
+    def __get_session_by_id(self, session_id: str, logger: logging.Logger) -> Optional['iterm2.Session']:
         try:
             return self.__app.get_session_by_id(session_id)
         except:
-            logger.exception("can't retrieve session object for {}".format(session_id))
+            logger.exception("can't retrieve session object for %s", session_id)
             return None
 
+    @property
+    def event_counts(self) -> Dict[str, int]:
+        return {s.session_id: s.events for s in self.__sessions}
+
+    def report(self) -> SessionsReport:
+        return self.__sessions.report()
+
+    def terminate(self, session_id: str):
+        task = self.__monitor_tasks.pop(session_id, None)
+        # the session's own monitor stops by itself once told the session is gone
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+        self.__session_manager.delete(session_id)
+        self.__sessions.evict(session_id)
+
+    async def __wait_until_ready(self):
+        if self.__ready is not None and not self.__ready.is_set():
+            await self.__ready.wait()
+
     async def attach_escapes_monitor(self, session_id: str):
-        logger = self.__create_logger(session_id)
+        import iterm2
+
+        logger = self.__get_logger(session_id)
+        self.__monitor_tasks[session_id] = asyncio.current_task()
 
         async with iterm2.CustomControlSequenceMonitor(
                 connection=self.__conn,
                 identity=self.__identity,
-                regex=r'^([^,]+),(.+)$',
+                regex=wire.PAYLOAD_REGEX,
                 session_id=session_id
         ) as mon:
             while True:
                 try:
                     matches = await mon.async_get()
                 except asyncio.CancelledError:
-                    logger.error("got CancelledError while waiting for new Control Sequences for session_id {}".format(
-                        session_id))
+                    if session_id not in self.__monitor_tasks:
+                        # the session is gone
+                        return
+
+                    logger.error("got CancelledError while waiting for new Control Sequences for session_id %s",
+                                 session_id)
                     continue
                 except:
-                    logger.exception("can't receive new Control Sequences for session_id {}".format(session_id))
+                    logger.exception("can't receive new Control Sequences for session_id %s", session_id)
                     continue
 
-                selector = matches.group(1)
-                args = matches.group(2).split(",")
+                await self.__wait_until_ready()
 
-                args_decoded = [b64decode(s).decode('utf-8') for s in args]
+                if not await self.receive(session_id, matches.group(0)):
+                    return
 
-                args = args_decoded
+    async def attach_multiplexed_monitor(self):
+        import iterm2
 
-                session = self.__get_session_by_id(session_id, logger)
-                if not session:
-                    return
+        # one subscription for all sessions, instead of a CustomControlSequenceMonitor (and a task) per session
+        async def callback(_connection, notification):
+            if notification.sender_identity != self.__identity:
+                return
 
-                try:
-                    dsp = self.__get_or_create_dispatcher(session, logger)
-                except:
-                    logger.exception("could not create dispatcher")
-                    continue
+            await self.__wait_until_ready()
+            await self.receive(notification.session, notification.payload)
 
-                dsp.dispatch(selector, args)
+        token = await iterm2.notifications.async_subscribe_to_custom_escape_sequence_notification(
+            self.__conn, callback, None)
 
-    def __get_or_create_dispatcher(self, session: iterm2.Session, logger: logging.Logger) -> dispatcher.Dispatcher:
-        if session.session_id in self.__dispatchers:
-            return self.__dispatchers[session.session_id]
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await iterm2.notifications.async_unsubscribe(self.__conn, token)
 
-        default_config = config.create_default(session.session_id)
+    async def receive(self, session_id: str, payload: str) -> bool:
+        """Queues payload in the session's inbox; returns False when the session is gone."""
+        keep_monitoring, live_session, message = self.__route(session_id, payload)
 
-        config_stack = self.__session_manager.initialize_session_stack(session_id=session.session_id,
-                                                                       default_stack=Stack([default_config]))
+        if message is not None:
+            await self.__get_or_create_actor(live_session).submit(message)
 
-        strategy_factories = {
-            'when-inactive': strategies.WhenInactive.create_factory(iTermAppAdapter(self.__app),
-                                                                    session_id=session.session_id),
-            'when-slow': strategies.WhenSlow.create_factory()
-        }
+        return keep_monitoring
 
-        backend_factories = {
-            'iterm': backends.iTerm.create_factory(logger=logger, conn=self.__conn),
-            'osascript': backends.OsaScript.create_factory(logger=logger, executor=Executor(logger)),
-            'terminal-notifier': backends.TerminalNotifier.create_factory(logger=logger, executor=Executor(logger))
-        }
+    def __route(self, session_id: str, payload: str) -> Tuple[bool, Optional[LiveSession], Optional[wire.Message]]:
+        # looked up first: a session that's gone won't get a termination event to release its state
+        if not self.__get_session_by_id(session_id, main_logger):
+            self.terminate(session_id)
+            return False, None, None
+
+        live_session = self.__sessions.get_or_create(session_id, self.__create_logger)
+        live_session.events += 1
+        logger = live_session.logger
+
+        try:
+            message = wire.decode(payload)
+        except:
+            logger.exception("can't decode control sequence payload %r", payload)
+            return True, live_session, None
+
+        try:
+            self.__get_or_create_dispatcher(live_session)
+        except:
+            logger.exception("could not create dispatcher")
+            return True, live_session, None
+
+        return True, live_session, message
+
+    async def submit(self, session_id: str, selector: str, args: List[str]):
+        # for messages that didn't come from a terminal, session_id doesn't have to be an iTerm session
+        live_session = self.__sessions.get_or_create(session_id, self.__create_logger)
+        live_session.events += 1
+
+        self.__get_or_create_dispatcher(live_session)
+        await self.__get_or_create_actor(live_session).submit(wire.Message(selector, args))
+
+    async def drain(self):
+        """Waits until the events already in the sessions' inboxes are handled."""
+        for s in self.__sessions:
+            if s.actor is not None:
+                await s.actor.drain()
+
+    @property
+    def inbox_depths(self) -> Dict[str, int]:
+        return {s.session_id: s.actor.depth for s in self.__sessions if s.actor is not None}
 
-        dsp = build_dispatcher(stack=config_stack,
-                               strategy_factory=StrategyFactory(strategy_factories),
-                               backend_factory=BackendFactory(backend_factories),
-                               logger=logger)
+    def __get_or_create_actor(self, live_session: LiveSession) -> SessionActor:
+        if live_session.actor is None:
+            live_session.actor = SessionActor(live_session.session_id, live_session.dispatcher,
+                                              size=self.__inbox_size, overflow=self.__overflow,
+                                              logger=live_session.logger)
 
-        self.__dispatchers[session.session_id] = dsp
+        return live_session.actor
+
+    def __get_or_create_dispatcher(self, live_session: LiveSession) -> Dispatcher:
+        if live_session.dispatcher is not None:
+            return live_session.dispatcher
+
+        session_id = live_session.session_id
+
+        config_stack = self.__session_manager.initialize_session_stack(
+            session_id=session_id, default_stack=Stack([config.create_default(session_id)]))
+
+        # the handlers are shared: a session only gets a state, the rest is created by the first event that needs it
+        state = SessionState(session_id, config_stack, live_session.logger, self, profiler=self.__profiler)
+        dsp = routing.bind(state, tracer=self.__profiler.trace)
+
+        if self.__recorder is not None:
+            dsp.on_dispatch += self.__recorder.for_session(session_id)
+
+        live_session.stack = config_stack
+        live_session.dispatcher = dsp
 
         return dsp
 
+    def create_strategy_factory(self, state: SessionState) -> StrategyFactory:
+        return StrategyFactory({
+            'when-inactive': strategies.WhenInactive.create_factory(self.__focus, session_id=state.session_id),
+            'when-slow': strategies.WhenSlow.create_factory()
+        })
+
+    def create_backend_factory(self, state: SessionState) -> BackendFactory:
+        logger = state.logger
+        executor = AsyncExecutor(logger, self.__subprocesses)
+
+        return BackendFactory(self.__delivery.wrap({
+            'iterm': backends.iTerm.create_factory(logger=logger, conn=self.__conn),
+            'osascript': backends.OsaScript.create_factory(logger=logger, executor=executor,
+                                                           worker=self.__osascript_worker),
+            'terminal-notifier': backends.TerminalNotifier.create_factory(logger=logger, executor=executor)
+        }))
+
+    def __get_logger(self, session_id: str) -> logging.Logger:
+        return self.__sessions.get_or_create(session_id, self.__create_logger).logger
+
     @staticmethod
-    def __create_logger(session_id: str):
+    def __create_logger(session_id: str) -> logging.Logger:
         logger = logging.getLogger(session_id)
         logger.addHandler(console_handler)
         logger.propagate = False
@@ -178,20 +280,58 @@ class SessionsMonitor:
 
 
 class Monitor:
-    def __init__(self, identity: str):
+    def __init__(self, identity: str, journal: bool = False, multiplex: bool = False,
+                 timer: Optional[StartupTimer] = None, metrics_socket: Optional[str] = None,
+                 metrics_port: Optional[int] = None, ingest_socket: Optional[str] = None,
+                 record: Optional[str] = None, overflow: str = actors.BLOCK):
+        actors.check_policy(overflow)
+
         self.__identity = identity
+        self.__journal = journal
+        self.__multiplex = multiplex
+        self.__timer = timer if timer is not None else StartupTimer()
+        self.__metrics_socket = metrics_socket
+        self.__metrics_port = metrics_port
+        self.__ingest_socket = ingest_socket
+        self.__record = record
+        self.__overflow = overflow
 
     async def attach_sessions_monitor(self, connection):
-        fs = config.FileStorage(
-            Path.home().joinpath('.iterm-notify-temp.json'),
-            logger=main_logger
-        )
+        import iterm2
+
+        timer = self.__timer
 
-        config_manager = config.SessionManager(fs, logger=main_logger)
+        if self.__journal:
+            fs = config.JournalStorage(
+                Path.home().joinpath('.iterm-notify-journal.jsonl'),
+                logger=main_logger
+            )
+        else:
+            fs = config.FileStorage(
+                Path.home().joinpath('.iterm-notify-temp.json'),
+                logger=main_logger
+            )
+
+        config_manager = config.SessionManager(fs, logger=main_logger, coalesce_window=PERSISTENCE_COALESCE_WINDOW)
+        atexit.register(config_manager.close)
 
         app = await iterm2.async_get_app(connection)
+        timer.mark("get app")
+
+        focus_tracker = FocusTracker(iTermAppAdapter(app))
 
-        config_manager.load_and_prune(list_existing_session_ids(app=app))
+        # monitors are attached before the sessions state is loaded, so that no event is missed while it loads: the
+        # events received in the meantime are handled as soon as it's ready
+        ready = asyncio.Event()
+        recorder = None
+        if self.__record is not None:
+            recorder = Recorder(self.__record)
+            atexit.register(recorder.close)
+            main_logger.info("recording events to %s", self.__record)
+
+        sessions_monitor = SessionsMonitor(self.__identity, app, connection, config_manager=config_manager,
+                                           focus=focus_tracker, ready=ready, recorder=recorder,
+                                           overflow=self.__overflow)
 
         # FIXME the following task does nothing of value, except it seems to mitigate a race condition that causes one
         # or two commands from the user's shell init file to be missed when creating new windows (but not tabs or
@@ -200,7 +340,7 @@ class Monitor:
             async with iterm2.CustomControlSequenceMonitor(
                     connection,
                     identity=self.__identity,
-                    regex=r'^([^,]+),(.+)$') as mon:
+                    regex=wire.PAYLOAD_REGEX) as mon:
                 while True:
                     await mon.async_get()
 
@@ -213,19 +353,55 @@ class Monitor:
                         main_logger.exception("could not get a closed session")
                         continue
 
-                    config_manager.delete(session_id)
-                    main_logger.debug("session deleted: {}".format(session_id))
+                    sessions_monitor.terminate(session_id)
+                    main_logger.debug("session deleted: %s", session_id)
+                    main_logger.debug("%s", lazy(sessions_monitor.report))
+
+        async def track_focus():
+            try:
+                async with iterm2.FocusMonitor(connection) as mon:
+                    await focus_tracker.track(mon)
+            except:
+                main_logger.exception("can't track focus changes, falling back to scanning windows")
 
-        asyncio.create_task(fallback())
         asyncio.create_task(on_session_termination())
+        asyncio.create_task(track_focus())
+
+        if self.__multiplex:
+            sessions_task = asyncio.create_task(sessions_monitor.attach_multiplexed_monitor())
+        else:
+            asyncio.create_task(fallback())
+            sessions_task = asyncio.create_task(iterm2.EachSessionOnceMonitor.async_foreach_session_create_task(
+                app,
+                sessions_monitor.attach_escapes_monitor
+            ))
+
+        # let the monitors send their subscriptions before loading
+        await asyncio.sleep(0)
+        timer.mark("attach monitors")
+
+        if self.__metrics_socket is not None or self.__metrics_port is not None:
+            try:
+                await metrics.serve(path=self.__metrics_socket, port=self.__metrics_port)
+            except OSError:
+                main_logger.exception("can't serve metrics")
+
+        await config_manager.async_load_and_prune(list_existing_session_ids(app=app))
+        ready.set()
+        timer.mark("load state")
+
+        if self.__ingest_socket is not None:
+            try:
+                await ingest.serve(self.__ingest_socket, self.__identity, sessions_monitor.submit, logger=main_logger)
+            except OSError:
+                main_logger.exception("can't accept control sequences on %s", self.__ingest_socket)
+
+        main_logger.info("%s", timer, extra={'startup': dict(timer.phases)})
 
-        await iterm2.EachSessionOnceMonitor.async_foreach_session_create_task(
-            app,
-            SessionsMonitor(self.__identity, app, connection, config_manager=config_manager).attach_escapes_monitor
-        )
+        await sessions_task
 
 
-def list_existing_session_ids(app: iterm2.App):
+def list_existing_session_ids(app: 'iterm2.App'):
     existing_sessions: List[str] = []
 
     for window in app.windows:
@@ -0,0 +1,198 @@
+"""
+Every session gets an inbox of events, dispatched in order by a task of its own: sessions don't wait for each other
+while a handler awaits, and a session that sends events faster than they're handled fills its own inbox only.
+
+When an inbox is full, what happens to a new event depends on the overflow policy:
+
+- block: the sender waits for room in the inbox
+- drop-oldest-config: the oldest configuration (set-) event in the inbox is dropped to make room
+- coalesce: a configuration event replaces a queued one with the same selector, if no other kind of event is queued
+  after it (so that it still applies to the same command)
+
+When there's no configuration event to drop or coalesce, the last two also block. A sender that waits holds up whatever
+else it would send: with one monitor per session that's only the events of the same session, but the multiplexed
+monitor receives the events of all sessions in a single callback, so there a session whose inbox stays full delays
+everyone's events until it has room again. drop-oldest-config and coalesce make that less likely.
+
+Control events like set-profiling are set- events too, but they're never dropped or coalesced.
+
+A closed actor (its session is gone) still handles the events already in its inbox, then stops.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from notify.dispatcher import Dispatcher
+from notify.metrics import REGISTRY
+from notify.wire import Message
+
+BLOCK = 'block'
+DROP_OLDEST_CONFIG = 'drop-oldest-config'
+COALESCE = 'coalesce'
+
+POLICIES = (BLOCK, DROP_OLDEST_CONFIG, COALESCE)
+
+INBOX_SIZE = 100
+
+# set- selectors that don't change the configuration, and must be handled whatever the policy
+CONTROL_SELECTORS = frozenset(['set-profiling'])
+
+INBOX_DEPTH = REGISTRY.gauge('iterm_notify_inbox_depth', 'Events waiting in a session inbox', ['session'])
+INBOX_SECONDS = REGISTRY.histogram('iterm_notify_inbox_seconds',
+                                   'Time an event waits in a session inbox before being handled', ['session'])
+SESSION_HANDLER_SECONDS = REGISTRY.histogram('iterm_notify_session_handler_seconds',
+                                             'Time spent handling the events of a session', ['session'])
+INBOX_OVERFLOWS = REGISTRY.counter('iterm_notify_inbox_overflows_total',
+                                   'Events dropped or coalesced because an inbox was full', ['policy'])
+
+
+def check_policy(overflow: str):
+    if overflow not in POLICIES:
+        raise ValueError("unknown overflow policy: {}, expected one of {}".format(overflow, ", ".join(POLICIES)))
+
+
+def is_config(selector: str) -> bool:
+    return selector.startswith('set-') and selector not in CONTROL_SELECTORS
+
+
+class SessionActor:
+    def __init__(self, session_id: str, dispatcher: Dispatcher, size: int = INBOX_SIZE, overflow: str = BLOCK,
+                 logger: Optional[logging.Logger] = None):
+        check_policy(overflow)
+
+        self.__session_id = session_id
+        self.__dispatcher = dispatcher
+        self.__size = size
+        self.__overflow = overflow
+        self.__logger = logger
+        self.__inbox: Deque[Tuple[Message, float]] = deque()
+        self.__received = asyncio.Event()
+        self.__room = asyncio.Event()
+        self.__idle = asyncio.Event()
+        self.__idle.set()
+        self.__task: Optional[asyncio.Task] = None
+        self.__closing = False
+        self.handled = 0
+        self.overflows = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.__inbox)
+
+    async def submit(self, message: Message):
+        """Queues message, waiting for room in the inbox if needed."""
+        if self.__closing:
+            self.__logger and self.__logger.warning("session closed, dropped %s", message.selector,
+                                                    extra={'selector': message.selector})
+            return
+
+        while len(self.__inbox) >= self.__size and not self.__make_room(message):
+            self.__room.clear()
+            await self.__room.wait()
+
+        self.__inbox.append((message, time.perf_counter()))
+        self.__queued()
+
+    async def drain(self):
+        """Waits until every event submitted so far is handled."""
+        while self.__inbox or not self.__idle.is_set():
+            await self.__idle.wait()
+
+    def close(self):
+        """Stops once the events already in the inbox are handled, right away if there are none."""
+        self.__closing = True
+
+        if self.__task is None or (not self.__inbox and self.__idle.is_set()):
+            self.__stop()
+
+    def __stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+        if self.__inbox:
+            self.__logger and self.__logger.warning("session closed, dropped %d queued events", len(self.__inbox))
+            self.__inbox.clear()
+
+        self.__idle.set()
+        INBOX_DEPTH.remove(self.__session_id)
+        INBOX_SECONDS.remove(self.__session_id)
+        SESSION_HANDLER_SECONDS.remove(self.__session_id)
+
+    def __queued(self):
+        INBOX_DEPTH.set(len(self.__inbox), self.__session_id)
+        self.__idle.clear()
+        self.__received.set()
+
+        if self.__task is None:
+            self.__task = asyncio.get_event_loop().create_task(self.__run())
+
+    def __make_room(self, message: Message) -> bool:
+        if not is_config(message.selector) or self.__overflow == BLOCK:
+            return False
+
+        if self.__overflow == DROP_OLDEST_CONFIG:
+            victim = next((i for i, (m, _) in enumerate(self.__inbox) if is_config(m.selector)), None)
+        else:
+            victim = None
+            for i in range(len(self.__inbox) - 1, -1, -1):
+                queued = self.__inbox[i][0]
+                if not is_config(queued.selector):
+                    break
+                if queued.selector == message.selector:
+                    victim = i
+                    break
+
+        if victim is None:
+            return False
+
+        dropped = self.__inbox[victim][0]
+        del self.__inbox[victim]
+
+        self.overflows += 1
+        INBOX_OVERFLOWS.inc(self.__overflow)
+        self.__logger and self.__logger.warning("inbox full, %s %s", "coalesced" if self.__overflow == COALESCE
+                                                else "dropped", dropped.selector, extra={'selector': dropped.selector})
+
+        return True
+
+    async def __run(self):
+        try:
+            while True:
+                if not self.__inbox:
+                    self.__idle.set()
+
+                    if self.__closing:
+                        self.__task = None
+                        self.__stop()
+                        return
+
+                    self.__received.clear()
+                    await self.__received.wait()
+                    continue
+
+                message, queued_at = self.__inbox.popleft()
+                INBOX_DEPTH.set(len(self.__inbox), self.__session_id)
+                self.__room.set()
+
+                started_at = time.perf_counter()
+                INBOX_SECONDS.observe(started_at - queued_at, self.__session_id)
+
+                try:
+                    await self.__dispatcher.dispatch_async(message.selector, message.args, sent_at=message.sent_at)
+                except Exception:
+                    # whatever happens to an event, the next ones are still handled
+                    self.__logger and self.__logger.exception("can't dispatch %s", message.selector)
+
+                self.handled += 1
+                SESSION_HANDLER_SECONDS.observe(time.perf_counter() - started_at, self.__session_id)
+
+                # let other sessions' tasks (and the monitors) run between events
+                await asyncio.sleep(0)
+        finally:
+            # if this task ends anyway, the next event starts another one
+            if self.__task is asyncio.current_task():
+                self.__task = None
@@ -1,26 +1,112 @@
 import asyncio
+import atexit
+import json
 import logging
+import os
 import shlex
 import subprocess
+import time
 from abc import ABC, abstractmethod
-from tempfile import NamedTemporaryFile
-from typing import Dict, List, Protocol
-
-import iterm2
+from tempfile import mkstemp
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Protocol, Set
 
+from notify.cache import LRUCache
 from notify.config import SelectedBackend
+from notify.logs import lazy
+from notify.metrics import REGISTRY
 from notify.notifications import Notification
 
+if TYPE_CHECKING:
+    import iterm2
+
+NOTIFICATIONS = REGISTRY.counter('iterm_notify_notifications_total', 'Notifications handed to a backend', ['backend'])
+DELIVERY_FAILURES = REGISTRY.counter('iterm_notify_delivery_failures_total',
+                                     'Notifications a backend failed to deliver', ['backend'])
+DELIVERY_SECONDS = REGISTRY.histogram('iterm_notify_delivery_seconds',
+                                      'Time from handing a notification to a backend to its delivery', ['backend'])
+
 
 class Executor:
     def __init__(self, logger: logging.Logger):
         self.__logger = logger
 
     def execute(self, cmd: list):
-        self.__logger.info(f"executing {shlex.join(cmd)}")
+        self.__logger.info("executing %s", lazy(shlex.join, cmd))
         subprocess.run(cmd, stdin=None, capture_output=False, check=True, timeout=5)
 
 
+class SubprocessPool:
+    def __init__(self, max_concurrency: int = 4, timeout: float = 5):
+        self.__max_concurrency = max_concurrency
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+        self.__tasks: Set[asyncio.Task] = set()
+        self.timeout = timeout
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, so that it's bound to the loop the subprocesses will actually run on
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.__max_concurrency)
+        return self.__semaphore
+
+    @property
+    def pending(self) -> int:
+        return len(self.__tasks)
+
+    def track(self, task: asyncio.Task):
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    def cancel(self):
+        for t in list(self.__tasks):
+            t.cancel()
+
+
+class AsyncExecutor(Executor):
+    def __init__(self, logger: logging.Logger, pool: SubprocessPool):
+        super().__init__(logger)
+        self.__logger = logger
+        self.__pool = pool
+
+    def execute(self, cmd: list) -> asyncio.Task:
+        task = asyncio.get_event_loop().create_task(self.run(cmd))
+        self.__pool.track(task)
+        task.add_done_callback(lambda t: self.__report(cmd, t))
+        return task
+
+    async def run(self, cmd: list) -> int:
+        async with self.__pool.semaphore:
+            self.__logger.info("executing %s", lazy(shlex.join, cmd))
+            proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL)
+
+            try:
+                return_code = await asyncio.wait_for(proc.wait(), timeout=self.__pool.timeout)
+            except BaseException:
+                # timed out or cancelled: don't leave the process behind
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                raise
+
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, cmd)
+
+        return return_code
+
+    def __report(self, cmd: list, task: asyncio.Task):
+        if task.cancelled():
+            self.__logger.warning("cancelled %s", lazy(shlex.join, cmd))
+            return
+
+        exc = task.exception()
+        if isinstance(exc, asyncio.TimeoutError):
+            self.__logger.error("timed out after %ss: %s", self.__pool.timeout, lazy(shlex.join, cmd))
+        elif exc is not None:
+            self.__logger.error("failed executing %s", lazy(shlex.join, cmd), exc_info=exc)
+        else:
+            self.__logger.info("done executing %s", lazy(shlex.join, cmd))
+
+
 class Backend(ABC):
     @abstractmethod
     def notify(self, n: Notification): ...
@@ -39,8 +125,13 @@ class BackendInitializer(Protocol):
 
 
 class BackendFactory:
-    def __init__(self, initializers: Dict[str, BackendInitializer]):
+    def __init__(self, initializers: Dict[str, BackendInitializer], cache_size: int = 4):
         self.__initializers = initializers
+        self.__cache: LRUCache[Backend] = LRUCache(cache_size)
+
+    @property
+    def cache(self) -> LRUCache[Backend]:
+        return self.__cache
 
     def create(self, selected_backend: SelectedBackend) -> Backend:
         if not isinstance(selected_backend, SelectedBackend):
@@ -52,11 +143,21 @@ class BackendFactory:
         except TypeError as e:
             raise e
 
-        return self.__initializers[selected_backend.name](*selected_backend.args)
+        return self.__cache.get_or_create(
+            _cache_key(selected_backend),
+            lambda: self.__initializers[selected_backend.name](*selected_backend.args)
+        )
+
+    def invalidate(self, selected_backend: Optional[SelectedBackend] = None):
+        self.__cache.invalidate(_cache_key(selected_backend) if selected_backend is not None else None)
+
+
+def _cache_key(selected_backend: SelectedBackend) -> tuple:
+    return selected_backend.name, tuple(selected_backend.args)
 
 
 class iTerm(Backend):
-    def __init__(self, logger: logging.Logger, conn: iterm2.Connection):
+    def __init__(self, logger: logging.Logger, conn: 'iterm2.Connection'):
         self.__logger = logger
         self.__conn = conn
 
@@ -69,16 +170,18 @@ class iTerm(Backend):
         return []
 
     @classmethod
-    def create_factory(cls, logger: logging.Logger, conn: iterm2.Connection) -> BackendInitializer:
+    def create_factory(cls, logger: logging.Logger, conn: 'iterm2.Connection') -> BackendInitializer:
         def create_iterm(*args):
             return cls(logger=logger, conn=conn)
 
         return create_iterm
 
     def notify(self, n: Notification):
+        import iterm2
+
         alert = iterm2.Alert(n.title, n.message)
-        self.__logger and self.__logger.info("sending notification: {}".format(n))
-        asyncio.get_event_loop().create_task(alert.async_run(self.__conn))
+        self.__logger and self.__logger.info("sending notification: %s", n, extra={'backend': self.name})
+        _track_delivery(self.name, lambda: asyncio.get_event_loop().create_task(alert.async_run(self.__conn)))
 
 
 class OsaScript(Backend):
@@ -93,9 +196,10 @@ class OsaScript(Backend):
               "  end tell\n" \
               "end run"
 
-    def __init__(self, logger: logging.Logger, executor: Executor):
+    def __init__(self, logger: logging.Logger, executor: Executor, worker: Optional['OsaScriptWorker'] = None):
         self.__executor = executor
         self.__logger = logger
+        self.__worker = worker
 
     @property
     def name(self) -> str:
@@ -103,30 +207,151 @@ class OsaScript(Backend):
 
     @property
     def args(self) -> List[str]:
-        return []
+        return ['worker'] if self.__worker is not None else []
 
     @classmethod
-    def create_factory(cls, logger: logging.Logger, executor: Executor) -> BackendInitializer:
+    def create_factory(cls, logger: logging.Logger, executor: Executor,
+                       worker: Optional['OsaScriptWorker'] = None) -> BackendInitializer:
         def create_osascript(*args):
-            return cls(logger=logger, executor=executor)
+            return cls(logger=logger, executor=executor, worker=worker if 'worker' in args else None)
 
         return create_osascript
 
+    @classmethod
+    def script_path(cls) -> str:
+        return _script_file(cls._SCRIPT, suffix='.applescript')
+
     def notify(self, n: Notification):
-        with NamedTemporaryFile(mode='w') as tmp_file:
-            tmp_file.write(self._SCRIPT)
-            tmp_file.flush()
+        self.__logger and self.__logger.info("sending notification: %s", n, extra={'backend': self.name})
+
+        if self.__worker is not None:
+            _track_delivery(self.name, lambda: self.__worker.send(n))
+            return
+
+        cmd = [
+            'osascript',
+            self.script_path(),
+            n.message,
+            n.title,
+            "" if n.sound is None else n.sound
+        ]
+
+        _track_delivery(self.name, lambda: self.__executor.execute(cmd))
+
+
+class OsaScriptWorker:
+    # JXA rather than AppleScript, as it can read newline-delimited JSON records from stdin in a loop
+    _SCRIPT = "ObjC.import('Foundation');\n" \
+              "\n" \
+              "function run() {\n" \
+              "  var app = Application('iTerm');\n" \
+              "  app.includeStandardAdditions = true;\n" \
+              "\n" \
+              "  var stdin = $.NSFileHandle.fileHandleWithStandardInput;\n" \
+              "  var pending = $.NSMutableData.data;\n" \
+              "\n" \
+              "  for (;;) {\n" \
+              "    var data = stdin.availableData;\n" \
+              "    if (data.length === 0) {\n" \
+              "      return;\n" \
+              "    }\n" \
+              "\n" \
+              "    pending.appendData(data);\n" \
+              "\n" \
+              "    var text = $.NSString.alloc.initWithDataEncoding(pending, $.NSUTF8StringEncoding);\n" \
+              "    if (text.isNil()) {\n" \
+              "      continue; // a multi-byte character was split across reads\n" \
+              "    }\n" \
+              "\n" \
+              "    var lines = text.js.split('\\n');\n" \
+              "    var rest = $(lines.pop()).dataUsingEncoding($.NSUTF8StringEncoding);\n" \
+              "    pending = $.NSMutableData.dataWithData(rest);\n" \
+              "\n" \
+              "    lines.forEach(function (line) {\n" \
+              "      if (line === '') {\n" \
+              "        return;\n" \
+              "      }\n" \
+              "\n" \
+              "      var n = JSON.parse(line);\n" \
+              "      var options = {withTitle: n.title};\n" \
+              "      if (n.sound) {\n" \
+              "        options.soundName = n.sound;\n" \
+              "      }\n" \
+              "\n" \
+              "      app.displayNotification(n.message, options);\n" \
+              "    });\n" \
+              "  }\n" \
+              "}\n"
+
+    def __init__(self, logger: logging.Logger, argv: Optional[List[str]] = None):
+        self.__logger = logger
+        self.__argv = argv
+        self.__proc: Optional[subprocess.Popen] = None
+        self.restarts = 0
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.__proc.pid if self.__proc is not None else None
+
+    def send(self, n: Notification):
+        record = json.dumps({'title': n.title, 'message': n.message, 'sound': n.sound}).encode('utf-8') + b'\n'
+
+        for _ in range(2):
+            proc = self.__ensure_running()
+            try:
+                proc.stdin.write(record)
+                proc.stdin.flush()
+                return
+            except OSError:
+                self.__logger.warning("osascript worker is gone, restarting it")
+                self.__kill()
+                self.restarts += 1
+
+        raise RuntimeError("could not deliver notification to the osascript worker")
+
+    def stop(self, timeout: float = 5):
+        if self.__proc is None:
+            return
+
+        try:
+            self.__proc.stdin.close()
+            self.__proc.wait(timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.__kill()
+
+        self.__proc = None
 
-            cmd = [
-                'osascript',
-                tmp_file.name,
-                n.message,
-                n.title,
-                "" if n.sound is None else n.sound
-            ]
+    def __ensure_running(self) -> subprocess.Popen:
+        if self.__proc is not None and self.__proc.poll() is None:
+            return self.__proc
 
-            self.__logger and self.__logger.info("sending notification: {}".format(n))
-            self.__executor.execute(cmd)
+        if self.__proc is not None:
+            self.restarts += 1
+            self.__logger.warning("osascript worker exited with %s, restarting it", self.__proc.returncode)
+            self.__kill()
+
+        argv = self.__argv
+        if argv is None:
+            argv = ['osascript', '-l', 'JavaScript', _script_file(self._SCRIPT, suffix='.js')]
+
+        self.__logger.info("starting %s", lazy(shlex.join, argv))
+        self.__proc = subprocess.Popen(argv, stdin=subprocess.PIPE)
+        return self.__proc
+
+    def __kill(self):
+        if self.__proc is None:
+            return
+
+        if self.__proc.poll() is None:
+            self.__proc.kill()
+            self.__proc.wait()
+
+        try:
+            self.__proc.stdin.close()
+        except OSError:
+            pass
+
+        self.__proc = None
 
 
 class TerminalNotifier(Backend):
@@ -169,5 +394,81 @@ class TerminalNotifier(Backend):
             cmd.append('-sound')
             cmd.append(n.sound)
 
-        self.__logger and self.__logger.info("sending notification: {}".format(n))
-        self.__executor.execute(cmd)
+        self.__logger and self.__logger.info("sending notification: %s", n, extra={'backend': self.name})
+        _track_delivery(self.name, lambda: self.__executor.execute(cmd))
+
+
+class Log(Backend):
+    """Only logs notifications, for when there's nothing to show them with (eg. running headless)."""
+
+    def __init__(self, logger: logging.Logger):
+        self.__logger = logger
+
+    @property
+    def name(self) -> str:
+        return 'log'
+
+    @property
+    def args(self) -> List[str]:
+        return []
+
+    @classmethod
+    def create_factory(cls, logger: logging.Logger) -> BackendInitializer:
+        def create_log(*args):
+            return cls(logger=logger)
+
+        return create_log
+
+    def notify(self, n: Notification):
+        _track_delivery(self.name, lambda: self.__logger.info(
+            "notification: %s", n, extra={'backend': self.name, 'title': n.title, 'body': n.message}))
+
+
+def _track_delivery(backend: str, deliver: Callable[[], Optional[asyncio.Future]]):
+    # deliver() either delivers right away, or returns a future that's done when the notification is delivered
+    started = time.perf_counter()
+    NOTIFICATIONS.inc(backend)
+
+    try:
+        result = deliver()
+    except BaseException:
+        DELIVERY_FAILURES.inc(backend)
+        raise
+
+    if not isinstance(result, asyncio.Future):
+        DELIVERY_SECONDS.observe(time.perf_counter() - started, backend)
+        return
+
+    def done(f: asyncio.Future):
+        if f.cancelled() or f.exception() is not None:
+            DELIVERY_FAILURES.inc(backend)
+        else:
+            DELIVERY_SECONDS.observe(time.perf_counter() - started, backend)
+
+    result.add_done_callback(done)
+
+
+_scripts: Dict[str, str] = {}
+
+
+def _script_file(source: str, suffix: str) -> str:
+    # written once per process rather than per notification; it must also outlive notify() as the executor may
+    # run osascript in the background
+    path = _scripts.get(source)
+
+    if path is None or not os.path.exists(path):
+        fd, path = mkstemp(prefix='iterm-notify-', suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write(source)
+
+        atexit.register(_unlink_quietly, path)
+        _scripts[source] = path
+
+    return path
+
+
+def _unlink_quietly(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
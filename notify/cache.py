@@ -0,0 +1,39 @@
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class LRUCache(Generic[T]):
+    def __init__(self, max_size: int):
+        self.__max_size = max_size
+        self.__items: 'OrderedDict[Hashable, T]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], T]) -> T:
+        try:
+            item = self.__items[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.__items.move_to_end(key)
+            return item
+
+        item = create()
+        self.__items[key] = item
+
+        if len(self.__items) > self.__max_size:
+            self.__items.popitem(last=False)
+
+        return item
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        if key is None:
+            self.__items.clear()
+        else:
+            self.__items.pop(key, None)
@@ -1,5 +1,10 @@
+import logging
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+# seconds between the shell's and the daemon's clocks above which a warning is logged
+MAX_CLOCK_SKEW = 2.0
 
 
 @dataclass(frozen=True)
@@ -20,3 +25,52 @@ class CompleteCommand:
     @property
     def successful(self) -> bool:
         return self.exit_code == 0
+
+
+class ShellClock:
+    """
+    Timestamps commands with the time the shell sent the control sequence, when the shell sends one, so durations don't
+    depend on how long the daemon took to get to the event. The offset between the two clocks is estimated as the
+    smallest (received - sent) seen: it is used for events sent without a timestamp, and to warn about hosts whose
+    clock is off.
+    """
+
+    def __init__(self, logger: Optional[logging.Logger] = None,
+                 max_skew: float = MAX_CLOCK_SKEW,
+                 now: Callable[[], datetime] = datetime.now):
+        self.__logger = logger
+        self.__max_skew = max_skew
+        self.__now = now
+        self.__offset: Optional[float] = None
+        self.__warned = False
+
+    @property
+    def offset(self) -> Optional[float]:
+        return self.__offset
+
+    def timestamp(self, sent_at: Optional[float] = None) -> datetime:
+        received = self.__now()
+
+        if sent_at is None:
+            if self.__offset is None:
+                return received
+
+            return received - timedelta(seconds=self.__offset)
+
+        sent = datetime.fromtimestamp(sent_at)
+        delay = (received - sent).total_seconds()
+
+        if self.__offset is None or delay < self.__offset:
+            self.__offset = delay
+            self.__check_skew()
+
+        return sent
+
+    def __check_skew(self):
+        if self.__warned or abs(self.__offset) <= self.__max_skew:
+            return
+
+        self.__warned = True
+        self.__logger and self.__logger.warning(
+            "the shell's clock is %.1fs %s this machine's, command start times will be off",
+            abs(self.__offset), "behind" if self.__offset > 0 else "ahead of", extra={'clock_offset': self.__offset})
@@ -1,10 +1,20 @@
+import asyncio
 import json
 import logging
+import os
+import threading
 import typing
-from copy import copy
+from contextlib import contextmanager
 from dataclasses import dataclass, field, replace
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from tempfile import mkstemp
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from notify.metrics import REGISTRY
+
+STORAGE_WRITES = REGISTRY.counter('iterm_notify_storage_writes_total', 'Writes of the sessions state', ['storage'])
+STORAGE_BYTES = REGISTRY.counter('iterm_notify_storage_written_bytes_total', 'Bytes of sessions state written',
+                                 ['storage'])
 
 
 @dataclass(frozen=True)
@@ -51,9 +61,9 @@ class EventHandlers:
         self.__handlers.remove(other)
         return self
 
-    def dispatch(self):
+    def dispatch(self, *args):
         for h in self.__handlers:
-            h()
+            h(*args)
 
 
 @dataclass(frozen=True)
@@ -72,20 +82,7 @@ class Config:
     failure_sound: Optional[str] = None
 
     def to_dict(self) -> dict:
-        return {
-            'logger-name': self.logger_name,
-            'logger-level': self.logger_level,
-            'notifications-strategy': self.notifications_strategy.to_dict(),
-            'notifications-backend': self.notifications_backend.to_dict(),
-            'success-title': self.success_title,
-            'success-message': self.success_message,
-            'success-icon': self.success_icon,
-            'success-sound': self.success_sound,
-            'failure-title': self.failure_title,
-            'failure-message': self.failure_message,
-            'failure-icon': self.failure_icon,
-            'failure-sound': self.failure_sound,
-        }
+        return overrides_to_dict({name: getattr(self, name) for name in _CONFIG_KEYS})
 
     @classmethod
     def from_dict(cls, data: dict) -> 'Config':
@@ -108,6 +105,49 @@ class Config:
         self.__dict__.update(other)
 
 
+_CONFIG_KEYS = {
+    'logger_name': 'logger-name',
+    'logger_level': 'logger-level',
+    'notifications_strategy': 'notifications-strategy',
+    'notifications_backend': 'notifications-backend',
+    'success_title': 'success-title',
+    'success_message': 'success-message',
+    'success_icon': 'success-icon',
+    'success_sound': 'success-sound',
+    'failure_title': 'failure-title',
+    'failure_message': 'failure-message',
+    'failure_icon': 'failure-icon',
+    'failure_sound': 'failure-sound',
+}
+
+_CONFIG_FIELDS = {key: name for name, key in _CONFIG_KEYS.items()}
+
+
+def overrides_to_dict(overrides: Dict[str, Any]) -> dict:
+    data = {}
+
+    for name, v in overrides.items():
+        if isinstance(v, (SelectedBackend, SelectedStrategy)):
+            v = v.to_dict()
+        data[_CONFIG_KEYS[name]] = v
+
+    return data
+
+
+def overrides_from_dict(data: dict) -> Dict[str, Any]:
+    overrides = {}
+
+    for key, v in data.items():
+        name = _CONFIG_FIELDS[key]
+        if name == 'notifications_backend':
+            v = SelectedBackend.from_dict(v)
+        elif name == 'notifications_strategy':
+            v = SelectedStrategy.from_dict(v)
+        overrides[name] = v
+
+    return overrides
+
+
 def create_default(logger_name: str) -> Config:
     return Config(
         notifications_backend=SelectedBackend(name="osascript"),
@@ -122,53 +162,138 @@ def create_default(logger_name: str) -> Config:
 
 
 class Stack:
+    # pushed frames only store the fields they override, the resolved Config of each level is built lazily and cached
     def __init__(self, data: List[Config]):
-        self.__data: List[Config] = data
+        self.__base: Config = data[0]
+        self.__frames: List[Dict[str, Any]] = []
+        self.__resolved: List[Optional[Config]] = [self.__base]
+
+        for c in data[1:]:
+            self.__frames.append(_overrides(c, self.__resolved[-1]))
+            self.__resolved.append(c)
+
         self.on_push = EventHandlers()
         self.on_pop = EventHandlers()
         self.on_change = EventHandlers()
 
+        self.__batch_depth = 0
+        self.__batch_changed = False
+
     @property
     def current(self) -> Config:
-        return self.__data[len(self.__data) - 1]
+        return self.__resolve(len(self.__resolved) - 1)
 
     @current.setter
     def current(self, v: Config):
-        self.__data[len(self.__data) - 1] = v
-        self.on_change.dispatch()
+        if v == self.current:
+            return
+
+        if not self.__frames:
+            self.__base = v
+        else:
+            self.__frames[-1] = _overrides(v, self.__resolve(len(self.__resolved) - 2))
+
+        self.__resolved[-1] = v
+        self.__changed()
+
+    @property
+    def depth(self) -> int:
+        return len(self.__resolved)
 
     @classmethod
     def from_dict(cls, data: List[dict]) -> 'Stack':
-        lst = []
-        for d in data:
-            lst.append(Config.from_dict(d))
+        stack = Stack([Config.from_dict(data[0])])
 
-        return Stack(lst)
+        for d in data[1:]:
+            parent = stack.current
+            stack.__frames.append(_overrides(replace(parent, **overrides_from_dict(d)), parent))
+            stack.__resolved.append(None)
+
+        return stack
 
     def to_dict(self) -> List[dict]:
-        return [c.to_dict() for c in self.__data]
+        return [self.__base.to_dict()] + [overrides_to_dict(f) for f in self.__frames]
+
+    def top_to_dict(self) -> dict:
+        if not self.__frames:
+            return self.__base.to_dict()
+
+        return overrides_to_dict(self.__frames[-1])
 
     def push(self):
-        cp = copy(self.current)
-        self.__data.append(cp)
+        self.__frames.append({})
+        self.__resolved.append(self.__resolved[-1])
         self.on_push.dispatch()
 
     def pop(self) -> Config:
-        if len(self.__data) == 1:
+        if not self.__frames:
             raise IndexError("can't pop the last item")
 
-        popped = self.__data.pop()
+        popped = self.current
+        self.__frames.pop()
+        self.__resolved.pop()
 
         self.on_pop.dispatch()
         return popped
 
+    def __resolve(self, level: int) -> Config:
+        c = self.__resolved[level]
+
+        if c is None:
+            parent = self.__resolve(level - 1)
+            overrides = self.__frames[level - 1]
+            c = replace(parent, **overrides) if overrides else parent
+            self.__resolved[level] = c
+
+        return c
+
+    def __set_field(self, name: str, v: Any):
+        if getattr(self.current, name) == v:
+            return
+
+        if not self.__frames:
+            self.__base = replace(self.__base, **{name: v})
+            self.__resolved[-1] = self.__base
+        else:
+            if getattr(self.__resolve(len(self.__resolved) - 2), name) == v:
+                del self.__frames[-1][name]
+            else:
+                self.__frames[-1][name] = v
+            self.__resolved[-1] = None
+
+        self.__changed()
+
+    def __changed(self):
+        if self.__batch_depth:
+            self.__batch_changed = True
+        else:
+            self.on_change.dispatch()
+
+    @contextmanager
+    def batch(self):
+        # changes made in the block are reported with a single on_change, and only if the top config actually changed
+        before = self.current
+        self.__batch_depth += 1
+
+        try:
+            yield self
+        finally:
+            self.__batch_depth -= 1
+
+            if not self.__batch_depth:
+                changed = self.__batch_changed and self.current != before
+                self.__batch_changed = False
+
+                if changed:
+                    self.on_change.dispatch()
+
     @property
     def success_title(self) -> str:
         return self.current.success_title
 
     @success_title.setter
     def success_title(self, v: str):
-        self.current = replace(self.current, success_title=v)
+        self.__set_field('success_title', v)
 
     @property
     def success_message(self) -> str:
@@ -176,7 +301,7 @@ class Stack:
 
     @success_message.setter
     def success_message(self, v: str):
-        self.current = replace(self.current, success_message=v)
+        self.__set_field('success_message', v)
 
     @property
     def success_icon(self) -> Optional[str]:
@@ -184,7 +309,7 @@ class Stack:
 
     @success_icon.setter
     def success_icon(self, v: Optional[str]):
-        self.current = replace(self.current, success_icon=v)
+        self.__set_field('success_icon', v)
 
     @property
     def success_sound(self) -> Optional[str]:
@@ -192,7 +317,7 @@ class Stack:
 
     @success_sound.setter
     def success_sound(self, v: Optional[str]):
-        self.current = replace(self.current, success_sound=v)
+        self.__set_field('success_sound', v)
 
     @property
     def failure_title(self) -> str:
@@ -200,7 +325,7 @@ class Stack:
 
     @failure_title.setter
     def failure_title(self, v: str):
-        self.current = replace(self.current, failure_title=v)
+        self.__set_field('failure_title', v)
 
     @property
     def failure_message(self) -> str:
@@ -208,7 +333,7 @@ class Stack:
 
     @failure_message.setter
     def failure_message(self, v: str):
-        self.current = replace(self.current, failure_message=v)
+        self.__set_field('failure_message', v)
 
     @property
     def failure_icon(self) -> Optional[str]:
@@ -216,7 +341,7 @@ class Stack:
 
     @failure_icon.setter
     def failure_icon(self, v: Optional[str]):
-        self.current = replace(self.current, failure_icon=v)
+        self.__set_field('failure_icon', v)
 
     @property
     def failure_sound(self) -> Optional[str]:
@@ -224,7 +349,7 @@ class Stack:
 
     @failure_sound.setter
     def failure_sound(self, v: Optional[str]):
-        self.current = replace(self.current, failure_sound=v)
+        self.__set_field('failure_sound', v)
 
     @property
     def notifications_strategy(self) -> SelectedStrategy:
@@ -232,7 +357,7 @@ class Stack:
 
     @notifications_strategy.setter
     def notifications_strategy(self, v: SelectedStrategy):
-        self.current = replace(self.current, notifications_strategy=v)
+        self.__set_field('notifications_strategy', v)
 
     @property
     def logger_name(self) -> str:
@@ -240,15 +365,15 @@ class Stack:
 
     @logger_name.setter
     def logger_name(self, v: str):
-        self.current = replace(self.current, logger_name=v)
+        self.__set_field('logger_name', v)
 
     @property
     def logger_level(self) -> str:
-        return self.current.logger_name
+        return self.current.logger_level
 
     @logger_level.setter
     def logger_level(self, v: str):
-        self.current = replace(self.current, logger_level=v)
+        self.__set_field('logger_level', v)
 
     @property
     def notifications_backend(self) -> SelectedBackend:
@@ -256,13 +381,17 @@ class Stack:
 
     @notifications_backend.setter
     def notifications_backend(self, v: SelectedBackend):
-        self.current = replace(self.current, notifications_backend=v)
+        self.__set_field('notifications_backend', v)
+
+
+def _overrides(c: Config, parent: Config) -> Dict[str, Any]:
+    return {name: getattr(c, name) for name in _CONFIG_KEYS if getattr(c, name) != getattr(parent, name)}
 
 
 class Storage(typing.Protocol):
     def load(self) -> Dict: ...
 
-    def save(self, data: Dict): ...
+    def save(self, data: Dict) -> Optional[int]: ...
 
 
 class FileStorage:
@@ -280,17 +409,230 @@ class FileStorage:
         except FileNotFoundError:
             return {}
 
-    def save(self, data: dict):
-        with open(str(self.__path), 'w') as f:
-            txt = json.dumps(data)
-            f.write(txt)
+    def save(self, data: dict) -> int:
+        txt = json.dumps(data)
+        _replace_file(self.__path, lambda f: f.write(txt))
+
+        size = len(txt.encode('utf-8'))
+        _record_write('file', size)
+        return size
+
+
+def _record_write(storage: str, size: int):
+    STORAGE_WRITES.inc(storage)
+    STORAGE_BYTES.inc(storage, amount=size)
+
+
+def _replace_file(path: Path, write: Callable[[typing.TextIO], Any]):
+    # write to a sibling file and rename it over the old one, so that a crash mid-write never leaves a truncated
+    # file behind
+    fd, tmp_path = mkstemp(dir=str(path.parent), prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            write(f)
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@typing.runtime_checkable
+class Journal(Storage, typing.Protocol):
+    def append(self, record: Dict) -> Optional[int]: ...
+
+    def close(self): ...
+
+
+class JournalStorage:
+    def __init__(self, path: Path, logger: logging.Logger, compact_threshold: int = 1024 * 1024):
+        self.__logger = logger
+        self.__path = path
+        self.__compact_threshold = compact_threshold
+        self.__lock = threading.Lock()
+        self.__state: Dict[str, List[dict]] = {}
+        self.__file: Optional[typing.TextIO] = None
+        self.__size = 0
+        self.__pending: Optional[List[str]] = None
+        self.__compaction: Optional[threading.Thread] = None
+        self.compactions = 0
+
+    def load(self) -> Dict:
+        state: Dict[str, List[dict]] = {}
+
+        try:
+            with open(str(self.__path), encoding='utf-8') as f:
+                for n, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if line == "":
+                        continue
+
+                    try:
+                        _apply_record(state, json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        self.__logger.warning("ignoring invalid journal record at %s:%d", self.__path, n)
+        except FileNotFoundError:
+            pass
+
+        with self.__lock:
+            self.__state = state
+
+        return {sid: list(frames) for sid, frames in state.items()}
+
+    def save(self, data: Dict) -> int:
+        self.__wait_for_compaction()
+
+        with self.__lock:
+            self.__state = {sid: list(frames) for sid, frames in data.items()}
+            snapshot = json.dumps({'op': 'snapshot', 'data': self.__state}, separators=(',', ':')) + '\n'
+
+            self.__close_file()
+            _replace_file(self.__path, lambda f: f.write(snapshot))
+
+        size = len(snapshot.encode('utf-8'))
+        _record_write('journal', size)
+        return size
+
+    def append(self, record: Dict) -> int:
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        size = len(line.encode('utf-8'))
+
+        with self.__lock:
+            _apply_record(self.__state, record)
+
+            if self.__pending is not None:
+                self.__pending.append(line)
+
+            f = self.__open()
+            f.write(line)
+            f.flush()
+            self.__size += size
+
+            if self.__size > self.__compact_threshold and self.__compaction is None:
+                self.__compaction = threading.Thread(target=self.__compact, name="journal-compaction", daemon=True)
+                self.__compaction.start()
+
+        _record_write('journal', size)
+        return size
+
+    def close(self):
+        self.__wait_for_compaction()
+
+        with self.__lock:
+            self.__close_file()
+
+    def __compact(self):
+        try:
+            with self.__lock:
+                state = {sid: list(frames) for sid, frames in self.__state.items()}
+                self.__pending = []
+
+            # the snapshot is serialized and written without holding the lock, records appended in the meantime are
+            # copied over right before swapping the files
+            snapshot = json.dumps({'op': 'snapshot', 'data': state}, separators=(',', ':')) + '\n'
+
+            fd, tmp_path = mkstemp(dir=str(self.__path.parent), prefix=self.__path.name, suffix='.tmp')
+            f = os.fdopen(fd, 'w', encoding='utf-8')
+            try:
+                f.write(snapshot)
+                f.flush()
+
+                with self.__lock:
+                    f.writelines(self.__pending)
+                    f.close()
+                    os.replace(tmp_path, str(self.__path))
+                    self.__close_file()
+            except BaseException:
+                f.close()
+                os.unlink(tmp_path)
+                raise
+
+            self.compactions += 1
+        except Exception:
+            self.__logger.exception("journal compaction failed")
+        finally:
+            with self.__lock:
+                self.__pending = None
+                self.__compaction = None
+
+    def __wait_for_compaction(self):
+        t = self.__compaction
+        if t is not None:
+            t.join()
+
+    def __close_file(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __open(self) -> typing.TextIO:
+        if self.__file is not None:
+            return self.__file
+
+        try:
+            with open(str(self.__path), 'rb') as f:
+                size = f.seek(0, os.SEEK_END)
+                # don't glue new records to a line torn by a crash
+                torn = size > 0 and f.seek(-1, os.SEEK_END) >= 0 and f.read(1) != b'\n'
+        except FileNotFoundError:
+            size, torn = 0, False
+
+        self.__file = open(str(self.__path), 'a', encoding='utf-8')
+        if torn:
+            self.__file.write('\n')
+            size += 1
+
+        self.__size = size
+        return self.__file
+
+
+def _apply_record(state: Dict[str, List[dict]], record: Dict):
+    op = record['op']
+
+    if op == 'snapshot':
+        state.clear()
+        state.update({sid: list(frames) for sid, frames in record['data'].items()})
+        return
+
+    sid = record['sid']
+
+    if op == 'init':
+        state[sid] = list(record['stack'])
+    elif op == 'delete':
+        state.pop(sid, None)
+    elif sid not in state:
+        return
+    elif op == 'push':
+        state[sid].append({})
+    elif op == 'pop':
+        if len(state[sid]) > 1:
+            state[sid].pop()
+    elif op == 'set':
+        state[sid][-1] = record['config']
+    else:
+        raise ValueError("unknown journal operation: {}".format(op))
+
+
+@dataclass
+class PersistenceStats:
+    events_received: int = 0
+    flushes: int = 0
+    bytes_written: int = 0
 
 
 class SessionManager:
-    def __init__(self, storage: Storage, logger: logging.Logger):
+    def __init__(self, storage: Storage, logger: logging.Logger, coalesce_window: Optional[float] = None):
         self.__logger = logger
         self.__storage = storage
-        self.__data = {}
+        self.__coalesce_window = coalesce_window
+        self.__data: Dict[str, List[dict]] = {}
+        self.__stacks: Dict[str, Tuple[Stack, Tuple[Callable[[], None], ...]]] = {}
+        self.__dirty: Set[str] = set()
+        self.__flush_handle: Optional[asyncio.TimerHandle] = None
+        self.__in_flight: Optional[asyncio.Future] = None
+        self.__write_lock = threading.Lock()
+        self.__generation = 0
+        self.__written_generation = 0
+        self.stats = PersistenceStats()
 
     def load_and_prune(self, existing_session_ids: List[str]):
         data = self.__storage.load()
@@ -304,29 +646,166 @@ class SessionManager:
                 discarded.append(sid)
 
         self.__data = valid_data
-        self.__storage.save(self.__data)
+        self.__write(self.__next_generation(), self.__data)
+
+    async def async_load_and_prune(self, existing_session_ids: List[str]):
+        await asyncio.get_running_loop().run_in_executor(None, self.load_and_prune, existing_session_ids)
 
-    def initialize_session_stack(self, session_id: str, default_stack: Stack) -> Optional[Stack]:
-        if session_id not in self.__data:
-            self.__register(session_id, default_stack)
+    def initialize_session_stack(self, session_id: str, default_stack: Stack) -> Stack:
+        if session_id in self.__data:
+            stack = Stack.from_dict(self.__data[session_id])
+            self.__register(session_id, stack)
+            return stack
 
-        return Stack.from_dict(self.__data[session_id])
+        stack = default_stack
+        self.__register(session_id, stack)
+
+        if isinstance(self.__storage, Journal):
+            self.__append({'op': 'init', 'sid': session_id, 'stack': stack.to_dict()})
+        else:
+            self.__mark_dirty(session_id)
+
+        return stack
 
     def delete(self, session_id: str):
-        if session_id not in self.__data:
+        if session_id not in self.__data and session_id not in self.__stacks:
+            return
+
+        self.__data.pop(session_id, None)
+        self.__unregister(session_id)
+
+        if isinstance(self.__storage, Journal):
+            self.__append({'op': 'delete', 'sid': session_id})
+        else:
+            self.__mark_dirty(session_id)
+
+    def flush(self):
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+
+        if not self.__dirty:
             return
 
-        del self.__data[session_id]
-        self.__storage.save(self.__data)
+        generation, snapshot = self.__collect()
+        self.__write(generation, snapshot)
+
+    def close(self):
+        self.flush()
+
+        if isinstance(self.__storage, Journal):
+            self.__storage.close()
 
     def __register(self, session_id: str, stack: Stack):
-        self.__data[session_id] = stack.to_dict()
-        self.__storage.save(self.__data)
+        self.__unregister(session_id)
+
+        if isinstance(self.__storage, Journal):
+            # a journal gets one small record per mutation instead of a rewrite of the whole state
+            handlers = (
+                lambda: self.__append({'op': 'pop', 'sid': session_id}),
+                lambda: self.__append({'op': 'push', 'sid': session_id}),
+                lambda: self.__append({'op': 'set', 'sid': session_id, 'config': stack.top_to_dict()}),
+            )
+        else:
+            def f():
+                self.__mark_dirty(session_id)
+
+            handlers = (f, f, f)
+
+        stack.on_pop += handlers[0]
+        stack.on_push += handlers[1]
+        stack.on_change += handlers[2]
+
+        self.__stacks[session_id] = (stack, handlers)
+
+    def __unregister(self, session_id: str):
+        if session_id not in self.__stacks:
+            return
+
+        stack, handlers = self.__stacks.pop(session_id)
+        stack.on_pop -= handlers[0]
+        stack.on_push -= handlers[1]
+        stack.on_change -= handlers[2]
+
+    def __append(self, record: Dict):
+        self.stats.events_received += 1
+
+        # replayed on the in-memory copy too, as the journal would be on load: a session initialized again (eg. after
+        # its dispatcher was evicted) gets its latest stack back
+        _apply_record(self.__data, record)
+
+        try:
+            written = self.__storage.append(record)
+        except Exception:
+            self.__logger.exception("could not append to the sessions journal")
+            return
+
+        if isinstance(written, int):
+            self.stats.bytes_written += written
+
+    def __mark_dirty(self, session_id: str):
+        self.stats.events_received += 1
+        self.__dirty.add(session_id)
+
+        if self.__coalesce_window is None:
+            self.flush()
+            return
+
+        if self.__flush_handle is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+
+        self.__flush_handle = loop.call_later(self.__coalesce_window, self.__flush_in_background)
+
+    def __flush_in_background(self):
+        self.__flush_handle = None
+
+        if not self.__dirty:
+            return
+
+        if self.__in_flight is not None and not self.__in_flight.done():
+            # one write at a time: pick up whatever got dirty in the meantime once the current one is done
+            self.__in_flight.add_done_callback(lambda _: self.__flush_in_background())
+            return
+
+        generation, snapshot = self.__collect()
+        self.__in_flight = asyncio.get_running_loop().run_in_executor(None, self.__write, generation, snapshot)
+        self.__in_flight.add_done_callback(self.__on_flushed)
+
+    def __on_flushed(self, fut: asyncio.Future):
+        if fut.cancelled():
+            return
+
+        exc = fut.exception()
+        if exc is not None:
+            self.__logger.error("could not persist sessions", exc_info=exc)
+
+    def __collect(self) -> Tuple[int, Dict[str, List[dict]]]:
+        for sid in self.__dirty:
+            if sid in self.__stacks:
+                self.__data[sid] = self.__stacks[sid][0].to_dict()
+
+        self.__dirty.clear()
+        return self.__next_generation(), dict(self.__data)
+
+    def __next_generation(self) -> int:
+        self.__generation += 1
+        return self.__generation
+
+    def __write(self, generation: int, data: Dict[str, List[dict]]):
+        with self.__write_lock:
+            # a slow background write must not overwrite a newer snapshot written by close()
+            if generation <= self.__written_generation:
+                return
 
-        def f():
-            self.__data[session_id] = stack.to_dict()
-            self.__storage.save(self.__data)
+            written = self.__storage.save(data)
+            self.__written_generation = generation
 
-        stack.on_pop += f
-        stack.on_push += f
-        stack.on_change += f
+            self.stats.flushes += 1
+            if isinstance(written, int):
+                self.stats.bytes_written += written
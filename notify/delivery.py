@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from notify.backends import Backend, BackendInitializer
+from notify.metrics import REGISTRY
+from notify.notifications import Notification
+
+DELIVERY_DROPPED = REGISTRY.counter('iterm_notify_delivery_dropped_total',
+                                    'Notifications dropped because the delivery queue was full', ['backend'])
+DELIVERY_COLLAPSED = REGISTRY.counter('iterm_notify_delivery_collapsed_total',
+                                      'Notifications collapsed into a summary of several', ['backend'])
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int):
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__updated_at: Optional[float] = None
+
+    def take(self, now: float) -> bool:
+        self.__refill(now)
+
+        if self.__tokens < 1:
+            return False
+
+        self.__tokens -= 1
+        return True
+
+    def wait_time(self, now: float) -> float:
+        self.__refill(now)
+        return max(0.0, (1 - self.__tokens) / self.__rate)
+
+    def __refill(self, now: float):
+        if self.__updated_at is not None:
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__updated_at) * self.__rate)
+        self.__updated_at = now
+
+
+class DeliveryQueue:
+    def __init__(self, logger: logging.Logger, window: float = 0.5, rate: float = 0.5, burst: int = 3,
+                 max_depth: int = 100):
+        self.__logger = logger
+        self.__window = window
+        self.__rate = rate
+        self.__burst = burst
+        self.__max_depth = max_depth
+        self.__pending: Dict[Tuple[str, Tuple[str, ...]], List[Tuple[Backend, Notification]]] = {}
+        self.__limiters: Dict[Tuple[str, Tuple[str, ...]], RateLimiter] = {}
+        self.__flush_handle: Optional[asyncio.TimerHandle] = None
+        self.delivered = 0
+        self.collapsed = 0
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(len(items) for items in self.__pending.values())
+
+    def submit(self, backend: Backend, n: Notification):
+        if self.depth >= self.__max_depth:
+            self.dropped += 1
+            DELIVERY_DROPPED.inc(backend.name)
+            self.__logger.warning("delivery queue is full, dropping notification: %s", n)
+            return
+
+        self.__pending.setdefault((backend.name, tuple(backend.args)), []).append((backend, n))
+        self.__schedule(self.__window)
+
+    def wrap(self, initializers: Dict[str, BackendInitializer]) -> Dict[str, BackendInitializer]:
+        def queued(initializer: BackendInitializer) -> BackendInitializer:
+            def f(*args):
+                return QueuedBackend(initializer(*args), self)
+
+            return f
+
+        return {name: queued(initializer) for name, initializer in initializers.items()}
+
+    def flush(self):
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+
+        now = self.__now()
+        retry_in: Optional[float] = None
+
+        for key in list(self.__pending):
+            limiter = self.__limiters.setdefault(key, RateLimiter(self.__rate, self.__burst))
+
+            if not limiter.take(now):
+                # keep them queued: whatever else arrives in the meantime is collapsed in the same notification
+                wait = limiter.wait_time(now)
+                retry_in = wait if retry_in is None else min(retry_in, wait)
+                continue
+
+            items = self.__pending.pop(key)
+            backend = items[-1][0]
+
+            if len(items) == 1:
+                n = items[0][1]
+            else:
+                n = summarize([n for _, n in items])
+                self.collapsed += len(items) - 1
+                DELIVERY_COLLAPSED.inc(backend.name, amount=len(items) - 1)
+
+            try:
+                backend.notify(n)
+                self.delivered += 1
+            except:
+                self.__logger.exception("could not deliver notification with %s", backend.name,
+                                        extra={'backend': backend.name})
+
+        if retry_in is not None:
+            self.__schedule(retry_in)
+
+    def __schedule(self, delay: float):
+        if self.__flush_handle is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+
+        self.__flush_handle = loop.call_later(delay, self.flush)
+
+    @staticmethod
+    def __now() -> float:
+        try:
+            return asyncio.get_running_loop().time()
+        except RuntimeError:
+            return time.monotonic()
+
+
+class QueuedBackend(Backend):
+    def __init__(self, backend: Backend, queue: DeliveryQueue):
+        self.__backend = backend
+        self.__queue = queue
+
+    @property
+    def name(self) -> str:
+        return self.__backend.name
+
+    @property
+    def args(self) -> List[str]:
+        return self.__backend.args
+
+    def notify(self, n: Notification):
+        self.__queue.submit(self.__backend, n)
+
+
+def summarize(notifications: List[Notification]) -> Notification:
+    commands = [n for n in notifications if n.exit_code is not None]
+    failed = [n for n in commands if n.exit_code != 0]
+
+    if len(commands) == len(notifications):
+        title = "{} commands finished".format(len(notifications))
+    else:
+        title = "{} notifications".format(len(notifications))
+
+    if failed:
+        title += ", {} failed".format(len(failed))
+
+    message = ", ".join(n.message for n in notifications[:3])
+    if len(notifications) > 3:
+        message += " and {} more".format(len(notifications) - 3)
+
+    template = failed[0] if failed else notifications[0]
+
+    return Notification(title=title, message=message, icon=template.icon, sound=template.sound)
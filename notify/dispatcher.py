@@ -1,21 +1,112 @@
-from typing import Callable, Optional
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Mapping, NamedTuple, Optional
 from logging import Logger
 
+from notify.config import EventHandlers
+from notify.metrics import REGISTRY
+
+EVENTS = REGISTRY.counter('iterm_notify_events_dispatched_total', 'Control sequences dispatched to a handler',
+                          ['selector'])
+HANDLER_ERRORS = REGISTRY.counter('iterm_notify_handler_errors_total', 'Handlers that raised', ['selector'])
+HANDLER_SECONDS = REGISTRY.histogram('iterm_notify_handler_seconds', 'Time spent in handlers', ['selector'])
+
+
+class Route(NamedTuple):
+    handler: Callable
+    # timestamped handlers also get the time the shell sent the event, as sent_at (None if it didn't)
+    timestamped: bool = False
+
 
 class Dispatcher:
-    def __init__(self, logger: Optional[Logger] = None):
+    def __init__(self, logger: Optional[Logger] = None, tracer: Optional[Callable[[str, float], None]] = None,
+                 routes: Optional[Mapping[str, Route]] = None, state: Any = None):
         self.__logger = logger
-        self.__handlers: dict[str: Callable[[list], None]] = {}
+        # gets the selector and the seconds spent handling it after every dispatch
+        self.__tracer = tracer
+        # called with the selector, the args and sent_at of every event, before it's handled
+        self.on_dispatch = EventHandlers()
+        # routes can be shared by many dispatchers, they're copied before a handler is registered
+        self.__routes: Mapping[str, Route] = routes if routes is not None else {}
+        self.__shared = routes is not None
+        # when given, passed to every handler before the args
+        self.__state = state
 
-    def register_handler(self, selector: str, handler: Callable):
-        self.__handlers[selector] = handler
+    def register_handler(self, selector: str, handler: Callable, timestamped: bool = False):
+        if self.__shared:
+            self.__routes = dict(self.__routes)
+            self.__shared = False
 
-    def dispatch(self, selector: str, args: list):
-        if selector not in self.__handlers:
-            raise RuntimeError("can't dispatch to unknown selector: {}".format(selector))
+        self.__routes[selector] = Route(handler, timestamped)
+
+    def dispatch(self, selector: str, args: list, sent_at: Optional[float] = None):
+        handler, timestamped = self.__prepare(selector, args, sent_at)
+        started = time.perf_counter()
+        result = None
+
+        try:
+            result = self.__call(handler, timestamped, args, sent_at)
+        except:
+            self.__failed(selector, args)
+        finally:
+            self.__done(selector, started)
+
+        if result is not None and inspect.isawaitable(result):
+            # a coroutine handler dispatched from synchronous code: it runs on its own, and isn't timed
+            def done(f: asyncio.Future):
+                if not f.cancelled() and f.exception() is not None:
+                    self.__failed(selector, args, f.exception())
+
+            asyncio.ensure_future(result).add_done_callback(done)
+
+    async def dispatch_async(self, selector: str, args: list, sent_at: Optional[float] = None):
+        """Like dispatch(), but handlers can be coroutines, which are awaited."""
+        handler, timestamped = self.__prepare(selector, args, sent_at)
+        started = time.perf_counter()
 
-        self.__logger and self.__logger.info("dispatching {} with args: {}".format(selector, args))
         try:
-            self.__handlers[selector](*args)
+            result = self.__call(handler, timestamped, args, sent_at)
+            if result is not None and inspect.isawaitable(result):
+                await result
+        except asyncio.CancelledError:
+            raise
         except:
-            self.__logger and self.__logger.exception("exception while dispatching {} with {}".format(selector, args))
+            self.__failed(selector, args)
+        finally:
+            self.__done(selector, started)
+
+    def __prepare(self, selector: str, args: list, sent_at: Optional[float]) -> Route:
+        try:
+            self.on_dispatch.dispatch(selector, args, sent_at)
+        except Exception:
+            # eg. a recording that can't be written, the event is still handled
+            self.__logger and self.__logger.exception("on_dispatch hook failed for %s", selector,
+                                                      extra={'selector': selector})
+
+        route = self.__routes.get(selector)
+        if route is None:
+            raise RuntimeError("can't dispatch to unknown selector: {}".format(selector))
+
+        self.__logger and self.__logger.info("dispatching %s with args: %s", selector, args,
+                                             extra={'selector': selector})
+        EVENTS.inc(selector)
+
+        return route
+
+    def __call(self, handler: Callable, timestamped: bool, args: list, sent_at: Optional[float]):
+        state = self.__state
+        if state is None:
+            return handler(*args, sent_at=sent_at) if timestamped else handler(*args)
+
+        return handler(state, *args, sent_at=sent_at) if timestamped else handler(state, *args)
+
+    def __failed(self, selector: str, args: list, exc: Optional[BaseException] = None):
+        HANDLER_ERRORS.inc(selector)
+        self.__logger and self.__logger.error("exception while dispatching %s with %s", selector, args,
+                                              exc_info=exc if exc is not None else True, extra={'selector': selector})
+
+    def __done(self, selector: str, started: float):
+        elapsed = time.perf_counter() - started
+        HANDLER_SECONDS.observe(elapsed, selector)
+        self.__tracer and self.__tracer(selector, elapsed)
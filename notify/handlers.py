@@ -1,141 +1,173 @@
-import logging
-from datetime import datetime
-from typing import List
+from typing import Callable, Dict, List, Optional, Tuple
 
-from notify.backends import BackendFactory
 from notify.commands import Command
-from notify.config import Config, Stack
-from notify.notifications import Factory, Notification
-from notify.strategies import StrategyFactory
+from notify.config import Config
+from notify.notifications import compile_template
+from notify.state import SessionState
+
+# keys whose value is split on whitespace into separate arguments by set-many
+_MULTI_VALUE_KEYS = {'notifications-backend'}
+
+# Handlers are shared by all sessions: every one of them gets the state of the session the event came from.
 
 
 class MaintainConfig:
-    def __init__(self, stack: Stack,
-                 success_template: Notification,
-                 failure_template: Notification,
-                 logger: logging.Logger):
-        self.__success_template = success_template
-        self.__failure_template = failure_template
-        self.__logger = logger
+    def __init__(self):
+        self.__setters = {
+            'command-complete-timeout': self.command_complete_timeout_handler,
+            'success-title': self.success_title_handler,
+            'success-message': self.success_message_handler,
+            'success-icon': self.success_icon_handler,
+            'success-sound': self.success_sound_handler,
+            'failure-title': self.failure_title_handler,
+            'failure-message': self.failure_message_handler,
+            'failure-icon': self.failure_icon_handler,
+            'failure-sound': self.failure_sound_handler,
+            'notifications-backend': self.notifications_backend_handler,
+            'logger-name': self.logging_name_handler,
+            'logger-level': self.logging_level_handler,
+        }
 
-        self.__configuration_stack = stack
-        self.__configuration_stack.on_pop += self.__apply_on_pop
-        self.__apply_config(self.__configuration_stack.current)
+    def attach(self, state: SessionState):
+        """Applies the current configuration of the session, and the restored one whenever its stack is popped."""
+        state.stack.on_pop += lambda: self.__apply_config(state, state.stack.current)
+        self.__apply_config(state, state.stack.current)
 
-    def __apply_config(self, cfg: Config):
-        self.notifications_backend_handler(cfg.notifications_backend.name, *cfg.notifications_backend.args)
+    def __apply_config(self, state: SessionState, cfg: Config):
+        self.notifications_backend_handler(state, cfg.notifications_backend.name, *cfg.notifications_backend.args)
 
-        self.success_title_handler(cfg.success_title)
-        self.success_message_handler(cfg.success_message)
-        self.success_icon_handler(cfg.success_icon)
-        self.success_sound_handler(cfg.success_sound)
+        self.success_title_handler(state, cfg.success_title)
+        self.success_message_handler(state, cfg.success_message)
+        self.success_icon_handler(state, cfg.success_icon)
+        self.success_sound_handler(state, cfg.success_sound)
 
-        self.failure_title_handler(cfg.failure_title)
-        self.failure_message_handler(cfg.failure_message)
-        self.failure_icon_handler(cfg.failure_icon)
-        self.failure_sound_handler(cfg.failure_sound)
+        self.failure_title_handler(state, cfg.failure_title)
+        self.failure_message_handler(state, cfg.failure_message)
+        self.failure_icon_handler(state, cfg.failure_icon)
+        self.failure_sound_handler(state, cfg.failure_sound)
 
-        self.command_complete_timeout_handler(*cfg.notifications_strategy.args)
+        self.command_complete_timeout_handler(state, *cfg.notifications_strategy.args)
 
-        self.logging_name_handler(cfg.logger_name)
-        self.logging_level_handler(cfg.logger_level)
+        self.logging_name_handler(state, cfg.logger_name)
+        self.logging_level_handler(state, cfg.logger_level)
 
-    def __apply_on_pop(self):
-        self.__apply_config(self.__configuration_stack.current)
+    @property
+    def setters(self) -> Dict[str, Callable]:
+        return dict(self.__setters)
 
-    def notifications_backend_handler(self, name: str, *args):
-        selected_backend = self.__configuration_stack.notifications_backend.with_name(name, *args)
-        self.__configuration_stack.notifications_backend = selected_backend
+    def set_many_handler(self, state: SessionState, *lines: str):
+        settings = [self.__parse_setting(line) for line in lines if line.strip() and not line.lstrip().startswith('#')]
 
-    def command_complete_timeout_handler(self, t: str):
-        selected_strategy = self.__configuration_stack.notifications_strategy.with_args(int(t))
-        self.__configuration_stack.notifications_strategy = selected_strategy
+        stack = state.stack
+        previous = stack.current
+        with stack.batch():
+            try:
+                for setter, args in settings:
+                    setter(state, *args)
+            except:
+                stack.current = previous
+                self.__apply_config(state, previous)
+                raise
 
-    def success_title_handler(self, title: str):
-        self.__success_template = self.__success_template.with_title(title)
-        self.__configuration_stack.success_title = self.__success_template.title
+    def __parse_setting(self, line: str) -> Tuple[Callable, List[str]]:
+        key, _, value = line.strip().partition(' ')
+        value = value.strip()
 
-    def success_message_handler(self, message: str):
-        self.__success_template = self.__success_template.with_message(message)
-        self.__configuration_stack.success_message = self.__success_template.message
+        if key not in self.__setters:
+            raise ValueError("unknown configuration key: {}".format(key))
 
-    def success_icon_handler(self, icon: str):
-        self.__success_template = self.__success_template.with_icon(icon if icon != "" else None)
-        self.__configuration_stack.success_icon = self.__success_template.icon
+        if key in _MULTI_VALUE_KEYS:
+            return self.__setters[key], value.split()
 
-    def success_sound_handler(self, sound: str):
-        self.__success_template = self.__success_template.with_sound(sound if sound != "" else None)
-        self.__configuration_stack.success_sound = self.__success_template.sound
+        return self.__setters[key], [value]
 
-    def failure_title_handler(self, title: str):
-        self.__failure_template = self.__failure_template.with_title(title)
-        self.__configuration_stack.failure_title = self.__failure_template.title
+    def notifications_backend_handler(self, state: SessionState, name: str, *args):
+        # the instance for the previous selection stays cached, a pushed frame usually goes back to it when popped
+        state.stack.notifications_backend = state.stack.notifications_backend.with_name(name, *args)
 
-    def failure_message_handler(self, message: str):
-        self.__failure_template = self.__failure_template.with_message(message)
-        self.__configuration_stack.failure_message = self.__failure_template.message
+    def command_complete_timeout_handler(self, state: SessionState, t: str):
+        state.stack.notifications_strategy = state.stack.notifications_strategy.with_args(int(t))
 
-    def failure_icon_handler(self, icon: str):
-        self.__failure_template = self.__failure_template.with_icon(icon if icon != "" else None)
-        self.__configuration_stack.failure_icon = self.__failure_template.icon
+    def success_title_handler(self, state: SessionState, title: str):
+        if title != state.stack.success_title:
+            compile_template(title).validate()
 
-    def failure_sound_handler(self, sound: str):
-        self.__failure_template = self.__failure_template.with_sound(sound if sound != "" else None)
-        self.__configuration_stack.failure_sound = self.__failure_template.sound
+        state.stack.success_title = title
 
-    def logging_name_handler(self, new_name: str):
-        self.__logger.name = new_name
-        self.__configuration_stack.logger_name = self.__logger.name
+    def success_message_handler(self, state: SessionState, message: str):
+        if message != state.stack.success_message:
+            compile_template(message).validate()
 
-    def logging_level_handler(self, new_level: str):
-        self.__logger.setLevel(new_level)
-        self.__configuration_stack.logger_level = self.__logger.level
+        state.stack.success_message = message
 
+    def success_icon_handler(self, state: SessionState, icon: str):
+        state.stack.success_icon = icon if icon != "" else None
 
-class Notify:
-    def __init__(self, stack: Stack,
-                 notification_factory: Factory,
-                 backend_factory: BackendFactory):
+    def success_sound_handler(self, state: SessionState, sound: str):
+        state.stack.success_sound = sound if sound != "" else None
 
-        self.__stack = stack
-        self.__notification_factory = notification_factory
-        self.__backend_factory = backend_factory
+    def failure_title_handler(self, state: SessionState, title: str):
+        if title != state.stack.failure_title:
+            compile_template(title).validate()
 
-        self.__commands: list = []
+        state.stack.failure_title = title
 
-    def notify(self, message: str, title: str):
-        n = self.__notification_factory.create(message=message, title=title, success=True)
-        self.__backend_factory.create(self.__stack.notifications_backend).notify(n)
+    def failure_message_handler(self, state: SessionState, message: str):
+        if message != state.stack.failure_message:
+            compile_template(message).validate()
 
+        state.stack.failure_message = message
 
-class NotifyCommandComplete:
-    def __init__(self, stack: Stack,
-                 strategy_factory: StrategyFactory,
-                 notification_factory: Factory,
-                 backend_factory: BackendFactory):
+    def failure_icon_handler(self, state: SessionState, icon: str):
+        state.stack.failure_icon = icon if icon != "" else None
+
+    def failure_sound_handler(self, state: SessionState, sound: str):
+        state.stack.failure_sound = sound if sound != "" else None
+
+    def logging_name_handler(self, state: SessionState, new_name: str):
+        state.logger.name = new_name
+        state.stack.logger_name = state.logger.name
+
+    def logging_level_handler(self, state: SessionState, new_level: str):
+        state.logger.setLevel(new_level)
+        state.stack.logger_level = state.logger.level
 
-        self.__stack = stack
-        self.__strategy_factory = strategy_factory
-        self.__notification_factory = notification_factory
-        self.__backend_factory = backend_factory
 
-        self.__commands: List[Command] = []
+class Profile:
+    def profiling_handler(self, state: SessionState, mode: str, seconds: str = '10', name: str = ''):
+        if state.profiler is None:
+            raise RuntimeError("profiling is not available")
 
-    def before_command(self, command_line: str):
-        self.__stack.push()
-        self.__commands.append(Command(datetime.now(), command_line))
+        if mode == 'off':
+            state.profiler.stop()
+            return
+
+        state.profiler.start(mode, float(seconds), name or None)
+
+
+class Notify:
+    def notify(self, state: SessionState, message: str, title: str):
+        n = state.notification_factory.create(message=message, title=title, success=True)
+        state.backend_factory.create(state.stack.notifications_backend).notify(n)
+
+
+class NotifyCommandComplete:
+    def before_command(self, state: SessionState, command_line: str, sent_at: Optional[float] = None):
+        state.stack.push()
+        state.commands.append(Command(state.clock.timestamp(sent_at), command_line))
 
-    def after_command(self, exit_code: str):
+    def after_command(self, state: SessionState, exit_code: str, sent_at: Optional[float] = None):
         exit_code = int(exit_code)
 
-        if len(self.__commands) == 0:
+        if len(state.commands) == 0:
             raise RuntimeError("after_command without a command")
 
-        cmd = self.__commands.pop()
-        complete_cmd = cmd.complete(exit_code, datetime.now())
+        cmd = state.commands.pop()
+        complete_cmd = cmd.complete(exit_code, state.clock.timestamp(sent_at))
+        stack = state.stack
 
-        if self.__strategy_factory.create(self.__stack.current.notifications_strategy).should_notify(complete_cmd):
-            n = self.__notification_factory.from_command(complete_cmd)
-            self.__backend_factory.create(self.__stack.current.notifications_backend).notify(n)
+        if state.strategy_factory.create(stack.current.notifications_strategy).should_notify(complete_cmd):
+            n = state.notification_factory.from_command(complete_cmd)
+            state.backend_factory.create(stack.current.notifications_backend).notify(n)
 
-        self.__stack.pop()
+        stack.pop()
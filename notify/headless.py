@@ -0,0 +1,126 @@
+"""
+Runs the dispatcher on the output of shells, rather than on the control sequences iTerm2 receives: without iTerm2 and
+on any OS, for test rigs and load testing.
+
+    bash -i 2>&1 | tee /dev/tty | python -m notify.headless -
+
+Every stream is handled as a session of its own; notifications are logged, unless a backend is configured.
+"""
+
+import argparse
+import errno
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+
+from notify import build_dispatcher, identity, logs, wire
+from notify.backends import BackendFactory, BackendInitializer, Log
+from notify.config import Config, SelectedBackend, SelectedStrategy, Stack
+from notify.osc import Parser
+from notify.strategies import StrategyFactory, StrategyInitializer, WhenSlow
+
+CHUNK_SIZE = 64 * 1024
+
+
+def create_default(session_id: str) -> Config:
+    # there's no focus to track, so commands are only notified when they're slow
+    return Config(
+        notifications_backend=SelectedBackend(name="log"),
+        notifications_strategy=SelectedStrategy(name='when-slow', args=["10"]),
+        logger_name=session_id,
+        logger_level="INFO",
+        success_title="#win ({duration})",
+        success_message="{command_line}",
+        failure_title="#fail ({duration})",
+        failure_message="{command_line}"
+    )
+
+
+class Headless:
+    def __init__(self, identity: str, logger: logging.Logger, stack: Optional[Stack] = None,
+                 backend_factories: Optional[Dict[str, BackendInitializer]] = None,
+                 strategy_factories: Optional[Dict[str, StrategyInitializer]] = None):
+        self.__logger = logger
+        self.__parser = Parser(identity)
+        self.stack = stack if stack is not None else Stack([create_default(logger.name)])
+
+        self.__dispatcher = build_dispatcher(
+            stack=self.stack,
+            strategy_factory=StrategyFactory(strategy_factories if strategy_factories is not None else {
+                'when-slow': WhenSlow.create_factory()
+            }),
+            backend_factory=BackendFactory(backend_factories if backend_factories is not None else {
+                'log': Log.create_factory(logger)
+            }),
+            logger=logger,
+            session_id=logger.name
+        )
+
+        self.events = 0
+
+    def feed(self, data: bytes) -> int:
+        """Dispatches the control sequences that end in data, returns how many."""
+        sequences = self.__parser.feed(data)
+
+        for sequence in sequences:
+            self.events += 1
+
+            try:
+                message = wire.decode(sequence.payload)
+            except ValueError:
+                self.__logger.exception("can't decode control sequence payload %r", sequence.payload)
+                continue
+
+            try:
+                self.__dispatcher.dispatch(message.selector, message.args, sent_at=message.sent_at)
+            except RuntimeError:
+                self.__logger.exception("can't dispatch %s", message.selector)
+
+        return len(sequences)
+
+    def run(self, stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> int:
+        """Reads stream until its end, as soon as any data is available; returns how many events were received."""
+        fd = stream.fileno()
+
+        while True:
+            try:
+                data = os.read(fd, chunk_size)
+            except OSError as e:
+                # what reading a pty whose other end is closed fails with on Linux
+                if e.errno == errno.EIO:
+                    break
+                raise
+
+            if not data:
+                break
+
+            self.feed(data)
+
+        return self.events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m notify.headless',
+                                     description="Dispatches the control sequences found in a stream")
+    parser.add_argument('input', help="file, FIFO or pty to read, - for stdin")
+    parser.add_argument('--identity-file', type=Path, default=Path.home().joinpath('.iterm-notify-identity'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format=logs.TEXT_FORMAT)
+    logger = logging.getLogger('headless')
+
+    headless = Headless(identity.load(args.identity_file), logger)
+
+    if args.input == '-':
+        headless.run(sys.stdin.buffer)
+    else:
+        with open(args.input, 'rb', buffering=0) as f:
+            headless.run(f)
+
+    logger.info("%d events received", headless.events)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+A Unix socket for producers that don't have a terminal (CI scripts, cron jobs, editor plugins) to send the same
+control sequences a shell does, as newline-delimited JSON.
+
+The first line authenticates the connection with the identity iTerm2 knows the shells by, within AUTH_TIMEOUT seconds:
+
+    {"identity": "..."}
+
+Every following line is a message, or a list of messages dispatched together:
+
+    {"selector": "notify", "args": ["message", "title"]}
+    [{"selector": "set-success-title", "args": ["done"]}, {"selector": "notify", "args": ["message", "title"]}]
+
+Messages go to the configuration of the "session" they name, "ingest" if they don't; up to MAX_SESSIONS names are
+accepted, since the configuration of each one is kept until the daemon exits. Only notify and the configuration setters
+are accepted. Every line gets a reply, {"ok": true, "dispatched": N} or {"ok": false, "error": "..."}; a line with an
+invalid message dispatches none of the messages in it.
+"""
+
+import asyncio
+import hmac
+import inspect
+import json
+import logging
+from typing import Awaitable, Callable, List, Optional, Set, Tuple, Union
+
+from notify import sockets
+from notify.routing import CONFIG
+
+DEFAULT_SESSION = 'ingest'
+
+# session names a server accepts, DEFAULT_SESSION included
+MAX_SESSIONS = 16
+
+# commands are timed by the shell that runs them, and the daemon itself isn't for producers to control: they can only
+# notify or change the configuration
+ALLOWED_SELECTORS = frozenset(['notify'] + ['set-' + key for key in CONFIG.setters])
+
+# longest line accepted, batches included
+MAX_LINE = 1024 * 1024
+
+# seconds a connection has to send its identity, so that idle clients don't hold on to a connection
+AUTH_TIMEOUT = 5.0
+
+# may be a coroutine function, it's awaited then
+Dispatch = Callable[[str, str, List[str]], Union[None, Awaitable[None]]]
+
+
+def is_allowed(selector: str) -> bool:
+    return selector in ALLOWED_SELECTORS
+
+
+def parse(line: bytes) -> List[Tuple[str, str, List[str]]]:
+    """Returns (session, selector, args) for every message in line, or raises ValueError."""
+    try:
+        decoded = json.loads(line)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("invalid JSON: {}".format(e))
+
+    messages = decoded if isinstance(decoded, list) else [decoded]
+    parsed = []
+
+    for m in messages:
+        if not isinstance(m, dict):
+            raise ValueError("a message must be an object")
+
+        selector = m.get('selector')
+        args = m.get('args', [])
+        session = m.get('session', DEFAULT_SESSION)
+
+        if not isinstance(selector, str) or not is_allowed(selector):
+            raise ValueError("selector not allowed: {!r}".format(selector))
+
+        if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+            raise ValueError("args must be a list of strings")
+
+        if not isinstance(session, str) or session == '':
+            raise ValueError("session must be a non-empty string")
+
+        parsed.append((session, selector, args))
+
+    return parsed
+
+
+async def serve(path: str, identity: str, dispatch: Dispatch, logger: Optional[logging.Logger] = None,
+                max_sessions: int = MAX_SESSIONS, auth_timeout: float = AUTH_TIMEOUT) -> asyncio.AbstractServer:
+    """Accepts connections on a Unix socket at path, only readable by the user; messages are passed to dispatch."""
+    sessions: Set[str] = set()
+
+    async def reply(writer: asyncio.StreamWriter, **response):
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def authenticate(reader: asyncio.StreamReader) -> bool:
+        try:
+            given = json.loads(await asyncio.wait_for(reader.readline(), auth_timeout)).get('identity')
+        except (ValueError, AttributeError, asyncio.TimeoutError):
+            return False
+
+        return isinstance(given, str) and hmac.compare_digest(given.encode('utf-8'), identity.encode('utf-8'))
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            if not await authenticate(reader):
+                await reply(writer, ok=False, error="authentication failed")
+                return
+
+            await reply(writer, ok=True)
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+
+                if not line.strip():
+                    continue
+
+                try:
+                    messages = parse(line)
+                except ValueError as e:
+                    await reply(writer, ok=False, error=str(e))
+                    continue
+
+                named = sessions.union(session for session, _, _ in messages)
+                if len(named) > max_sessions:
+                    await reply(writer, ok=False, error="too many sessions, at most {}".format(max_sessions))
+                    continue
+
+                sessions.update(named)
+
+                dispatched = 0
+                try:
+                    for session, selector, args in messages:
+                        result = dispatch(session, selector, args)
+                        if inspect.isawaitable(result):
+                            await result
+                        dispatched += 1
+                except Exception as e:
+                    logger and logger.exception("could not dispatch ingested messages")
+                    await reply(writer, ok=False, error=str(e), dispatched=dispatched)
+                    continue
+
+                await reply(writer, ok=True, dispatched=dispatched)
+        except (ValueError, ConnectionError):
+            # ValueError is a line longer than MAX_LINE
+            pass
+        finally:
+            writer.close()
+
+    server = await sockets.start_unix_server(handle, path, limit=MAX_LINE)
+
+    logger and logger.info("accepting control sequences on %s", path)
+    return server
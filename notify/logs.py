@@ -0,0 +1,86 @@
+import atexit
+import copy
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, Callable, TextIO
+
+TEXT_FORMAT = '%(name)s: %(levelname)s %(message)s'
+
+# attributes every LogRecord has, anything else was passed with extra= and is emitted as a field of its own
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', logging.INFO, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class lazy:
+    """Calls fn(*args) only if the message it's an argument of is actually formatted."""
+
+    __slots__ = ('__fn', '__args')
+
+    def __init__(self, fn: Callable[..., Any], *args):
+        self.__fn = fn
+        self.__args = args
+
+    def __str__(self):
+        return str(self.__fn(*self.__args))
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+
+        for k, v in vars(record).items():
+            if k not in _RECORD_ATTRIBUTES and not k.startswith('_'):
+                entry[k] = v
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    def __init__(self, queue: SimpleQueue, listener: QueueListener):
+        super().__init__(queue)
+        self.__listener = listener
+        self.__stopped = False
+
+    def stop(self):
+        # waits for the records already queued to be written
+        if not self.__stopped:
+            self.__stopped = True
+            self.__listener.stop()
+
+    # unlike QueueHandler.prepare(), only resolves the message: the record is formatted (and the traceback rendered)
+    # by the listener's thread
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure(stream: TextIO, json_lines: bool = False) -> BackgroundHandler:
+    """
+    Returns a handler that only puts records in a queue, the actual writes to the stream happen in a background thread.
+    """
+    target = logging.StreamHandler(stream)
+    target.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+
+    queue = SimpleQueue()
+    listener = QueueListener(queue, target, respect_handler_level=True)
+    listener.start()
+
+    handler = BackgroundHandler(queue, listener)
+
+    # registered before anything that might log while exiting, so it's stopped (and the queue flushed) after them
+    atexit.register(handler.stop)
+
+    return handler
@@ -0,0 +1,229 @@
+"""
+A small metrics registry, rendered in the Prometheus text format and served on a Unix socket or on localhost:
+
+    curl --unix-socket ~/.iterm-notify-metrics.sock http://localhost/metrics
+
+Updating a metric is a dict lookup and an addition under a lock, so they're always on.
+"""
+
+import asyncio
+import math
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+from notify import sockets
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric(ABC):
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        # by label values
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    @abstractmethod
+    def samples(self) -> Iterator[Tuple[str, Tuple[Tuple[str, str], ...], float]]: ...
+
+    def remove(self, *label_values: str):
+        # for label values that won't be used anymore, eg. those of a closed session
+        with self._lock:
+            self._values.pop(label_values, None)
+
+    def _label_pairs(self, values: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+        if len(values) != len(self.labels):
+            raise ValueError("{} expects labels {}, got {!r}".format(self.name, self.labels, values))
+
+        return tuple(zip(self.labels, values))
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+
+        for label_values, v in values:
+            yield self.name, self._label_pairs(label_values), v
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.__function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, *label_values: str):
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_function(self, f: Optional[Callable[[], float]]):
+        # evaluated when the metrics are rendered, rather than kept up to date
+        self.__function = f
+
+    def value(self, *label_values: str) -> float:
+        if self.__function is not None and not label_values:
+            return self.__function()
+
+        return self._values.get(label_values, 0.0)
+
+    def samples(self):
+        if self.__function is not None:
+            yield self.name, (), float(self.__function())
+            return
+
+        with self._lock:
+            values = list(self._values.items())
+
+        for label_values, v in values:
+            yield self.name, self._label_pairs(label_values), v
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # _values holds, per label values, a count per bucket (the last one is +Inf) and the sum of all observations
+
+    def observe(self, value: float, *label_values: str):
+        i = bisect_left(self.buckets, value)
+
+        with self._lock:
+            v = self._values.get(label_values)
+            if v is None:
+                v = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+
+            v[0][i] += 1
+            v[1][0] += value
+
+    def count(self, *label_values: str) -> int:
+        v = self._values.get(label_values)
+        return sum(v[0]) if v is not None else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(k, list(counts), total[0]) for k, (counts, total) in self._values.items()]
+
+        for label_values, counts, total in values:
+            labels = self._label_pairs(label_values)
+            cumulative = 0
+
+            for le, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                yield self.name + '_bucket', labels + (('le', _format_value(le)),), cumulative
+
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.__metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        existing = self.__metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.labels != metric.labels:
+                raise ValueError("{} is already registered with a different type or labels".format(metric.name))
+
+            return existing
+
+        self.__metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+
+        for metric in self.__metrics.values():
+            lines.append('# HELP {} {}'.format(metric.name, _escape_help(metric.documentation)))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+
+            for name, labels, value in metric.samples():
+                if labels:
+                    lines.append('{}{{{}}} {}'.format(
+                        name, ','.join('{}="{}"'.format(k, _escape_label(v)) for k, v in labels), _format_value(value)))
+                else:
+                    lines.append('{} {}'.format(name, _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+async def serve(registry: Registry = REGISTRY, path: Optional[str] = None, port: Optional[int] = None,
+                host: str = '127.0.0.1') -> asyncio.AbstractServer:
+    """Serves registry.render() over HTTP on a Unix socket at path (only readable by the user), or on host:port."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=5)
+            method, target = request.split(b' ', 2)[:2]
+
+            if method == b'GET' and target.split(b'?')[0] in (b'/', b'/metrics'):
+                status, body = '200 OK', registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'not found\n'
+
+            writer.write('HTTP/1.0 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n'.format(
+                status, CONTENT_TYPE, len(body)).encode('ascii') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    if path is not None:
+        return await sockets.start_unix_server(handle, path)
+
+    return await asyncio.start_server(handle, host=host, port=port)
+
+
+def _format_value(v: float) -> str:
+    if v == math.inf:
+        return '+Inf'
+
+    if float(v).is_integer():
+        return str(int(v))
+
+    return repr(float(v))
+
+
+def _escape_help(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(s: str) -> str:
+    return str(s).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
@@ -1,7 +1,10 @@
 import dataclasses
+import re
 from dataclasses import dataclass
 from datetime import timedelta
-from typing import Optional, Union
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Callable, Dict, FrozenSet, Optional, Union
 
 from notify.commands import CompleteCommand
 from notify.config import Stack
@@ -13,6 +16,7 @@ class Notification:
     message: str
     icon: Optional[str] = None
     sound: Optional[str] = None
+    exit_code: Optional[int] = None
 
     def with_title(self, v: str) -> 'Notification':
         return dataclasses.replace(self, title=v)
@@ -62,27 +66,82 @@ class Factory:
     def from_command(self, cmd: CompleteCommand) -> Notification:
         template = self.__get_template(cmd.successful)
 
-        icon = template.icon
-        sound = template.sound
+        return Notification(
+            title=compile_template(template.title).render(cmd),
+            message=compile_template(template.message).render(cmd),
+            icon=template.icon,
+            sound=template.sound,
+            exit_code=cmd.exit_code
+        )
+
+
+VARIABLES: Dict[str, Callable[[CompleteCommand], Any]] = {
+    'duration': lambda cmd: "{}".format(timedelta(seconds=round(cmd.duration.total_seconds()))),
+    'command_line': lambda cmd: cmd.command.command_line,
+    'exit_code': lambda cmd: cmd.exit_code,
+    'started_at': lambda cmd: cmd.command.started_at,
+}
+
+
+class Template:
+    def __init__(self, source: str):
+        self.__source = source
+        self.__error: Optional[str] = None
+        self.__fields: FrozenSet[str] = frozenset()
+        self.__static: Optional[str] = None
 
         try:
-            title = apply_template(template.title, cmd)
-        except KeyError:
-            title = template.title
+            fields = set()
+            for _, field_name, _, _ in Formatter().parse(source):
+                if field_name is None:
+                    continue
+
+                name = re.split(r'[.\[]', field_name, maxsplit=1)[0]
+                if name not in VARIABLES:
+                    raise ValueError("unknown variable {{{}}}, expected one of: {}".format(
+                        field_name, ", ".join(sorted(VARIABLES))))
+
+                fields.add(name)
+
+            self.__fields = frozenset(fields)
+
+            if not self.__fields:
+                self.__static = source.format()
+        except ValueError as e:
+            self.__error = "invalid template {!r}: {}".format(source, e)
+
+    @property
+    def source(self) -> str:
+        return self.__source
+
+    @property
+    def fields(self) -> FrozenSet[str]:
+        return self.__fields
+
+    def validate(self):
+        if self.__error is not None:
+            raise ValueError(self.__error)
+
+    def render(self, cmd: CompleteCommand) -> str:
+        if self.__error is not None:
+            return self.__source
+
+        if self.__static is not None:
+            return self.__static
+
+        # only compute what the template actually uses
+        variables = {name: VARIABLES[name](cmd) for name in self.__fields}
 
         try:
-            message = apply_template(template.message, cmd)
-        except KeyError:
-            message = template.message
+            return self.__source.format_map(variables)
+        except (LookupError, AttributeError, ValueError, TypeError):
+            return self.__source
 
-        return Notification(title=title, message=message, icon=icon, sound=sound)
 
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> Template:
+    return Template(source)
 
-def apply_template(tpl: str, cmd: CompleteCommand) -> str:
-    vars = {
-        'duration': "{}".format(timedelta(seconds=round(cmd.duration.total_seconds()))),
-        'command_line': cmd.command.command_line,
-        'exit_code': cmd.exit_code
-    }
 
-    return tpl.format(**vars)
+def apply_template(tpl: str, cmd: CompleteCommand) -> str:
+    return compile_template(tpl).render(cmd)
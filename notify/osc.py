@@ -0,0 +1,176 @@
+"""
+An incremental parser of the custom control sequences init.sh prints, for transports other than iTerm2:
+
+    ESC ] 1337 ; Custom=id=IDENTITY:PAYLOAD BEL
+
+either as is, or wrapped in the passthrough sequence tmux needs (where every ESC in the wrapped sequence is doubled):
+
+    ESC P tmux; ESC ESC ] 1337 ; Custom=id=IDENTITY:PAYLOAD BEL ESC \\
+
+Input is consumed in chunks of any size, a sequence can be split across chunks; everything that isn't part of an OSC or
+DCS sequence is skipped without being copied, and sequences longer than max_length are dropped, so memory use doesn't
+depend on the size of the input.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+ESC = 0x1b
+BEL = 0x07
+
+CUSTOM_PREFIX = b'1337;Custom=id='
+TMUX_PREFIX = b'tmux;'
+
+# longer than any control sequence init.sh prints, including a long command line
+MAX_LENGTH = 64 * 1024
+
+_GROUND, _ESCAPE, _OSC, _OSC_ESCAPE, _DCS, _DCS_ESCAPE = range(6)
+
+_introducer = re.compile(b'\x1b[]P]')
+_osc_end = re.compile(b'[\x07\x1b]')
+
+
+@dataclass(frozen=True)
+class CustomSequence:
+    identity: str
+    payload: str
+
+
+class Parser:
+    def __init__(self, identity: Optional[str] = None, max_length: int = MAX_LENGTH):
+        # when identity is given, sequences with a different one are ignored
+        self.__identity = identity
+        self.__max_length = max_length
+        self.__state = _GROUND
+        self.__buffer = bytearray()
+        self.__overflow = False
+        self.__passthrough: Optional[Parser] = None
+        self.dropped = 0
+
+    def feed(self, data: bytes) -> List[CustomSequence]:
+        found: List[CustomSequence] = []
+        i, n = 0, len(data)
+
+        while i < n:
+            state = self.__state
+
+            if state == _GROUND:
+                # other escape sequences (eg. colors) are skipped along with the text
+                m = _introducer.search(data, i)
+                if m is None:
+                    if data[-1] == ESC:
+                        self.__state = _ESCAPE
+                    break
+
+                self.__start(_OSC if m.group() == b'\x1b]' else _DCS)
+                i = m.end()
+            elif state == _ESCAPE:
+                c = data[i]
+
+                if c == 0x5d:  # ]
+                    self.__start(_OSC)
+                elif c == 0x50:  # P
+                    self.__start(_DCS)
+                elif c != ESC:
+                    self.__state = _GROUND
+
+                i += 1
+            elif state == _OSC:
+                m = _osc_end.search(data, i)
+                end = m.start() if m is not None else n
+                self.__append(data, i, end)
+
+                if m is None:
+                    break
+
+                if data[end] == BEL:
+                    self.__state = _GROUND
+                    self.__osc_done(found)
+                else:
+                    self.__state = _OSC_ESCAPE
+
+                i = end + 1
+            elif state == _OSC_ESCAPE:
+                if data[i] == 0x5c:  # \, the string terminator
+                    self.__state = _GROUND
+                    self.__osc_done(found)
+                    i += 1
+                else:
+                    # an ESC that doesn't terminate the sequence starts another one, this one is abandoned
+                    self.__state = _ESCAPE
+            elif state == _DCS:
+                end = data.find(b'\x1b', i)
+                self.__append(data, i, end if end >= 0 else n)
+
+                if end < 0:
+                    break
+
+                self.__state = _DCS_ESCAPE
+                i = end + 1
+            else:
+                c = data[i]
+
+                if c == 0x5c:
+                    self.__state = _GROUND
+                    self.__dcs_done(found)
+                else:
+                    # a doubled ESC is an ESC of the wrapped sequence
+                    self.__state = _DCS
+                    self.__append(b'\x1b', 0, 1)
+                    if c != ESC:
+                        self.__append(data, i, i + 1)
+
+                i += 1
+
+        return found
+
+    def __start(self, state: int):
+        self.__state = state
+        self.__buffer.clear()
+        self.__overflow = False
+
+    def __append(self, data: bytes, start: int, end: int):
+        if self.__overflow or start == end:
+            return
+
+        if len(self.__buffer) + end - start > self.__max_length:
+            self.__overflow = True
+            self.__buffer.clear()
+            return
+
+        self.__buffer += data[start:end]
+
+    def __osc_done(self, found: List[CustomSequence]):
+        if self.__overflow:
+            self.dropped += 1
+            return
+
+        body = self.__buffer
+        if not body.startswith(CUSTOM_PREFIX):
+            return
+
+        colon = body.find(b':', len(CUSTOM_PREFIX))
+        if colon < 0:
+            return
+
+        identity = body[len(CUSTOM_PREFIX):colon].decode('utf-8', errors='replace')
+        if self.__identity is not None and identity != self.__identity:
+            return
+
+        found.append(CustomSequence(identity, body[colon + 1:].decode('utf-8', errors='replace')))
+
+    def __dcs_done(self, found: List[CustomSequence]):
+        if self.__overflow:
+            self.dropped += 1
+            return
+
+        if not self.__buffer.startswith(TMUX_PREFIX):
+            return
+
+        if self.__passthrough is None:
+            self.__passthrough = Parser(self.__identity, self.__max_length)
+
+        found.extend(self.__passthrough.feed(bytes(self.__buffer[len(TMUX_PREFIX):])))
+        self.dropped += self.__passthrough.dropped
+        self.__passthrough.dropped = 0
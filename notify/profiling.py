@@ -0,0 +1,190 @@
+"""
+Profiling of the running daemon, started from a shell for a given number of seconds:
+
+    iterm-notify config-set profiling cprofile 30
+
+Modes are:
+
+- cprofile: deterministic profiling of the event loop's thread, written as a pstats file
+- sample: the event loop's thread stack is sampled every few milliseconds from another thread, and written in the
+  collapsed-stack format read by flamegraph.pl and speedscope
+- trace: the time each dispatched control sequence took, one tab separated line per dispatch
+- off: stops profiling early
+
+Profiles are written in ~/.iterm-notify-profiles, under the file name given after the number of seconds or a name with
+the current time; since control sequences can come from any shell that knows the identity, a name can't point elsewhere
+and an existing file is never replaced.
+"""
+
+import cProfile
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import IO, Any, Callable, List, Optional, Tuple
+
+MODES = {'cprofile': 'pstats', 'sample': 'folded', 'trace': 'tsv'}
+
+DEFAULT_DIRECTORY = Path.home().joinpath('.iterm-notify-profiles')
+
+MAX_SECONDS = 600
+SAMPLE_INTERVAL = 0.005
+MAX_TRACE_ENTRIES = 100000
+
+Scheduler = Callable[[float, Callable[[], None]], Any]
+
+
+def _call_later(delay: float, callback: Callable[[], None]):
+    import asyncio
+    return asyncio.get_event_loop().call_later(delay, callback)
+
+
+class Sampler:
+    """Counts the stacks of a thread, sampled from a thread of its own every interval seconds."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.__thread_id = thread_id
+        self.__interval = interval
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='iterm-notify-sampler', daemon=True)
+        self.stacks: Counter = Counter()
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+
+    def __run(self):
+        while not self.__stopped.wait(self.__interval):
+            frame = sys._current_frames().get(self.__thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def write(self, f: IO[str]):
+        for stack, count in self.stacks.most_common():
+            f.write("{} {}\n".format(stack, count))
+
+
+class Profiler:
+    """Only one profiling session runs at a time; it's shared by all the sessions' dispatchers."""
+
+    def __init__(self, logger: logging.Logger, directory: Optional[Path] = None,
+                 schedule: Scheduler = _call_later, clock: Callable[[], float] = time.time):
+        self.__logger = logger
+        self.__directory = directory if directory is not None else DEFAULT_DIRECTORY
+        self.__schedule = schedule
+        self.__clock = clock
+        self.__mode: Optional[str] = None
+        self.__path: Optional[Path] = None
+        self.__timer = None
+        self.__profile: Optional[cProfile.Profile] = None
+        self.__sampler: Optional[Sampler] = None
+        self.__trace: List[Tuple[float, str, float]] = []
+
+    @property
+    def mode(self) -> Optional[str]:
+        return self.__mode
+
+    def start(self, mode: str, seconds: float, name: Optional[str] = None) -> Path:
+        if mode not in MODES:
+            raise ValueError("unknown profiling mode: {}, expected one of {}".format(mode, ", ".join(MODES)))
+
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError("profiling duration must be between 0 and {} seconds".format(MAX_SECONDS))
+
+        if self.__mode is not None:
+            raise RuntimeError("already profiling ({}) to {}".format(self.__mode, self.__path))
+
+        self.__path = self.__output_path(mode, name)
+        self.__mode = mode
+
+        if mode == 'cprofile':
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+        elif mode == 'sample':
+            self.__sampler = Sampler(threading.get_ident())
+            self.__sampler.start()
+        else:
+            self.__trace = []
+
+        self.__timer = self.__schedule(seconds, self.stop)
+        self.__logger.info("profiling (%s) for %ss to %s", mode, seconds, self.__path)
+
+        return self.__path
+
+    def stop(self) -> Optional[Path]:
+        if self.__mode is None:
+            return None
+
+        mode, path = self.__mode, self.__path
+        self.__mode = None
+
+        if self.__timer is not None and hasattr(self.__timer, 'cancel'):
+            self.__timer.cancel()
+        self.__timer = None
+
+        try:
+            if mode == 'cprofile':
+                self.__profile.disable()
+                # what dump_stats() does, without replacing a file created since the profiling started
+                self.__profile.create_stats()
+                with _create(path, 'wb') as f:
+                    marshal.dump(self.__profile.stats, f)
+            elif mode == 'sample':
+                self.__sampler.stop()
+                with _create(path, 'w') as f:
+                    self.__sampler.write(f)
+            else:
+                with _create(path, 'w') as f:
+                    for at, selector, elapsed in self.__trace:
+                        f.write("{:.6f}\t{}\t{:.6f}\n".format(at, selector, elapsed))
+        finally:
+            self.__profile = None
+            self.__sampler = None
+            self.__trace = []
+
+        self.__logger.info("profile (%s) written to %s", mode, path)
+        return path
+
+    def trace(self, selector: str, elapsed: float):
+        # called after every dispatch, so it must be cheap when not tracing
+        if self.__mode == 'trace' and len(self.__trace) < MAX_TRACE_ENTRIES:
+            self.__trace.append((self.__clock(), selector, elapsed))
+
+    def __output_path(self, mode: str, name: Optional[str]) -> Path:
+        if name:
+            # only the last component, anything else would let a control sequence write anywhere
+            name = Path(name).name
+            if name in ('', '.', '..'):
+                raise ValueError("invalid profile file name")
+        else:
+            name = 'profile-{}.{}'.format(int(self.__clock()), MODES[mode])
+
+        self.__directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+        path = self.__directory.joinpath(name)
+        if os.path.lexists(path):
+            raise FileExistsError("{} already exists".format(path))
+
+        return path
+
+
+def _create(path: Path, mode: str) -> IO:
+    # fails if path exists, even as a dangling symlink
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), mode)
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
@@ -0,0 +1,256 @@
+"""
+Recording of the events the daemon dispatches, and their replay, to reproduce what happened in a session storm or to
+measure throughput with a real workload:
+
+    ITERM_NOTIFY_RECORD=~/events.jsonl.gz ./notify.py
+    python -m notify.replay ~/events.jsonl.gz --speed 10
+
+A recording is a JSON header followed by one JSON array per event: seconds since the start of the recording, session
+id, selector, args and the time the shell sent the event (or null). It's gzipped if the file name ends with .gz.
+
+Replays use a fresh default configuration for every session, and record notifications instead of showing them.
+Commands are timed as they were when recorded, whatever the speed of the replay.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import IO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from notify.backends import Backend, BackendInitializer
+from notify.notifications import Notification
+
+FORMAT = 'iterm-notify-recording'
+VERSION = 1
+
+BACKENDS = ['iterm', 'osascript', 'terminal-notifier', 'log']
+
+
+@dataclass(frozen=True)
+class Event:
+    at: float
+    session_id: str
+    selector: str
+    args: List[str]
+    sent_at: Optional[float] = None
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if mode == 'w':
+        # recordings hold every command line typed, only the user may read them
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+        os.chmod(path, 0o600)
+
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+
+    return open(path, mode, encoding='utf-8')
+
+
+class Recorder:
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.__clock = clock
+        self.__started_at = clock()
+        self.__lock = threading.Lock()
+        self.__file: Optional[IO[str]] = _open(path, 'w')
+        self.__file.write(json.dumps({'format': FORMAT, 'version': VERSION, 'started_at': self.__started_at}) + '\n')
+        self.__file.flush()
+        self.events = 0
+
+    def for_session(self, session_id: str) -> Callable[[str, List[str], Optional[float]], None]:
+        """Returns a Dispatcher.on_dispatch handler that records the events of session_id."""
+
+        def record(selector: str, args: List[str], sent_at: Optional[float]):
+            self.record(session_id, selector, args, sent_at)
+
+        return record
+
+    def record(self, session_id: str, selector: str, args: List[str], sent_at: Optional[float] = None):
+        line = json.dumps([round(self.__clock() - self.__started_at, 6), session_id, selector, list(args), sent_at],
+                          separators=(',', ':'))
+
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.write(line + '\n')
+                # so that what's recorded can be read back if the daemon doesn't exit cleanly, gzipped or not
+                self.__file.flush()
+                self.events += 1
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+
+def read(path: str) -> Tuple[float, Iterator[Event]]:
+    """Returns the time the recording started at, and its events (read lazily, the file is closed after the last)."""
+    f = _open(path, 'r')
+
+    try:
+        header = json.loads(f.readline())
+        if header.get('format') != FORMAT or header.get('version') != VERSION:
+            raise ValueError("{} is not a recording of a known version".format(path))
+    except:
+        f.close()
+        raise
+
+    def events() -> Iterator[Event]:
+        with f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield Event(*json.loads(line))
+            except EOFError:
+                # a gzipped recording that wasn't closed: every line before the end was flushed whole
+                return
+
+    return header['started_at'], events()
+
+
+class RecordingBackend(Backend):
+    """Stands for any backend in a replay: notifications are appended to a list instead of being shown."""
+
+    def __init__(self, name: str, args: List[str], session_id: str,
+                 notifications: List[Tuple[str, str, Notification]]):
+        self.__name = name
+        self.__args = list(args)
+        self.__session_id = session_id
+        self.__notifications = notifications
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def args(self) -> List[str]:
+        return self.__args
+
+    @classmethod
+    def create_factory(cls, name: str, session_id: str,
+                       notifications: List[Tuple[str, str, Notification]]) -> BackendInitializer:
+        def create_recording(*args):
+            return cls(name, args, session_id, notifications)
+
+        return create_recording
+
+    def notify(self, n: Notification):
+        self.__notifications.append((self.__session_id, self.__name, n))
+
+
+class _Unfocused:
+    # nothing is focused during a replay, so when-inactive behaves like when-slow
+    active = False
+    current_session_id = None
+
+
+@dataclass
+class ReplayResult:
+    events: int = 0
+    sessions: int = 0
+    elapsed: float = 0.0
+    notifications: List[Tuple[str, str, Notification]] = field(default_factory=list)
+
+    @property
+    def events_per_second(self) -> float:
+        return self.events / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return "replayed {} events of {} sessions in {:.3f}s ({:.0f} events/s), {} notifications".format(
+            self.events, self.sessions, self.elapsed, self.events_per_second, len(self.notifications))
+
+
+def replay(started_at: float, events: Iterator[Event], speed: Optional[float] = 1.0,
+           logger: Optional[logging.Logger] = None,
+           sleep: Callable[[float], None] = time.sleep,
+           clock: Callable[[], float] = time.perf_counter) -> ReplayResult:
+    """
+    Dispatches events to a dispatcher per session, built like the daemon does; speed is how many times faster than
+    recorded the events are dispatched, None for as fast as possible.
+    """
+    from notify import build_dispatcher, config, strategies
+    from notify.backends import BackendFactory
+    from notify.commands import ShellClock
+    from notify.dispatcher import Dispatcher
+
+    result = ReplayResult()
+    dispatchers: Dict[str, Dispatcher] = {}
+
+    # the time the event being dispatched was recorded at, what the shell clocks of the replay see as now
+    recorded_now = [started_at]
+
+    def create_dispatcher(session_id: str) -> Dispatcher:
+        strategy_factories = {
+            'when-inactive': strategies.WhenInactive.create_factory(_Unfocused(), session_id=session_id),
+            'when-slow': strategies.WhenSlow.create_factory()
+        }
+
+        backend_factories = {name: RecordingBackend.create_factory(name, session_id, result.notifications)
+                             for name in BACKENDS}
+
+        session_logger = logging.getLogger(__name__).getChild(session_id)
+
+        return build_dispatcher(stack=config.Stack([config.create_default(session_id)]),
+                                strategy_factory=strategies.StrategyFactory(strategy_factories),
+                                backend_factory=BackendFactory(backend_factories),
+                                logger=session_logger,
+                                clock=ShellClock(session_logger, now=lambda: datetime.fromtimestamp(recorded_now[0])),
+                                session_id=session_id)
+
+    started = clock()
+
+    for event in events:
+        if speed is not None:
+            delay = event.at / speed - (clock() - started)
+            if delay > 0:
+                sleep(delay)
+
+        dsp = dispatchers.get(event.session_id)
+        if dsp is None:
+            dsp = dispatchers[event.session_id] = create_dispatcher(event.session_id)
+
+        recorded_now[0] = started_at + event.at
+        result.events += 1
+
+        try:
+            dsp.dispatch(event.selector, event.args, sent_at=event.sent_at)
+        except RuntimeError:
+            logger and logger.exception("can't dispatch %s", event.selector)
+
+    result.elapsed = clock() - started
+    result.sessions = len(dispatchers)
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m notify.replay', description="Replays a recording of events")
+    parser.add_argument('recording')
+    speed = parser.add_mutually_exclusive_group()
+    speed.add_argument('--speed', type=float, default=1.0, help="times faster than recorded, 1 by default")
+    speed.add_argument('--fast', action='store_true', help="as fast as possible")
+    parser.add_argument('--notifications', action='store_true', help="print the notifications")
+    args = parser.parse_args(argv)
+
+    if not args.fast and args.speed <= 0:
+        parser.error("--speed must be greater than 0")
+
+    started_at, events = read(args.recording)
+    result = replay(started_at, events, speed=None if args.fast else args.speed)
+
+    if args.notifications:
+        for session_id, backend, n in result.notifications:
+            print("{}\t{}\t{}\t{}".format(session_id, backend, n.title, n.message))
+
+    print(result, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+The selectors the daemon handles, and their handlers: built once and shared by the dispatchers of all sessions, which
+only differ by the SessionState they pass to the handlers.
+"""
+
+from types import MappingProxyType
+from typing import Callable, Dict, Mapping, Optional
+
+from notify import handlers
+from notify.dispatcher import Dispatcher, Route
+from notify.state import SessionState
+
+CONFIG = handlers.MaintainConfig()
+
+
+def _create_routes() -> Mapping[str, Route]:
+    command_complete = handlers.NotifyCommandComplete()
+
+    routes: Dict[str, Route] = {
+        "before-command": Route(command_complete.before_command, timestamped=True),
+        "after-command": Route(command_complete.after_command, timestamped=True),
+        "notify": Route(handlers.Notify().notify),
+    }
+
+    for key, setter in CONFIG.setters.items():
+        routes["set-" + key] = Route(setter)
+
+    routes["set-many"] = Route(CONFIG.set_many_handler)
+    routes["set-profiling"] = Route(handlers.Profile().profiling_handler)
+
+    return MappingProxyType(routes)
+
+
+ROUTES = _create_routes()
+
+
+def bind(state: SessionState, tracer: Optional[Callable[[str, float], None]] = None) -> Dispatcher:
+    """Returns a dispatcher of ROUTES for the session of state, applying its current configuration."""
+    CONFIG.attach(state)
+    return Dispatcher(state.logger, tracer=tracer, routes=ROUTES, state=state)
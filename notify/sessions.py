@@ -0,0 +1,130 @@
+import dataclasses
+import logging
+import resource
+import sys
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional
+
+from notify.actors import SessionActor
+from notify.config import Stack
+from notify.dispatcher import Dispatcher
+
+
+class LiveSession:
+    def __init__(self, session_id: str, logger: logging.Logger):
+        self.session_id = session_id
+        self.logger = logger
+        self.dispatcher: Optional[Dispatcher] = None
+        self.actor: Optional[SessionActor] = None
+        self.stack: Optional[Stack] = None
+        self.events = 0
+
+
+@dataclass(frozen=True)
+class SessionsReport:
+    live_sessions: int
+    dispatchers: int
+    stack_frames: int
+    approximate_size: int
+    max_rss: int
+
+    def __str__(self):
+        return "live sessions: {}, dispatchers: {}, stack frames: {}, ~{} bytes of session state, max RSS: {} bytes" \
+            .format(self.live_sessions, self.dispatchers, self.stack_frames, self.approximate_size, self.max_rss)
+
+
+class SessionRegistry:
+    def __init__(self):
+        self.__sessions: Dict[str, LiveSession] = {}
+
+    def __len__(self) -> int:
+        return len(self.__sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.__sessions
+
+    def __iter__(self) -> Iterator[LiveSession]:
+        return iter(list(self.__sessions.values()))
+
+    def get(self, session_id: str) -> Optional[LiveSession]:
+        return self.__sessions.get(session_id)
+
+    def get_or_create(self, session_id: str, create_logger: Callable[[str], logging.Logger]) -> LiveSession:
+        session = self.__sessions.get(session_id)
+
+        if session is None:
+            session = LiveSession(session_id, create_logger(session_id))
+            self.__sessions[session_id] = session
+
+        return session
+
+    def evict(self, session_id: str) -> bool:
+        session = self.__sessions.pop(session_id, None)
+        if session is None:
+            return False
+
+        release_logger(session_id, session.logger)
+
+        if session.actor is not None:
+            session.actor.close()
+
+        session.dispatcher = None
+        session.actor = None
+        session.stack = None
+        return True
+
+    def report(self) -> SessionsReport:
+        dispatchers = 0
+        frames = 0
+        size = 0
+
+        for s in self.__sessions.values():
+            if s.dispatcher is not None:
+                dispatchers += 1
+
+            if s.stack is not None:
+                frames += s.stack.depth
+                size += _deep_sizeof(s.stack.to_dict())
+
+        return SessionsReport(
+            live_sessions=len(self.__sessions),
+            dispatchers=dispatchers,
+            stack_frames=frames,
+            approximate_size=size,
+            max_rss=max_rss(),
+        )
+
+
+def release_logger(name: str, logger: logging.Logger):
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+
+    # loggers are never removed from the logging manager, so one per session would otherwise stay around forever
+    if logging.Logger.manager.loggerDict.get(name) is logger:
+        del logging.Logger.manager.loggerDict[name]
+
+
+def max_rss() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _deep_sizeof(o, seen: Optional[set] = None) -> int:
+    if seen is None:
+        seen = set()
+
+    if id(o) in seen:
+        return 0
+
+    seen.add(id(o))
+    size = sys.getsizeof(o)
+
+    if isinstance(o, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in o.items())
+    elif isinstance(o, (list, tuple, set)):
+        size += sum(_deep_sizeof(v, seen) for v in o)
+    elif dataclasses.is_dataclass(o):
+        size += sum(_deep_sizeof(getattr(o, f.name), seen) for f in dataclasses.fields(o))
+
+    return size
@@ -0,0 +1,47 @@
+import asyncio
+import errno
+import os
+import socket
+import stat
+
+
+def remove_stale(path: str):
+    """
+    Removes the socket at path if nothing listens on it anymore; raises OSError if something else is there, be it a
+    regular file or the socket of a running daemon.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return
+
+    if not stat.S_ISSOCK(st.st_mode):
+        raise FileExistsError(errno.EEXIST, "not a socket, refusing to replace it", path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+
+    raise OSError(errno.EADDRINUSE, "another process is listening on the socket", path)
+
+
+async def start_unix_server(handle, path: str, **kwargs) -> asyncio.AbstractServer:
+    """Like asyncio.start_unix_server(), but the socket is only accessible by the user from the moment it listens."""
+    # asyncio would replace a socket nobody listens on by itself, but not check that nobody does
+    remove_stale(path)
+
+    # nobody can connect before listen(), which asyncio calls: permissions are fixed in between, instead of changing the
+    # umask of the whole process
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        os.chmod(path, 0o600)
+        return await asyncio.start_unix_server(handle, sock=sock, **kwargs)
+    except BaseException:
+        sock.close()
+        raise
@@ -0,0 +1,90 @@
+import logging
+from typing import List, Optional, Protocol
+
+from notify.backends import BackendFactory
+from notify.commands import Command, ShellClock
+from notify.config import Stack
+from notify.notifications import Factory
+from notify.profiling import Profiler
+from notify.strategies import StrategyFactory
+
+
+class Services(Protocol):
+    """Creates the parts of a session's state that depend on where the daemon runs, when a handler first needs them."""
+
+    def create_strategy_factory(self, state: 'SessionState') -> StrategyFactory: ...
+
+    def create_backend_factory(self, state: 'SessionState') -> BackendFactory: ...
+
+
+class StaticServices:
+    """The same factories for every session."""
+
+    def __init__(self, strategy_factory: StrategyFactory, backend_factory: BackendFactory):
+        self.__strategy_factory = strategy_factory
+        self.__backend_factory = backend_factory
+
+    def create_strategy_factory(self, state: 'SessionState') -> StrategyFactory:
+        return self.__strategy_factory
+
+    def create_backend_factory(self, state: 'SessionState') -> BackendFactory:
+        return self.__backend_factory
+
+
+class SessionState:
+    """
+    What the handlers keep of a session: the handlers themselves are shared by all sessions. Anything but the stack is
+    created when it's first used, so a session that never runs a command costs little more than this object.
+    """
+
+    __slots__ = ('session_id', 'stack', 'logger', 'profiler', '__services', '__clock', '__commands',
+                 '__notification_factory', '__strategy_factory', '__backend_factory')
+
+    def __init__(self, session_id: str, stack: Stack, logger: logging.Logger, services: Services,
+                 profiler: Optional[Profiler] = None, clock: Optional[ShellClock] = None):
+        self.session_id = session_id
+        self.stack = stack
+        self.logger = logger
+        self.profiler = profiler
+        self.__services = services
+        self.__clock = clock
+        self.__commands: Optional[List[Command]] = None
+        self.__notification_factory: Optional[Factory] = None
+        self.__strategy_factory: Optional[StrategyFactory] = None
+        self.__backend_factory: Optional[BackendFactory] = None
+
+    @property
+    def clock(self) -> ShellClock:
+        if self.__clock is None:
+            self.__clock = ShellClock(self.logger)
+
+        return self.__clock
+
+    @property
+    def commands(self) -> List[Command]:
+        # commands started and not yet complete, innermost last
+        if self.__commands is None:
+            self.__commands = []
+
+        return self.__commands
+
+    @property
+    def notification_factory(self) -> Factory:
+        if self.__notification_factory is None:
+            self.__notification_factory = Factory(stack=self.stack)
+
+        return self.__notification_factory
+
+    @property
+    def strategy_factory(self) -> StrategyFactory:
+        if self.__strategy_factory is None:
+            self.__strategy_factory = self.__services.create_strategy_factory(self)
+
+        return self.__strategy_factory
+
+    @property
+    def backend_factory(self) -> BackendFactory:
+        if self.__backend_factory is None:
+            self.__backend_factory = self.__services.create_backend_factory(self)
+
+        return self.__backend_factory
@@ -1,11 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Protocol, Union
-
-import iterm2
+from typing import TYPE_CHECKING, Dict, Optional, Protocol, Union
 
+from notify.cache import LRUCache
 from notify.commands import CompleteCommand
 from notify.config import SelectedStrategy
 
+if TYPE_CHECKING:
+    import iterm2
+
 
 class App(Protocol):
     # noinspection PyPropertyDefinition
@@ -18,7 +20,7 @@ class App(Protocol):
 
 
 class iTermAppAdapter:
-    def __init__(self, iterm: iterm2.App):
+    def __init__(self, iterm: 'iterm2.App'):
         self.__iterm = iterm
 
     @property
@@ -35,6 +37,62 @@ class iTermAppAdapter:
         return None
 
 
+class FocusUpdates(Protocol):
+    async def async_get_next_update(self): ...
+
+
+class FocusTracker:
+    def __init__(self, fallback: App):
+        self.__fallback = fallback
+        self.__tracking = False
+        self.__active: Optional[bool] = None
+        self.__session_id: Optional[str] = None
+        self.__session_id_known = False
+        self.scans = 0
+
+    @property
+    def active(self) -> bool:
+        if not self.__tracking or self.__active is None:
+            return self.__fallback.active
+
+        return self.__active
+
+    @property
+    def current_session_id(self) -> Union[None, str]:
+        if not self.__tracking:
+            self.scans += 1
+            return self.__fallback.current_session_id
+
+        if not self.__session_id_known:
+            self.scans += 1
+            self.__session_id = self.__fallback.current_session_id
+            self.__session_id_known = True
+
+        return self.__session_id
+
+    def update(self, update):
+        if update.application_active is not None:
+            self.__active = update.application_active.application_active
+
+        if update.active_session_changed is not None:
+            self.__session_id = update.active_session_changed.session_id
+            self.__session_id_known = True
+        elif update.selected_tab_changed is not None or update.window_changed is not None:
+            # these only tell which tab or window got focus: scan for the session once, when it's next needed
+            self.__session_id_known = False
+
+    async def track(self, updates: FocusUpdates):
+        self.__tracking = True
+        self.__active = None
+        self.__session_id_known = False
+
+        try:
+            while True:
+                self.update(await updates.async_get_next_update())
+        finally:
+            self.__tracking = False
+
+
 class Strategy(ABC):
     @abstractmethod
     def should_notify(self, cmd: CompleteCommand) -> bool: ...
@@ -45,8 +103,13 @@ class StrategyInitializer(Protocol):
 
 
 class StrategyFactory:
-    def __init__(self, factories: Dict[str, StrategyInitializer]):
+    def __init__(self, factories: Dict[str, StrategyInitializer], cache_size: int = 4):
         self.__factories = factories
+        self.__cache: LRUCache[Strategy] = LRUCache(cache_size)
+
+    @property
+    def cache(self) -> LRUCache[Strategy]:
+        return self.__cache
 
     def create(self, selected_strategy: SelectedStrategy) -> Strategy:
         if not isinstance(selected_strategy, SelectedStrategy):
@@ -55,7 +118,17 @@ class StrategyFactory:
         if selected_strategy.name not in self.__factories:
             raise ValueError("unknown backend: {}".format(selected_strategy.name))
 
-        return self.__factories[selected_strategy.name](*selected_strategy.args)
+        return self.__cache.get_or_create(
+            _cache_key(selected_strategy),
+            lambda: self.__factories[selected_strategy.name](*selected_strategy.args)
+        )
+
+    def invalidate(self, selected_strategy: Optional[SelectedStrategy] = None):
+        self.__cache.invalidate(_cache_key(selected_strategy) if selected_strategy is not None else None)
+
+
+def _cache_key(selected_strategy: SelectedStrategy) -> tuple:
+    return selected_strategy.name, tuple(selected_strategy.args)
 
 
 class WhenSlow(Strategy):
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from typing import List
+from unittest import TestCase
+
+from notify.actors import BLOCK, COALESCE, DROP_OLDEST_CONFIG, INBOX_DEPTH, INBOX_SECONDS, SESSION_HANDLER_SECONDS
+from notify.actors import SessionActor
+from notify.dispatcher import Dispatcher
+from notify.wire import Message
+
+
+class RecordingDispatcher(Dispatcher):
+    def __init__(self):
+        super().__init__()
+        self.handled: List[str] = []
+        # handlers wait for it, so that the inbox fills up
+        self.gate = asyncio.Event()
+
+        async def handle(*args, selector):
+            await self.gate.wait()
+            self.handled.append(" ".join((selector,) + args))
+
+        for selector in ["before-command", "after-command", "notify", "set-success-title", "set-failure-title",
+                         "set-profiling"]:
+            self.register_handler(selector, lambda *args, s=selector: handle(*args, selector=s))
+
+
+def messages(*events: str) -> List[Message]:
+    return [Message(e.split()[0], e.split()[1:]) for e in events]
+
+
+class TestSessionActor(TestCase):
+    def run_actor(self, overflow: str, events: List[str], size: int = 3) -> List[str]:
+        async def run():
+            dsp = RecordingDispatcher()
+            actor = SessionActor("s1", dsp, size=size, overflow=overflow)
+
+            # the first event is taken out of the inbox right away, and blocks the handler
+            await actor.submit(Message("before-command", ["ls"]))
+            await asyncio.sleep(0)
+
+            # submitted one at a time, those that find the inbox full wait until the gate opens
+            submitted = []
+            for m in messages(*events):
+                submitted.append(asyncio.create_task(actor.submit(m)))
+                await asyncio.sleep(0)
+
+            dsp.gate.set()
+            await asyncio.gather(*submitted)
+            await actor.drain()
+            actor.close()
+
+            return dsp.handled
+
+        return asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    def test_in_order(self):
+        self.assertEqual(["before-command ls", "set-success-title a", "notify b", "after-command 0"],
+                         self.run_actor(BLOCK, ["set-success-title a", "notify b", "after-command 0"]))
+
+    def test_block(self):
+        async def run():
+            dsp = RecordingDispatcher()
+            actor = SessionActor("s1", dsp, size=1, overflow=BLOCK)
+
+            await actor.submit(Message("before-command", ["ls"]))
+            await asyncio.sleep(0)
+            await actor.submit(Message("set-success-title", ["a"]))
+
+            blocked = asyncio.create_task(actor.submit(Message("set-success-title", ["b"])))
+            await asyncio.sleep(0.01)
+            self.assertFalse(blocked.done())
+            self.assertEqual(1, actor.depth)
+
+            dsp.gate.set()
+            await blocked
+            await actor.drain()
+
+            self.assertEqual(["before-command ls", "set-success-title a", "set-success-title b"], dsp.handled)
+
+        asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    def test_drop_oldest_config(self):
+        self.assertEqual(["before-command ls", "notify n", "set-success-title b", "set-failure-title c"],
+                         self.run_actor(DROP_OLDEST_CONFIG, ["set-success-title a", "notify n", "set-success-title b",
+                                                             "set-failure-title c"]))
+
+    def test_drop_oldest_config_keeps_control_events(self):
+        self.assertEqual(["before-command ls", "set-profiling on", "notify n", "set-success-title b"],
+                         self.run_actor(DROP_OLDEST_CONFIG, ["set-profiling on", "set-success-title a", "notify n",
+                                                             "set-success-title b"]))
+
+    def test_drop_oldest_config_blocks_other_events(self):
+        self.assertEqual(["before-command ls", "set-success-title a", "notify n", "set-success-title b",
+                          "after-command 0"],
+                         self.run_actor(DROP_OLDEST_CONFIG, ["set-success-title a", "notify n", "set-success-title b",
+                                                             "after-command 0"]))
+
+    def test_coalesce(self):
+        self.assertEqual(["before-command ls", "notify n", "set-failure-title c", "set-success-title d"],
+                         self.run_actor(COALESCE, ["notify n", "set-success-title a", "set-failure-title c",
+                                                   "set-success-title d"]))
+
+    def test_coalesce_stays_within_a_command(self):
+        # set-success-title a is queued before after-command, so it's not coalesced: d waits for room instead
+        self.assertEqual(["before-command ls", "set-success-title a", "after-command 0", "notify n",
+                          "set-success-title d"],
+                         self.run_actor(COALESCE, ["set-success-title a", "after-command 0", "notify n",
+                                                   "set-success-title d"]))
+
+    def test_metrics(self):
+        async def run():
+            dsp = RecordingDispatcher()
+            dsp.gate.set()
+            actor = SessionActor("metrics-session", dsp)
+
+            await actor.submit(Message("notify", ["a", "b"]))
+            self.assertEqual(1, INBOX_DEPTH.value("metrics-session"))
+
+            await actor.drain()
+            self.assertEqual(0, INBOX_DEPTH.value("metrics-session"))
+            self.assertEqual(1, INBOX_SECONDS.count("metrics-session"))
+            self.assertEqual(1, SESSION_HANDLER_SECONDS.count("metrics-session"))
+
+            actor.close()
+            self.assertEqual(0, INBOX_SECONDS.count("metrics-session"))
+            self.assertEqual(0, SESSION_HANDLER_SECONDS.count("metrics-session"))
+
+        asyncio.run(run())
+
+    def test_close_handles_queued_events(self):
+        async def run():
+            dsp = RecordingDispatcher()
+            actor = SessionActor("closed-session", dsp)
+
+            for m in messages("before-command ls", "after-command 0", "notify n"):
+                await actor.submit(m)
+            await asyncio.sleep(0)
+
+            actor.close()
+            await actor.submit(Message("notify", ["late"]))
+
+            dsp.gate.set()
+            await actor.drain()
+
+            self.assertEqual(["before-command ls", "after-command 0", "notify n"], dsp.handled)
+            self.assertEqual(0, INBOX_SECONDS.count("closed-session"))
+
+        asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    def test_survives_dispatch_errors(self):
+        class FailingDispatcher(RecordingDispatcher):
+            async def dispatch_async(self, selector, args, sent_at=None):
+                if selector == 'set-failure-title':
+                    raise OSError("disk full")
+
+                await super().dispatch_async(selector, args, sent_at=sent_at)
+
+        async def run():
+            dsp = FailingDispatcher()
+            dsp.gate.set()
+            actor = SessionActor("failing-session", dsp, logger=logging.getLogger(__name__))
+
+            with self.assertLogs(__name__, 'ERROR'):
+                for m in messages("set-failure-title a", "notify n"):
+                    await actor.submit(m)
+                await actor.drain()
+
+            await actor.submit(Message("notify", ["m"]))
+            await actor.drain()
+            actor.close()
+
+            self.assertEqual(["notify n", "notify m"], dsp.handled)
+
+        asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            SessionActor("s1", Dispatcher(), overflow="nope")
@@ -1,10 +1,36 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import ANY, Mock
 from notify import *
-from notify.backends import Executor, OsaScript, TerminalNotifier
+from notify.backends import AsyncExecutor, Backend, BackendFactory, Executor, OsaScript, OsaScriptWorker, SubprocessPool, TerminalNotifier
+from notify.config import SelectedBackend
 from notify.notifications import Notification
 
 
+class TestBackendFactory(TestCase):
+    def test_caches_backends_by_selection(self):
+        initializer = Mock(side_effect=lambda *args: Mock(spec=Backend))
+        factory = BackendFactory({'test': initializer})
+
+        a = factory.create(SelectedBackend('test', ['a']))
+        self.assertIs(a, factory.create(SelectedBackend('test', ['a'])))
+        self.assertIsNot(a, factory.create(SelectedBackend('test', ['b'])))
+
+        factory.invalidate(SelectedBackend('test', ['a']))
+        self.assertIsNot(a, factory.create(SelectedBackend('test', ['a'])))
+
+        self.assertEqual(3, initializer.call_count)
+        self.assertEqual(1, factory.cache.hits)
+        self.assertEqual(3, factory.cache.misses)
+
+
 class TestTerminalNotifier(TestCase):
     DEFAULTS = ['/some/path', '-activate',
                 'com.googlecode.iterm2']
@@ -46,3 +72,127 @@ class TestOsaScriptNotifier(TestCase):
         self.__mock_executor.execute.assert_called_once_with(
             self.DEFAULTS + ['but something happened!', 'sorry to bother you', 'Glass'])
 
+    def test_notify_with_worker(self):
+        worker = Mock(spec=OsaScriptWorker)
+        notifier = OsaScript.create_factory(self.__mock_logger, self.__mock_executor, worker=worker)('worker')
+
+        n = Notification(title="sorry to bother you", message="but something happened!")
+        notifier.notify(n)
+
+        self.assertEqual(['worker'], notifier.args)
+        worker.send.assert_called_once_with(n)
+        self.__mock_executor.execute.assert_not_called()
+
+
+class TestOsaScriptWorker(TestCase):
+    # stands in for osascript: appends every record it receives to the file given as first argument
+    HELPER = "import sys\n" \
+             "with open(sys.argv[1], 'a') as f:\n" \
+             "    for line in sys.stdin:\n" \
+             "        f.write(line)\n" \
+             "        f.flush()\n"
+
+    def setUp(self) -> None:
+        self.__dir = TemporaryDirectory()
+        self.__output = Path(self.__dir.name).joinpath("received.jsonl")
+        self.__worker = OsaScriptWorker(Mock(spec=logging.Logger),
+                                        argv=[sys.executable, '-c', self.HELPER, str(self.__output)])
+
+    def tearDown(self) -> None:
+        self.__worker.stop()
+        self.__dir.cleanup()
+
+    def __received(self) -> list:
+        with open(str(self.__output)) as f:
+            return [json.loads(line) for line in f]
+
+    def test_send(self):
+        self.__worker.send(Notification(title="title", message="multi\nline message"))
+        self.__worker.send(Notification(title="other", message="message", sound="Glass"))
+        self.__worker.stop()
+
+        self.assertEqual([
+            {'title': 'title', 'message': 'multi\nline message', 'sound': None},
+            {'title': 'other', 'message': 'message', 'sound': 'Glass'},
+        ], self.__received())
+        self.assertEqual(0, self.__worker.restarts)
+
+    def test_restarts_dead_worker(self):
+        self.__worker.send(Notification(title="first", message="message"))
+        pid = self.__worker.pid
+
+        time.sleep(0.2)
+        os.kill(pid, signal.SIGKILL)
+        time.sleep(0.2)
+
+        self.__worker.send(Notification(title="second", message="message"))
+        self.assertNotEqual(pid, self.__worker.pid)
+        self.__worker.stop()
+
+        self.assertEqual(1, self.__worker.restarts)
+        self.assertEqual(['first', 'second'], [r['title'] for r in self.__received()])
+
+
+class TestAsyncExecutor(TestCase):
+    def setUp(self) -> None:
+        self.__mock_logger = Mock(spec=logging.Logger)
+
+    def test_execute_returns_immediately(self):
+        pool = SubprocessPool()
+        executor = AsyncExecutor(self.__mock_logger, pool)
+
+        async def run():
+            started = time.monotonic()
+            task = executor.execute(['sleep', '0.2'])
+            self.assertLess(time.monotonic() - started, 0.1)
+            self.assertEqual(1, pool.pending)
+            return await task
+
+        self.assertEqual(0, asyncio.run(run()))
+        self.assertEqual(0, pool.pending)
+        self.__mock_logger.error.assert_not_called()
+
+    def test_failures_are_logged(self):
+        executor = AsyncExecutor(self.__mock_logger, SubprocessPool())
+
+        async def run():
+            await asyncio.wait([executor.execute(['false'])])
+
+        asyncio.run(run())
+        self.__mock_logger.error.assert_called_once()
+
+    def test_timeout(self):
+        executor = AsyncExecutor(self.__mock_logger, SubprocessPool(timeout=0.1))
+
+        async def run():
+            started = time.monotonic()
+            await asyncio.wait([executor.execute(['sleep', '5'])])
+            return time.monotonic() - started
+
+        self.assertLess(asyncio.run(run()), 1)
+        self.assertIn("timed out", self.__mock_logger.error.call_args[0][0])
+
+    def test_bounded_concurrency(self):
+        executor = AsyncExecutor(self.__mock_logger, SubprocessPool(max_concurrency=1))
+
+        async def run():
+            started = time.monotonic()
+            await asyncio.wait([executor.execute(['sleep', '0.1']) for _ in range(3)])
+            return time.monotonic() - started
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.3)
+        self.__mock_logger.error.assert_not_called()
+
+    def test_cancel(self):
+        pool = SubprocessPool()
+        executor = AsyncExecutor(self.__mock_logger, pool)
+
+        async def run():
+            task = executor.execute(['sleep', '5'])
+            await asyncio.sleep(0.1)
+            pool.cancel()
+            await asyncio.wait([task])
+            return task
+
+        self.assertTrue(asyncio.run(run()).cancelled())
+        self.__mock_logger.warning.assert_called_once()
@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+from notify.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_get_or_create(self):
+        cache = LRUCache(max_size=2)
+
+        self.assertEqual("a", cache.get_or_create("a", lambda: "a"))
+        self.assertEqual("a", cache.get_or_create("a", lambda: "not a"))
+
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+
+        cache.get_or_create("a", lambda: "a")
+        cache.get_or_create("b", lambda: "b")
+        cache.get_or_create("a", lambda: "a")
+        cache.get_or_create("c", lambda: "c")
+
+        self.assertEqual(2, len(cache))
+        self.assertEqual("a", cache.get_or_create("a", lambda: "new a"))
+        self.assertEqual("new b", cache.get_or_create("b", lambda: "new b"))
+
+    def test_invalidate(self):
+        cache = LRUCache(max_size=2)
+
+        cache.get_or_create("a", lambda: "a")
+        cache.get_or_create("b", lambda: "b")
+
+        cache.invalidate("a")
+        self.assertEqual("new a", cache.get_or_create("a", lambda: "new a"))
+        self.assertEqual("b", cache.get_or_create("b", lambda: "new b"))
+
+        cache.invalidate()
+        self.assertEqual(0, len(cache))
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import Mock
+
+from notify.commands import ShellClock
+
+NOW = datetime(2019, 11, 4, 18, 0, 0)
+
+
+class TestShellClock(TestCase):
+    def setUp(self) -> None:
+        self.now = NOW
+        self.logger = Mock(['warning'])
+        self.clock = ShellClock(self.logger, max_skew=2.0, now=lambda: self.now)
+
+    def test_prefers_shell_timestamps(self):
+        sent_at = (NOW - timedelta(seconds=0.5)).timestamp()
+
+        self.assertEqual(datetime.fromtimestamp(sent_at), self.clock.timestamp(sent_at))
+        self.assertAlmostEqual(0.5, self.clock.offset)
+
+    def test_without_shell_timestamps(self):
+        self.assertEqual(NOW, self.clock.timestamp(None))
+        self.assertIsNone(self.clock.offset)
+
+    def test_offset_is_smallest_delay(self):
+        self.clock.timestamp((NOW - timedelta(seconds=3)).timestamp())
+        self.clock.timestamp((NOW - timedelta(seconds=0.25)).timestamp())
+        self.clock.timestamp((NOW - timedelta(seconds=1)).timestamp())
+
+        self.assertAlmostEqual(0.25, self.clock.offset)
+
+        # events without a timestamp are moved to the shell's clock
+        self.assertEqual(NOW - timedelta(seconds=0.25), self.clock.timestamp(None))
+
+    def test_warns_once_about_skew(self):
+        self.clock.timestamp((NOW - timedelta(seconds=1)).timestamp())
+        self.logger.warning.assert_not_called()
+
+        self.clock.timestamp((NOW + timedelta(seconds=30)).timestamp())
+        self.clock.timestamp((NOW + timedelta(seconds=60)).timestamp())
+
+        self.logger.warning.assert_called_once()
+        msg, *args = self.logger.warning.call_args[0]
+        self.assertIn("30.0s ahead of", msg % tuple(args))
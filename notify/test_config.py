@@ -1,9 +1,12 @@
+import asyncio
 import logging
 from copy import copy
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest.case import TestCase
 from unittest.mock import Mock
 
-from notify.config import SessionManager, Stack, create_default
+from notify.config import FileStorage, JournalStorage, SessionManager, Stack, create_default
 
 
 class TestManager(TestCase):
@@ -43,6 +46,198 @@ class TestManager(TestCase):
 
         mock_storage.save.assert_called_once_with(expected_saved_data)
 
+    def test_async_load_and_prune(self):
+        mock_storage = Mock(['load', 'save'])
+        mock_storage.load = Mock(return_value=self.SAMPLE_DATA)
+
+        mgr = SessionManager(mock_storage, logger=Mock(spec=logging.Logger))
+        asyncio.run(mgr.async_load_and_prune(['CURRENT_SESSION']))
+
+        self.assertEqual(['CURRENT_SESSION'], list(mock_storage.save.call_args[0][0]))
+
+    def test_initialized_stack_is_persisted_on_change(self):
+        mock_storage = Mock(['load', 'save'])
+        mock_storage.load = Mock(return_value={})
+
+        mgr = SessionManager(mock_storage, logger=Mock(spec=logging.Logger))
+        mgr.load_and_prune([])
+
+        stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        stack.push()
+        stack.success_title = "bar"
+
+        saved = mock_storage.save.call_args[0][0]
+        self.assertEqual("bar", saved["foo"][1]["success-title"])
+
+    def test_coalesces_changes_within_window(self):
+        mock_storage = Mock(['load', 'save'])
+        mock_storage.load = Mock(return_value={})
+        mock_storage.save = Mock(return_value=10)
+
+        mgr = SessionManager(mock_storage, logger=Mock(spec=logging.Logger), coalesce_window=0.01)
+
+        async def run():
+            stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+            for _ in range(50):
+                stack.push()
+                stack.success_title = "bar"
+                stack.pop()
+
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+
+        mock_storage.save.assert_called_once()
+        self.assertEqual(1 + 50 * 3, mgr.stats.events_received)
+        self.assertEqual(1, mgr.stats.flushes)
+        self.assertEqual(10, mgr.stats.bytes_written)
+
+    def test_close_flushes_pending_changes(self):
+        mock_storage = Mock(['load', 'save'])
+
+        mgr = SessionManager(mock_storage, logger=Mock(spec=logging.Logger), coalesce_window=60)
+
+        async def run():
+            stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+            stack.success_title = "bar"
+
+        asyncio.run(run())
+        mock_storage.save.assert_not_called()
+
+        mgr.close()
+        mock_storage.save.assert_called_once()
+        self.assertEqual("bar", mock_storage.save.call_args[0][0]["foo"][0]["success-title"])
+
+    def test_delete(self):
+        mock_storage = Mock(['load', 'save'])
+
+        mgr = SessionManager(mock_storage, logger=Mock(spec=logging.Logger))
+        stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        mgr.delete("foo")
+
+        self.assertEqual({}, mock_storage.save.call_args[0][0])
+
+        mock_storage.save.reset_mock()
+        stack.push()
+        mock_storage.save.assert_not_called()
+
+
+class TestFileStorage(TestCase):
+    def test_save_and_load(self):
+        with TemporaryDirectory() as d:
+            path = Path(d).joinpath("state.json")
+            fs = FileStorage(path, logger=Mock(spec=logging.Logger))
+
+            self.assertEqual({}, fs.load())
+
+            written = fs.save({"foo": [{"a": 1}]})
+            self.assertEqual(path.stat().st_size, written)
+            self.assertEqual({"foo": [{"a": 1}]}, fs.load())
+            self.assertEqual(["state.json"], [p.name for p in Path(d).iterdir()])
+
+
+class TestJournalStorage(TestCase):
+    def setUp(self) -> None:
+        self.__dir = TemporaryDirectory()
+        self.__path = Path(self.__dir.name).joinpath("journal.jsonl")
+
+    def tearDown(self) -> None:
+        self.__dir.cleanup()
+
+    def __create_manager(self, **kwargs) -> SessionManager:
+        journal = JournalStorage(self.__path, logger=Mock(spec=logging.Logger), **kwargs)
+        return SessionManager(journal, logger=Mock(spec=logging.Logger))
+
+    def test_replay(self):
+        mgr = self.__create_manager()
+        mgr.load_and_prune([])
+
+        foo = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        bar = mgr.initialize_session_stack("bar", Stack([create_default("bar")]))
+
+        foo.success_title = "base"
+        foo.push()
+        foo.success_title = "pushed"
+        bar.push()
+        bar.failure_title = "bar"
+        mgr.delete("bar")
+        mgr.close()
+
+        mgr = self.__create_manager()
+        mgr.load_and_prune(["foo"])
+
+        stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        self.assertEqual("pushed", stack.success_title)
+        stack.pop()
+        self.assertEqual("base", stack.success_title)
+        mgr.close()
+
+    def test_initialize_again_returns_latest_stack(self):
+        mgr = self.__create_manager()
+        mgr.load_and_prune([])
+
+        stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        stack.push()
+        stack.success_title = "pushed"
+
+        stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        self.assertEqual("pushed", stack.success_title)
+        stack.pop()
+        self.assertEqual(create_default("foo").success_title, stack.success_title)
+        mgr.close()
+
+    def test_appends_one_line_per_mutation(self):
+        mgr = self.__create_manager()
+        mgr.load_and_prune([])
+
+        stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        stack.push()
+        stack.pop()
+        mgr.close()
+
+        with open(str(self.__path)) as f:
+            self.assertEqual(4, len(f.readlines()))
+
+        self.assertEqual(self.__path.stat().st_size, mgr.stats.bytes_written)
+
+    def test_compaction(self):
+        journal = JournalStorage(self.__path, logger=Mock(spec=logging.Logger), compact_threshold=4096)
+        mgr = SessionManager(journal, logger=Mock(spec=logging.Logger))
+        mgr.load_and_prune([])
+
+        stack = mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        for i in range(200):
+            stack.push()
+            stack.success_title = str(i)
+
+        mgr.close()
+
+        self.assertGreater(journal.compactions, 0)
+        self.assertLess(self.__path.stat().st_size, mgr.stats.bytes_written)
+
+        data = JournalStorage(self.__path, logger=Mock(spec=logging.Logger)).load()
+        self.assertEqual(201, len(data["foo"]))
+        self.assertEqual("199", data["foo"][-1]["success-title"])
+
+    def test_ignores_torn_records(self):
+        mgr = self.__create_manager()
+        mgr.load_and_prune([])
+        mgr.initialize_session_stack("foo", Stack([create_default("foo")]))
+        mgr.close()
+
+        with open(str(self.__path), 'a') as f:
+            f.write('{"op": "pu')
+
+        mgr = self.__create_manager()
+        mgr.load_and_prune(["foo"])
+        stack = mgr.initialize_session_stack("foo", Stack([create_default("bar")]))
+        stack.push()
+        mgr.close()
+
+        data = JournalStorage(self.__path, logger=Mock(spec=logging.Logger)).load()
+        self.assertEqual(2, len(data["foo"]))
+        self.assertEqual("foo", data["foo"][0]["logger-name"])
+
 
 class TestStack(TestCase):
     def test_push_pop(self):
@@ -80,3 +275,69 @@ class TestStack(TestCase):
 
         s.pop()
         f.assert_called_once()
+
+    def test_push_stores_only_overrides(self):
+        s = Stack([create_default("foo")])
+
+        s.push()
+        s.push()
+        self.assertEqual([create_default("foo").to_dict(), {}, {}], s.to_dict())
+
+        s.success_title = "bar"
+        self.assertEqual({'success-title': 'bar'}, s.to_dict()[-1])
+        self.assertEqual("bar", s.current.success_title)
+        self.assertEqual("foo", s.current.logger_name)
+
+        s.success_title = create_default("foo").success_title
+        self.assertEqual({}, s.to_dict()[-1])
+
+    def test_setting_same_value_does_not_change(self):
+        s = Stack([create_default("foo")])
+        f = Mock()
+        s.on_change += f
+
+        s.logger_name = "foo"
+        s.current = create_default("foo")
+        f.assert_not_called()
+
+        s.logger_name = "bar"
+        f.assert_called_once()
+
+    def test_batch_reports_one_change(self):
+        s = Stack([create_default("foo")])
+        f = Mock()
+        s.on_change += f
+
+        with s.batch():
+            s.logger_name = "bar"
+            s.success_title = "baz"
+            f.assert_not_called()
+
+        f.assert_called_once()
+        self.assertEqual("bar", s.current.logger_name)
+        self.assertEqual("baz", s.current.success_title)
+
+        with s.batch():
+            s.logger_name = "qux"
+            s.logger_name = "bar"
+
+        f.assert_called_once()
+
+    def test_from_dict(self):
+        base = create_default("foo")
+
+        # frames used to be saved in full, they are still understood
+        s = Stack.from_dict([
+            base.to_dict(),
+            create_default("bar").to_dict(),
+            {'success-title': 'baz'},
+        ])
+
+        self.assertEqual(3, s.depth)
+        self.assertEqual("baz", s.current.success_title)
+        self.assertEqual("bar", s.current.logger_name)
+        self.assertEqual({'logger-name': 'bar'}, s.to_dict()[1])
+
+        s.pop()
+        s.pop()
+        self.assertEqual(base, s.current)
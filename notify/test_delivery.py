@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from unittest import TestCase
+from unittest.mock import Mock
+
+from notify.backends import Backend
+from notify.delivery import DELIVERY_COLLAPSED, DELIVERY_DROPPED, DeliveryQueue, RateLimiter, summarize
+from notify.notifications import Notification
+
+
+def create_backend(name: str = "test") -> Mock:
+    backend = Mock(spec=Backend)
+    backend.name = name
+    backend.args = []
+    return backend
+
+
+class TestDeliveryQueue(TestCase):
+    def test_delivers_single_notification_as_is(self):
+        backend = create_backend()
+        q = DeliveryQueue(Mock(spec=logging.Logger), window=0.01)
+        n = Notification(title="title", message="message", exit_code=0)
+
+        async def run():
+            q.submit(backend, n)
+            self.assertEqual(1, q.depth)
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+
+        backend.notify.assert_called_once_with(n)
+        self.assertEqual(0, q.depth)
+
+    def test_collapses_notifications_within_window(self):
+        backend = create_backend("collapsing")
+        q = DeliveryQueue(Mock(spec=logging.Logger), window=0.01)
+
+        async def run():
+            for i in range(12):
+                q.submit(backend, Notification(title="title", message="cmd {}".format(i), exit_code=i % 4))
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+
+        backend.notify.assert_called_once()
+        n = backend.notify.call_args[0][0]
+        self.assertEqual("12 commands finished, 9 failed", n.title)
+        self.assertEqual(11, q.collapsed)
+        self.assertEqual(11, DELIVERY_COLLAPSED.value("collapsing"))
+
+    def test_groups_by_backend(self):
+        foo = create_backend("foo")
+        bar = create_backend("bar")
+        q = DeliveryQueue(Mock(spec=logging.Logger), window=0.01)
+
+        async def run():
+            q.submit(foo, Notification(title="foo", message="message"))
+            q.submit(bar, Notification(title="bar", message="message"))
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+
+        self.assertEqual("foo", foo.notify.call_args[0][0].title)
+        self.assertEqual("bar", bar.notify.call_args[0][0].title)
+
+    def test_rate_limit_defers_and_collapses(self):
+        backend = create_backend()
+        q = DeliveryQueue(Mock(spec=logging.Logger), window=0.01, rate=10, burst=1)
+
+        async def run():
+            q.submit(backend, Notification(title="first", message="message"))
+            await asyncio.sleep(0.03)
+            q.submit(backend, Notification(title="second", message="message"))
+            q.submit(backend, Notification(title="third", message="message"))
+            await asyncio.sleep(0.03)
+            self.assertEqual(1, backend.notify.call_count)
+            await asyncio.sleep(0.15)
+
+        asyncio.run(run())
+
+        self.assertEqual(2, backend.notify.call_count)
+        self.assertEqual("2 notifications", backend.notify.call_args[0][0].title)
+
+    def test_drops_when_full(self):
+        backend = create_backend("dropping")
+        q = DeliveryQueue(Mock(spec=logging.Logger), window=60, max_depth=2)
+
+        async def run():
+            for _ in range(5):
+                q.submit(backend, Notification(title="title", message="message"))
+            self.assertEqual(2, q.depth)
+            q.flush()
+
+        asyncio.run(run())
+
+        self.assertEqual(3, q.dropped)
+        self.assertEqual(3, DELIVERY_DROPPED.value("dropping"))
+        self.assertEqual(1, q.delivered)
+
+
+class TestRateLimiter(TestCase):
+    def test(self):
+        limiter = RateLimiter(rate=1, burst=2)
+
+        self.assertTrue(limiter.take(0))
+        self.assertTrue(limiter.take(0))
+        self.assertFalse(limiter.take(0.5))
+        self.assertAlmostEqual(0.5, limiter.wait_time(0.5))
+        self.assertTrue(limiter.take(1))
+
+
+class TestSummarize(TestCase):
+    def test_mixed(self):
+        n = summarize([
+            Notification(title="a", message="ls", exit_code=0),
+            Notification(title="b", message="make", exit_code=2, sound="Basso"),
+            Notification(title="c", message="hello"),
+            Notification(title="d", message="true", exit_code=0),
+        ])
+
+        self.assertEqual("4 notifications, 1 failed", n.title)
+        self.assertEqual("ls, make, hello and 1 more", n.message)
+        self.assertEqual("Basso", n.sound)
@@ -1,5 +1,7 @@
+import asyncio
+import logging
 from unittest import TestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
 
 from notify.dispatcher import Dispatcher
 
@@ -19,8 +21,89 @@ class TestDispatcher(TestCase):
         foo.handle.assert_called_with('a', 'b')
         bar.handle.assert_not_called()
 
+    def test_failing_hook_does_not_prevent_dispatch(self):
+        foo = MagicMock(['handle'])
+        d = Dispatcher(logger=logging.getLogger(__name__))
+        d.register_handler("foo", foo.handle)
+
+        def failing_hook(*args):
+            raise OSError("disk full")
+
+        d.on_dispatch += failing_hook
+
+        with self.assertLogs(__name__, 'ERROR'):
+            d.dispatch("foo", ['a'])
+            asyncio.run(d.dispatch_async("foo", ['b']))
+
+        self.assertEqual([call('a'), call('b')], foo.handle.mock_calls)
+
     def test_dispatcher_raises_with_unknown_handler(self):
         d = Dispatcher()
 
         with self.assertRaises(RuntimeError):
             d.dispatch("foo", ['a'])
+
+    def test_timestamped_handlers_get_sent_at(self):
+        foo = MagicMock(['handle'])
+        bar = MagicMock(['handle'])
+
+        d = Dispatcher()
+
+        d.register_handler("foo", foo.handle, timestamped=True)
+        d.register_handler("bar", bar.handle)
+
+        d.dispatch("foo", ['a'], sent_at=1.5)
+        d.dispatch("foo", ['b'])
+        d.dispatch("bar", ['c'], sent_at=1.5)
+
+        foo.handle.assert_any_call('a', sent_at=1.5)
+        foo.handle.assert_called_with('b', sent_at=None)
+        bar.handle.assert_called_once_with('c')
+
+    def test_dispatch_updates_metrics(self):
+        from notify.dispatcher import EVENTS, HANDLER_ERRORS, HANDLER_SECONDS
+
+        d = Dispatcher()
+        d.register_handler("metrics-ok", MagicMock())
+        d.register_handler("metrics-failing", MagicMock(side_effect=ValueError))
+
+        d.dispatch("metrics-ok", [])
+        d.dispatch("metrics-ok", [])
+        d.dispatch("metrics-failing", [])
+
+        self.assertEqual(2, EVENTS.value("metrics-ok"))
+        self.assertEqual(0, HANDLER_ERRORS.value("metrics-ok"))
+        self.assertEqual(1, HANDLER_ERRORS.value("metrics-failing"))
+        self.assertEqual(2, HANDLER_SECONDS.count("metrics-ok"))
+
+    def test_dispatch_async_awaits_coroutine_handlers(self):
+        from notify.dispatcher import HANDLER_ERRORS
+
+        handled = []
+
+        async def handler(arg):
+            await asyncio.sleep(0)
+            handled.append(arg)
+
+        async def failing():
+            raise ValueError
+
+        d = Dispatcher()
+        d.register_handler("async-foo", handler)
+        d.register_handler("async-failing", failing)
+        d.register_handler("sync-foo", handled.append)
+
+        async def run():
+            await d.dispatch_async("async-foo", ['a'])
+            await d.dispatch_async("sync-foo", ['b'])
+            await d.dispatch_async("async-failing", [])
+
+            # from synchronous code, coroutine handlers run on their own
+            d.dispatch("async-foo", ['c'])
+            self.assertEqual(['a', 'b'], handled)
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+
+        self.assertEqual(['a', 'b', 'c'], handled)
+        self.assertEqual(1, HANDLER_ERRORS.value("async-failing"))
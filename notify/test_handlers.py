@@ -1,7 +1,10 @@
+from datetime import datetime, timedelta
 from unittest.case import TestCase
+from types import SimpleNamespace
 from unittest.mock import Mock, PropertyMock
 
 from notify.backends import BackendFactory
+from notify.commands import ShellClock
 from notify.config import SelectedBackend, Stack
 from notify.handlers import Notify, NotifyCommandComplete
 from notify.notifications import Factory, Notification
@@ -24,8 +27,9 @@ class TestNotify(TestCase):
 
         mock_notification_factory.create.return_value = n
 
-        notify = Notify(mock_stack, notification_factory=mock_notification_factory, backend_factory=mock_backend_factory)
-        notify.notify("message", "title")
+        state = SimpleNamespace(stack=mock_stack, notification_factory=mock_notification_factory,
+                                backend_factory=mock_backend_factory)
+        Notify().notify(state, "message", "title")
 
         mock_notification_factory.create.assert_called_with(message='message', title='title', success=True)
         mock_backend.notify.assert_called_with(n)
@@ -62,19 +66,21 @@ class TestNotifyCommandComplete(TestCase):
         self.__stack = Mock(['push', 'pop', 'current'])
         type(self.__stack).current = PropertyMock(return_value=self.__current_config)
 
-        self.command = NotifyCommandComplete(
-            stack=self.__stack,
-            strategy_factory=self.__strategy_factory,
-            notification_factory=self.__factory,
-            backend_factory=self.__backend_factory,
-        )
+        self.__state = self.__create_state(ShellClock())
+        self.command = NotifyCommandComplete()
+
+    def __create_state(self, clock: ShellClock) -> SimpleNamespace:
+        return SimpleNamespace(stack=self.__stack, commands=[], clock=clock,
+                               strategy_factory=self.__strategy_factory,
+                               notification_factory=self.__factory,
+                               backend_factory=self.__backend_factory)
 
     def test_push_pop(self):
-        self.command.before_command(*['ls -la'])
+        self.command.before_command(self.__state, *['ls -la'])
         self.__stack.push.assert_called_once()
         self.__stack.pop.assert_not_called()
 
-        self.command.after_command(*['0'])
+        self.command.after_command(self.__state, *['0'])
         self.__stack.push.assert_called_once()
         self.__stack.pop.assert_called_once()
 
@@ -85,8 +91,8 @@ class TestNotifyCommandComplete(TestCase):
 
         self.__backend_factory.notify = Mock(return_value=None)
 
-        self.command.before_command(*["ls -la"])
-        self.command.after_command(*["0"])
+        self.command.before_command(self.__state, *["ls -la"])
+        self.command.after_command(self.__state, *["0"])
 
         self.__strategy.should_notify.assert_called_once()
         self.assertEqual("ls -la", self.__strategy.should_notify.call_args[0][0].command.command_line)
@@ -100,8 +106,8 @@ class TestNotifyCommandComplete(TestCase):
     def test_after_handler_notification(self):
         self.__strategy.should_notify = Mock(return_value=True)
 
-        self.command.before_command(*["ls -la"])
-        self.command.after_command(*["0"])
+        self.command.before_command(self.__state, *["ls -la"])
+        self.command.after_command(self.__state, *["0"])
 
         self.__strategy.should_notify.assert_called_once()
         self.assertEqual("ls -la", self.__strategy.should_notify.call_args[0][0].command.command_line)
@@ -117,7 +123,7 @@ class TestNotifyCommandComplete(TestCase):
         self.__strategy.should_notify = Mock(return_value=False)
 
         with self.assertRaises(RuntimeError):
-            self.command.after_command(*["0"])
+            self.command.after_command(self.__state, *["0"])
 
         self.__strategy.should_notify.assert_not_called()
         self.__factory.from_command.assert_not_called()
@@ -125,3 +131,16 @@ class TestNotifyCommandComplete(TestCase):
 
         self.__stack.push.assert_not_called()
         self.__stack.pop.assert_not_called()
+
+    def test_duration_uses_shell_timestamps(self):
+        # the daemon gets to both events late, and at the same time
+        received = datetime(2019, 11, 4, 18, 0, 0)
+        state = self.__create_state(ShellClock(now=lambda: received))
+        self.__strategy.should_notify = Mock(return_value=False)
+
+        self.command.before_command(state, "make", sent_at=(received - timedelta(seconds=50)).timestamp())
+        self.command.after_command(state, "0", sent_at=(received - timedelta(seconds=8)).timestamp())
+
+        complete_cmd = self.__strategy.should_notify.call_args[0][0]
+        self.assertEqual(timedelta(seconds=42), complete_cmd.duration)
+        self.assertEqual(received - timedelta(seconds=50), complete_cmd.command.started_at)
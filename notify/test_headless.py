@@ -0,0 +1,64 @@
+import logging
+import os
+from unittest import TestCase
+from unittest.mock import Mock
+
+from notify import wire
+from notify.backends import Backend
+from notify.headless import Headless
+
+
+def sequence(selector: str, *args: str, sent_at=None, identity="FOO_ID") -> bytes:
+    return "\033]1337;Custom=id={}:{}\a".format(identity, wire.encode(selector, list(args), sent_at=sent_at)) \
+        .encode('ascii')
+
+
+class TestHeadless(TestCase):
+    def setUp(self):
+        self.backend = Mock(spec=Backend)
+        self.headless = Headless("FOO_ID", logging.getLogger(__name__),
+                                 backend_factories={'log': lambda *args: self.backend})
+
+    def test_dispatches_sequences(self):
+        first = sequence("set-success-title", "done")
+        output = first + b"$ sleep 20\r\n" + \
+            sequence("before-command", "sleep 20", sent_at=1572889271.0) + \
+            sequence("after-command", "0", sent_at=1572889291.0, identity="OTHER") + \
+            sequence("after-command", "0", sent_at=1572889291.0)
+
+        self.assertEqual(1, self.headless.feed(output[:len(first) + 5]))
+        self.assertEqual(2, self.headless.feed(output[len(first) + 5:]))
+
+        self.assertEqual("done", self.headless.stack.success_title)
+        self.backend.notify.assert_called_once()
+        self.assertEqual("sleep 20", self.backend.notify.call_args[0][0].message)
+
+    def test_bad_sequences_are_skipped(self):
+        with self.assertLogs(__name__, logging.ERROR) as logs:
+            self.assertEqual(3, self.headless.feed(b"\033]1337;Custom=id=FOO_ID:@2,99:x\a" +
+                                                   sequence("no-such-selector") +
+                                                   sequence("notify", "message", "title")))
+
+        self.assertEqual(2, len(logs.output))
+
+        self.assertEqual(3, self.headless.events)
+        self.backend.notify.assert_called_once()
+
+    def test_run_reads_until_the_end_of_a_pipe(self):
+        r, w = os.pipe()
+
+        with os.fdopen(w, 'wb') as f:
+            f.write(sequence("notify", "message", "title") * 2)
+
+        with os.fdopen(r, 'rb', buffering=0) as f:
+            self.assertEqual(2, self.headless.run(f, chunk_size=7))
+
+        self.assertEqual(2, self.backend.notify.call_count)
+
+    def test_log_backend(self):
+        logger = logging.getLogger(__name__)
+
+        with self.assertLogs(logger, logging.INFO) as logs:
+            Headless("FOO_ID", logger).feed(sequence("notify", "message", "title"))
+
+        self.assertTrue(any("message" in line and "title" in line for line in logs.output))
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+import socket
+import stat
+import tempfile
+from typing import List
+from unittest import TestCase
+
+from notify import ingest
+
+
+def exchange(path: str, lines: List[str]) -> List[dict]:
+    # a plain blocking client, like a script would use
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall("".join(line + "\n" for line in lines).encode('utf-8'))
+        s.shutdown(socket.SHUT_WR)
+
+        received = b""
+        while True:
+            chunk = s.recv(4096)
+            if not chunk:
+                break
+            received += chunk
+
+    return [json.loads(line) for line in received.splitlines()]
+
+
+class TestParse(TestCase):
+    def test_single_and_batch(self):
+        self.assertEqual([('ingest', 'notify', ['message', 'title'])],
+                         ingest.parse(b'{"selector": "notify", "args": ["message", "title"]}'))
+        self.assertEqual([('s1', 'set-success-title', ['done']), ('ingest', 'notify', [])],
+                         ingest.parse(b'[{"selector": "set-success-title", "args": ["done"], "session": "s1"},'
+                                      b' {"selector": "notify"}]'))
+
+    def test_invalid(self):
+        for line in [b'nope', b'"notify"', b'{"selector": "after-command", "args": ["0"]}', b'{"args": []}',
+                     b'{"selector": "notify", "args": "message"}', b'{"selector": "notify", "args": [1]}',
+                     b'{"selector": "notify", "session": ""}', b'[{"selector": "notify"}, {"selector": "x"}]',
+                     b'{"selector": "set-profiling", "args": ["trace"]}', b'{"selector": "set-nope", "args": ["x"]}',
+                     b'\xff']:
+            with self.subTest(line):
+                with self.assertRaises(ValueError):
+                    ingest.parse(line)
+
+
+class TestServe(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'ingest.sock')
+        self.dispatched = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def dispatch(self, session_id, selector, args):
+        if selector == 'set-command-complete-timeout':
+            raise ValueError("invalid value")
+
+        self.dispatched.append((session_id, selector, args))
+
+    def run_client(self, lines: List[str]) -> List[dict]:
+        async def run():
+            server = await ingest.serve(self.path, "secret", self.dispatch)
+            try:
+                return await asyncio.get_event_loop().run_in_executor(None, exchange, self.path, lines)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        return asyncio.run(run())
+
+    def test_dispatches_messages_and_batches(self):
+        replies = self.run_client([
+            '{"identity": "secret"}',
+            '{"selector": "notify", "args": ["message", "title"]}',
+            '',
+            '[{"selector": "set-success-title", "args": ["done"], "session": "s1"}, {"selector": "notify"}]',
+        ])
+
+        self.assertEqual([{"ok": True}, {"ok": True, "dispatched": 1}, {"ok": True, "dispatched": 2}], replies)
+        self.assertEqual([('ingest', 'notify', ['message', 'title']), ('s1', 'set-success-title', ['done']),
+                          ('ingest', 'notify', [])], self.dispatched)
+
+    def test_limits_the_number_of_sessions(self):
+        lines = ['{"identity": "secret"}']
+        lines += ['{{"selector": "notify", "session": "s{}"}}'.format(i) for i in range(ingest.MAX_SESSIONS + 1)]
+        lines += ['{"selector": "notify", "session": "s0"}']
+
+        replies = self.run_client(lines)
+
+        self.assertEqual([True] * ingest.MAX_SESSIONS + [False, True], [r["ok"] for r in replies[1:]])
+        self.assertEqual(ingest.MAX_SESSIONS, len({session for session, _, _ in self.dispatched}))
+
+    def test_socket_is_only_accessible_by_the_user(self):
+        async def run():
+            server = await ingest.serve(self.path, "secret", self.dispatch)
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(run())
+
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    def test_rejects_wrong_identity(self):
+        for first_line in ['{"identity": "wrong"}', '{}', 'secret', '[]']:
+            with self.subTest(first_line):
+                replies = self.run_client([first_line, '{"selector": "notify", "args": ["message", "title"]}'])
+
+                self.assertEqual([{"ok": False, "error": "authentication failed"}], replies)
+                self.assertEqual([], self.dispatched)
+
+    def test_rejects_clients_that_dont_authenticate(self):
+        def idle_client() -> bytes:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(5)
+                s.connect(self.path)
+                return s.recv(4096)
+
+        async def run():
+            server = await ingest.serve(self.path, "secret", self.dispatch, auth_timeout=0.05)
+            try:
+                return await asyncio.get_event_loop().run_in_executor(None, idle_client)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        self.assertEqual({"ok": False, "error": "authentication failed"}, json.loads(asyncio.run(run())))
+
+    def test_invalid_lines_are_rejected_whole(self):
+        replies = self.run_client([
+            '{"identity": "secret"}',
+            '[{"selector": "notify"}, {"selector": "before-command", "args": ["ls"]}]',
+            '[{"selector": "notify"}, {"selector": "set-command-complete-timeout", "args": ["soon"]}]',
+            '{"selector": "notify"}',
+        ])
+
+        self.assertEqual(False, replies[1]["ok"])
+        self.assertEqual({"ok": False, "error": "invalid value", "dispatched": 1}, replies[2])
+        self.assertEqual({"ok": True, "dispatched": 1}, replies[3])
+        self.assertEqual([('ingest', 'notify', []), ('ingest', 'notify', [])], self.dispatched)
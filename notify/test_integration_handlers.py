@@ -1,35 +1,133 @@
 from unittest import TestCase
 from unittest.mock import Mock
 
+from notify.backends import BackendFactory
 from notify.config import Config, SelectedBackend, SelectedStrategy, Stack
 from notify.handlers import MaintainConfig
-from notify.notifications import Notification
+from notify.state import SessionState, StaticServices
+
+
+def attach(stack: Stack, logger=None, strategy_factory=None, backend_factory=None) -> SessionState:
+    state = SessionState("session", stack, logger if logger is not None else Mock(['name', 'level', 'setLevel']),
+                         StaticServices(strategy_factory, backend_factory))
+    MaintainConfig().attach(state)
+    return state
 
 
 class TestMaintainConfigHandler(TestCase):
     def test_on_pop_restores_previous_config(self):
         mock_logger = Mock(['name', 'level', 'setLevel'])
 
-        success_template = Notification("success title", "success message")
-        failure_template = Notification("failure title", "failure message")
-
         stack = Stack(
             [Config(notifications_backend=SelectedBackend("test"), logger_name="", logger_level="",
                     notifications_strategy=SelectedStrategy("test", ["5"]),
                     success_title="", success_message="", failure_title="", failure_message="")])
 
-        h = MaintainConfig(stack=stack,
-                           success_template=success_template,
-                           failure_template=failure_template,
-                           logger=mock_logger)
+        h, state = MaintainConfig(), attach(stack, logger=mock_logger)
 
-        h.command_complete_timeout_handler("10")
+        h.command_complete_timeout_handler(state, "10")
         self.assertEqual([10], stack.current.notifications_strategy.args)
 
         stack.push()
 
-        h.command_complete_timeout_handler("42")
+        h.command_complete_timeout_handler(state, "42")
         self.assertEqual([42], stack.current.notifications_strategy.args)
 
         stack.pop()
         self.assertEqual([10], stack.current.notifications_strategy.args)
+
+    def test_pushed_selections_reuse_cached_instances(self):
+        created = []
+
+        def create_backend(*args):
+            created.append(args)
+            return Mock(['notify'])
+
+        backend_factory = BackendFactory({'test': create_backend, 'other': create_backend})
+
+        stack = Stack(
+            [Config(notifications_backend=SelectedBackend("test"), logger_name="", logger_level="",
+                    notifications_strategy=SelectedStrategy("test", [5]),
+                    success_title="", success_message="", failure_title="", failure_message="")])
+
+        h = MaintainConfig()
+        state = attach(stack, backend_factory=backend_factory)
+        default = state.backend_factory.create(stack.current.notifications_backend)
+
+        # a per-command selection, in a frame pushed by before-command and popped by after-command
+        for _ in range(3):
+            stack.push()
+            h.notifications_backend_handler(state, "other", "arg")
+            state.backend_factory.create(stack.current.notifications_backend)
+            stack.pop()
+
+        self.assertIs(default, state.backend_factory.create(stack.current.notifications_backend))
+        self.assertEqual([(), ("arg",)], created)
+
+    def test_invalid_templates_are_rejected(self):
+        stack = Stack(
+            [Config(notifications_backend=SelectedBackend("test"), logger_name="", logger_level="",
+                    notifications_strategy=SelectedStrategy("test", [5]),
+                    success_title="", success_message="", failure_title="", failure_message="")])
+
+        h, state = MaintainConfig(), attach(stack)
+
+        with self.assertRaises(ValueError):
+            h.success_title_handler(state, "took {duraton}")
+
+        with self.assertRaises(ValueError):
+            h.failure_message_handler(state, "{command_line")
+
+        self.assertEqual("", stack.current.success_title)
+        self.assertEqual("", stack.current.failure_message)
+
+        h.success_title_handler(state, "took {duration}")
+        self.assertEqual("took {duration}", stack.current.success_title)
+
+    def test_set_many_applies_all_settings_at_once(self):
+        stack = Stack(
+            [Config(notifications_backend=SelectedBackend("test"), logger_name="", logger_level="",
+                    notifications_strategy=SelectedStrategy("test", [5]),
+                    success_title="", success_message="", failure_title="", failure_message="")])
+
+        mock_logger = Mock(['name', 'level', 'setLevel'])
+        h, state = MaintainConfig(), attach(stack, logger=mock_logger)
+
+        on_change = Mock()
+        stack.on_change += on_change
+
+        h.set_many_handler(state, "success-title took {duration}",
+                           "",
+                           "# comments are ignored",
+                           "notifications-backend osascript worker",
+                           "command-complete-timeout 30",
+                           "failure-icon")
+
+        on_change.assert_called_once()
+        self.assertEqual("took {duration}", stack.current.success_title)
+        self.assertEqual(SelectedBackend("osascript", ["worker"]), stack.current.notifications_backend)
+        self.assertEqual([30], stack.current.notifications_strategy.args)
+        self.assertIsNone(stack.current.failure_icon)
+
+    def test_set_many_is_all_or_nothing(self):
+        stack = Stack(
+            [Config(notifications_backend=SelectedBackend("test"), logger_name="", logger_level="",
+                    notifications_strategy=SelectedStrategy("test", [5]),
+                    success_title="", success_message="", failure_title="", failure_message="")])
+
+        h, state = MaintainConfig(), attach(stack)
+
+        previous = stack.current
+        on_change = Mock()
+        stack.on_change += on_change
+
+        for lines in [("success-title ok", "no-such-key 1"),
+                      ("success-title ok", "command-complete-timeout soon"),
+                      ("success-title ok", "failure-title {nope}")]:
+            with self.subTest(lines):
+                with self.assertRaises(ValueError):
+                    h.set_many_handler(state, *lines)
+
+                self.assertEqual(previous, stack.current)
+
+        on_change.assert_not_called()
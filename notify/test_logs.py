@@ -0,0 +1,96 @@
+import io
+import json
+import logging
+from unittest import TestCase
+from unittest.mock import Mock
+
+from notify import logs
+from notify.dispatcher import Dispatcher
+
+
+class CountingRepr:
+    def __init__(self):
+        self.calls = 0
+
+    def __repr__(self):
+        self.calls += 1
+        return "counted"
+
+    __str__ = __repr__
+
+
+def create_logger(name: str, handler: logging.Handler, level=logging.DEBUG) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+
+class TestLogs(TestCase):
+    def test_text_lines(self):
+        stream = io.StringIO()
+        handler = logs.configure(stream)
+        logger = create_logger("test-logs-text", handler)
+
+        logger.info("dispatching %s with args: %s", "notify", ["a"])
+        handler.stop()
+
+        self.assertEqual("test-logs-text: INFO dispatching notify with args: ['a']\n", stream.getvalue())
+
+    def test_json_lines(self):
+        stream = io.StringIO()
+        handler = logs.configure(stream, json_lines=True)
+        logger = create_logger("test-logs-json", handler)
+
+        logger.info("dispatching %s", "notify", extra={'selector': 'notify'})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("failed")
+
+        handler.stop()
+        handler.stop()
+
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+        self.assertEqual("dispatching notify", first['message'])
+        self.assertEqual("INFO", first['level'])
+        self.assertEqual("test-logs-json", first['logger'])
+        self.assertEqual("notify", first['selector'])
+        self.assertNotIn('exception', first)
+
+        self.assertEqual("failed", second['message'])
+        self.assertIn("ValueError: boom", second['exception'])
+
+    def test_message_is_resolved_when_logged(self):
+        stream = io.StringIO()
+        handler = logs.configure(stream)
+        logger = create_logger("test-logs-resolved", handler)
+
+        args = ["before"]
+        logger.info("%s", args)
+        args.append("after")
+        handler.stop()
+
+        self.assertIn("['before']", stream.getvalue())
+
+    def test_lazy(self):
+        fn = Mock(return_value="a b")
+        logger = create_logger("test-logs-lazy", logging.NullHandler(), level=logging.WARNING)
+
+        logger.info("executing %s", logs.lazy(fn, ["a", "b"]))
+        fn.assert_not_called()
+
+        self.assertEqual("a b", str(logs.lazy(fn, ["a", "b"])))
+        fn.assert_called_once_with(["a", "b"])
+
+    def test_dispatcher_does_not_format_disabled_messages(self):
+        logger = create_logger("test-logs-dispatcher", logging.NullHandler(), level=logging.WARNING)
+        arg = CountingRepr()
+
+        d = Dispatcher(logger)
+        d.register_handler("foo", Mock())
+        d.dispatch("foo", [arg])
+
+        self.assertEqual(0, arg.calls)
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import socket
+import stat
+import tempfile
+from unittest import TestCase
+
+from notify.metrics import Registry, serve
+
+
+class TestRegistry(TestCase):
+    def test_counter_and_gauge(self):
+        r = Registry()
+        c = r.counter('events_total', 'Events', ['selector'])
+        g = r.gauge('sessions', 'Sessions')
+
+        c.inc('notify')
+        c.inc('notify', amount=2)
+        c.inc('set-title')
+        g.set(3)
+
+        self.assertEqual(3, c.value('notify'))
+        self.assertEqual("# HELP events_total Events\n"
+                         "# TYPE events_total counter\n"
+                         "events_total{selector=\"notify\"} 3\n"
+                         "events_total{selector=\"set-title\"} 1\n"
+                         "# HELP sessions Sessions\n"
+                         "# TYPE sessions gauge\n"
+                         "sessions 3\n", r.render())
+
+    def test_gauge_function(self):
+        r = Registry()
+        items = [1, 2]
+        r.gauge('items', 'Items').set_function(lambda: len(items))
+
+        items.append(3)
+
+        self.assertIn("items 3\n", r.render())
+
+    def test_histogram(self):
+        r = Registry()
+        h = r.histogram('latency_seconds', 'Latency', buckets=[0.1, 1])
+
+        h.observe(0.05)
+        h.observe(0.1)
+        h.observe(0.5)
+        h.observe(2)
+
+        self.assertEqual(4, h.count())
+        self.assertEqual("# HELP latency_seconds Latency\n"
+                         "# TYPE latency_seconds histogram\n"
+                         "latency_seconds_bucket{le=\"0.1\"} 2\n"
+                         "latency_seconds_bucket{le=\"1\"} 3\n"
+                         "latency_seconds_bucket{le=\"+Inf\"} 4\n"
+                         "latency_seconds_sum 2.65\n"
+                         "latency_seconds_count 4\n", r.render())
+
+    def test_remove(self):
+        r = Registry()
+        metrics = [r.counter('c', 'C', ['session']), r.gauge('g', 'G', ['session']),
+                   r.histogram('h', 'H', ['session'])]
+
+        metrics[0].inc('foo')
+        metrics[1].set(1, 'foo')
+        metrics[2].observe(1, 'foo')
+
+        for m in metrics:
+            m.remove('foo')
+            m.remove('never-used')
+
+        self.assertNotIn('foo', r.render())
+
+    def test_label_values_are_escaped(self):
+        r = Registry()
+        r.counter('c', 'A "counter"\nwith \\ escapes', ['l']).inc('a "b"\n\\')
+
+        self.assertEqual("# HELP c A \"counter\"\\nwith \\\\ escapes\n"
+                         "# TYPE c counter\n"
+                         "c{l=\"a \\\"b\\\"\\n\\\\\"} 1\n", r.render())
+
+    def test_register_returns_existing_metric(self):
+        r = Registry()
+        c = r.counter('c', 'Counter', ['l'])
+
+        self.assertIs(c, r.counter('c', 'Counter', ['l']))
+
+        with self.assertRaises(ValueError):
+            r.gauge('c', 'Gauge', ['l'])
+
+        with self.assertRaises(ValueError):
+            r.counter('c', 'Counter', ['other'])
+
+    def test_wrong_number_of_labels(self):
+        r = Registry()
+        r.counter('c', 'Counter', ['l']).inc()
+
+        with self.assertRaises(ValueError):
+            r.render()
+
+
+class TestServe(TestCase):
+    def test_serve_on_unix_socket(self):
+        r = Registry()
+        r.counter('c', 'Counter').inc()
+
+        async def get(path: str, target: str) -> bytes:
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(target).encode('ascii'))
+            response = await reader.read()
+            writer.close()
+            return response
+
+        async def run(path: str):
+            server = await serve(r, path=path)
+            try:
+                self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+                return await get(path, '/metrics'), await get(path, '/other')
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics.sock')
+            # stale socket left by a previous run
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(path)
+            stale.close()
+
+            found, not_found = asyncio.run(run(path))
+
+        self.assertTrue(found.startswith(b"HTTP/1.0 200 OK\r\n"))
+        self.assertTrue(found.endswith(b"\r\n\r\n# HELP c Counter\n# TYPE c counter\nc 1\n"))
+        self.assertTrue(not_found.startswith(b"HTTP/1.0 404 Not Found\r\n"))
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+from base64 import b64encode
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import AsyncMock, Mock, patch
+
+import iterm2
+
+from notify import SessionsMonitor, routing, wire
+from notify.config import SessionManager
+from notify.dispatcher import Route
+from notify.replay import Recorder
+
+
+def encode(*args: str) -> str:
+    return ",".join(b64encode(a.encode('utf-8')).decode('ascii') for a in args)
+
+
+def payload(selector: str, *args: str) -> str:
+    return wire.encode(selector, list(args))
+
+
+class FakeApp:
+    def __init__(self, *session_ids: str):
+        self.session_ids = set(session_ids)
+
+    def get_session_by_id(self, session_id: str):
+        if session_id not in self.session_ids:
+            return None
+
+        return SimpleNamespace(session_id=session_id)
+
+
+class TestSessionsMonitor(TestCase):
+    def setUp(self) -> None:
+        self.__storage = Mock(['load', 'save'])
+        self.__conn = Mock()
+        self.__monitor = SessionsMonitor("FOO_ID", FakeApp("foo", "bar"), self.__conn,
+                                         config_manager=SessionManager(self.__storage, logger=Mock(spec=logging.Logger)))
+
+    def __saved_config(self, session_id: str) -> dict:
+        return self.__storage.save.call_args[0][0][session_id][-1]
+
+    async def __receive(self, session_id: str, payload: str, monitor: SessionsMonitor = None) -> bool:
+        monitor = monitor if monitor is not None else self.__monitor
+
+        keep_monitoring = await monitor.receive(session_id, payload)
+        await monitor.drain()
+        return keep_monitoring
+
+    def test_rejects_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            SessionsMonitor("FOO_ID", FakeApp("foo"), self.__conn,
+                            config_manager=SessionManager(self.__storage, logger=Mock(spec=logging.Logger)),
+                            overflow="nope")
+
+    def test_routes_events_by_session(self):
+        async def run():
+            self.assertTrue(await self.__receive("foo", payload("set-success-title", "foo title")))
+            self.assertTrue(await self.__receive("bar", payload("set-success-title", "bar title")))
+            self.assertTrue(await self.__receive("foo", payload("set-failure-title", "foo failure")))
+
+            self.assertEqual("foo title", self.__saved_config("foo")["success-title"])
+            self.assertEqual("foo failure", self.__saved_config("foo")["failure-title"])
+            self.assertEqual("bar title", self.__saved_config("bar")["success-title"])
+            self.assertEqual({"foo": 2, "bar": 1}, self.__monitor.event_counts)
+
+        asyncio.run(run())
+
+    def test_terminate(self):
+        async def run():
+            await self.__receive("foo", payload("set-success-title", "foo title"))
+            await self.__receive("bar", payload("set-success-title", "bar title"))
+            self.assertEqual(2, self.__monitor.report().dispatchers)
+
+            self.__monitor.terminate("foo")
+
+            self.assertEqual({"bar": 1}, self.__monitor.event_counts)
+            self.assertEqual(1, self.__monitor.report().live_sessions)
+            self.assertNotIn("foo", self.__storage.save.call_args[0][0])
+
+        asyncio.run(run())
+
+    def test_accepts_both_wire_versions(self):
+        async def run():
+            self.assertTrue(await self.__receive("foo", "set-success-title," + encode("v1 title")))
+            self.assertEqual("v1 title", self.__saved_config("foo")["success-title"])
+
+            self.assertTrue(await self.__receive("foo", payload("set-success-title", "v2 title")))
+            self.assertEqual("v2 title", self.__saved_config("foo")["success-title"])
+
+        asyncio.run(run())
+
+    def test_malformed_payload_is_ignored(self):
+        async def run():
+            self.assertTrue(await self.__receive("foo", "@2,99:set-success-title"))
+            self.assertEqual({"foo": 1}, self.__monitor.event_counts)
+
+        asyncio.run(run())
+
+    def test_unknown_session(self):
+        async def run():
+            self.assertFalse(await self.__receive("baz", payload("set-success-title", "title")))
+            self.assertEqual({}, self.__monitor.event_counts)
+
+        asyncio.run(run())
+
+    def test_gone_session_is_released(self):
+        async def run():
+            app = FakeApp("foo")
+            monitor = SessionsMonitor("FOO_ID", app, self.__conn,
+                                      config_manager=SessionManager(self.__storage, logger=Mock(spec=logging.Logger)))
+
+            self.assertTrue(await self.__receive("foo", payload("set-success-title", "title"), monitor))
+            self.assertEqual(1, monitor.report().live_sessions)
+
+            app.session_ids.clear()
+
+            self.assertFalse(await self.__receive("foo", payload("set-success-title", "title"), monitor))
+            self.assertEqual(0, monitor.report().live_sessions)
+            self.assertNotIn("foo", self.__storage.save.call_args[0][0])
+
+        asyncio.run(run())
+
+    def test_submit_without_a_terminal(self):
+        async def run():
+            await self.__monitor.submit("ingest", "set-success-title", ["ingest title"])
+            await self.__monitor.drain()
+
+        asyncio.run(run())
+
+        self.assertEqual("ingest title", self.__saved_config("ingest")["success-title"])
+        self.assertEqual({"ingest": 1}, self.__monitor.event_counts)
+
+    def test_records_events(self):
+        async def run():
+            recorder = Mock(spec=Recorder)
+            monitor = SessionsMonitor("FOO_ID", FakeApp("foo"), self.__conn, recorder=recorder,
+                                      config_manager=SessionManager(self.__storage, logger=Mock(spec=logging.Logger)))
+
+            await self.__receive("foo", wire.encode("set-success-title", ["title"], sent_at=1.5), monitor)
+
+            recorder.for_session.assert_called_once_with("foo")
+            recorder.for_session.return_value.assert_called_once_with("set-success-title", ["title"], 1.5)
+
+        asyncio.run(run())
+
+    def test_inbox_keeps_the_order_of_each_session(self):
+        handled = []
+
+        async def slow_handler(title: str):
+            await asyncio.sleep(0.01 if title == "foo 1" else 0)
+            handled.append(title)
+
+        async def run():
+            for title in ["foo 1", "bar 1", "foo 2", "bar 2"]:
+                await self.__monitor.receive(title.split()[0], payload("notify", title, "title"))
+
+            self.assertEqual(4, sum(self.__monitor.inbox_depths.values()))
+            await self.__monitor.drain()
+            self.assertEqual({"foo": 0, "bar": 0}, self.__monitor.inbox_depths)
+
+        routes = dict(routing.ROUTES, notify=Route(lambda _, message, title: slow_handler(message)))
+        with patch('notify.routing.ROUTES', routes):
+            asyncio.run(run())
+
+        # bar doesn't wait for foo's slow handler, but each session's events are handled in order
+        self.assertEqual(["bar 1", "bar 2", "foo 1", "foo 2"], handled)
+
+    def test_multiplexed_monitor(self):
+        notifications = SimpleNamespace(
+            async_subscribe_to_custom_escape_sequence_notification=AsyncMock(return_value="token"),
+            async_unsubscribe=AsyncMock()
+        )
+
+        async def run():
+            task = asyncio.create_task(self.__monitor.attach_multiplexed_monitor())
+            await asyncio.sleep(0)
+
+            callback = notifications.async_subscribe_to_custom_escape_sequence_notification.call_args[0][1]
+            for session_id, identity in [("foo", "FOO_ID"), ("bar", "FOO_ID"), ("foo", "OTHER_ID")]:
+                await callback(None, SimpleNamespace(
+                    session=session_id,
+                    sender_identity=identity,
+                    payload="set-success-title," + encode(session_id)
+                ))
+
+            await self.__monitor.drain()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        with patch.object(iterm2, 'notifications', notifications, create=True):
+            asyncio.run(run())
+
+        notifications.async_unsubscribe.assert_awaited_once_with(self.__conn, "token")
+        self.assertEqual({"foo": 1, "bar": 1}, self.__monitor.event_counts)
+        self.assertEqual("foo", self.__saved_config("foo")["success-title"])
+        self.assertEqual("bar", self.__saved_config("bar")["success-title"])
+
+    def test_events_wait_until_state_is_loaded(self):
+        notifications = SimpleNamespace(
+            async_subscribe_to_custom_escape_sequence_notification=AsyncMock(return_value="token"),
+            async_unsubscribe=AsyncMock()
+        )
+        self.__storage.load.return_value = {}
+
+        async def run():
+            ready = asyncio.Event()
+            monitor = SessionsMonitor("FOO_ID", FakeApp("foo"), self.__conn,
+                                      config_manager=SessionManager(self.__storage, logger=Mock(spec=logging.Logger)),
+                                      ready=ready)
+
+            task = asyncio.create_task(monitor.attach_multiplexed_monitor())
+            await asyncio.sleep(0)
+
+            callback = notifications.async_subscribe_to_custom_escape_sequence_notification.call_args[0][1]
+            event = asyncio.create_task(callback(None, SimpleNamespace(
+                session="foo", sender_identity="FOO_ID", payload=payload("set-success-title", "early"))))
+
+            await asyncio.sleep(0)
+            self.assertFalse(event.done())
+            self.assertEqual({}, monitor.event_counts)
+
+            ready.set()
+            await event
+            await monitor.drain()
+
+            self.assertEqual({"foo": 1}, monitor.event_counts)
+
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        with patch.object(iterm2, 'notifications', notifications, create=True):
+            asyncio.run(run())
+
+        self.assertEqual("early", self.__saved_config("foo")["success-title"])
@@ -4,7 +4,7 @@ from unittest.mock import Mock, PropertyMock
 
 from notify.commands import Command
 from notify.config import Config, Stack
-from notify.notifications import Factory, apply_template
+from notify.notifications import Factory, apply_template, compile_template
 
 TS_1 = 1572889271
 TS_2 = 1572889290.1234567
@@ -60,6 +60,7 @@ class TestFactory(TestCase):
         self.assertEqual("failure in 0:00:19", n.title)
         self.assertEqual("some command", n.message)
         self.assertEqual("failure.png", n.icon)
+        self.assertEqual(1, n.exit_code)
 
     def test_from_command_failed_without_icon(self):
         cmd = Command(datetime.fromtimestamp(TS_1), "some command")
@@ -151,3 +152,50 @@ class TestApplyTemplate(TestCase):
         self.assertEqual("0:00:19", apply_template("{duration}", complete_cmd))
         self.assertEqual("some command", apply_template("{command_line}", complete_cmd))
         self.assertEqual("0", apply_template("{exit_code}", complete_cmd))
+        self.assertEqual(str(datetime.fromtimestamp(TS_1)), apply_template("{started_at}", complete_cmd))
+
+    def test_with_format_spec(self):
+        cmd = Command(datetime.fromtimestamp(TS_1), "some command")
+        complete_cmd = cmd.complete(0, datetime.fromtimestamp(TS_2))
+
+        self.assertEqual("[   0]", apply_template("[{exit_code:4}]", complete_cmd))
+        self.assertEqual("19:21", apply_template("{started_at:%H:%M}", datetime_cmd(TS_1)))
+
+
+def datetime_cmd(ts):
+    return Command(datetime(2019, 11, 4, 19, 21, 11), "some command").complete(0, datetime.fromtimestamp(ts))
+
+
+class TestCompileTemplate(TestCase):
+    def test_is_cached(self):
+        self.assertIs(compile_template("{duration} {exit_code}"), compile_template("{duration} {exit_code}"))
+
+    def test_collects_referenced_fields(self):
+        self.assertEqual({"duration", "command_line"}, compile_template("{duration} {command_line!r}").fields)
+        self.assertEqual({"started_at"}, compile_template("{started_at.year}").fields)
+        self.assertEqual(frozenset(), compile_template("no vars {{here}}").fields)
+
+    def test_static_template_is_rendered_once(self):
+        tpl = compile_template("no vars {{here}}")
+        self.assertEqual("no vars {here}", tpl.render(Mock()))
+
+    def test_only_computes_referenced_fields(self):
+        cmd = Mock()
+        cmd.exit_code = 3
+
+        self.assertEqual("exit 3", compile_template("exit {exit_code}").render(cmd))
+        cmd.duration.total_seconds.assert_not_called()
+
+    def test_validate(self):
+        compile_template("{duration} {exit_code} {command_line} {started_at}").validate()
+
+        for invalid in ["{some_var}", "{0}", "{}", "{duration", "}"]:
+            with self.subTest(invalid):
+                with self.assertRaises(ValueError):
+                    compile_template(invalid).validate()
+
+    def test_invalid_template_renders_as_is(self):
+        cmd = Command(datetime.fromtimestamp(TS_1), "some command").complete(0, datetime.fromtimestamp(TS_2))
+
+        self.assertEqual("{duration", compile_template("{duration").render(cmd))
+        self.assertEqual("{exit_code:%Y}", compile_template("{exit_code:%Y}").render(cmd))
@@ -0,0 +1,88 @@
+import shutil
+from os import environ
+from subprocess import run
+from tempfile import NamedTemporaryFile
+from unittest import TestCase, skipIf
+
+from notify import wire
+from notify.osc import CustomSequence, Parser
+
+PLAIN = b"\x1b]1337;Custom=id=FOO_ID:@2,14:before-command0:5:ls -l\x07"
+TMUX = b"\x1bPtmux;\x1b\x1b]1337;Custom=id=FOO_ID:@2,13:after-command0:1:0\x07\x1b\\"
+
+EXPECTED = [CustomSequence("FOO_ID", "@2,14:before-command0:5:ls -l"),
+            CustomSequence("FOO_ID", "@2,13:after-command0:1:0")]
+
+
+class TestParser(TestCase):
+    def test_sequences_in_output(self):
+        stream = b"$ ls -l\r\n\x1b[1;32mtotal 0\x1b[0m\r\n" + PLAIN + b"output\x1b]0;title\x07more" + TMUX + b"$ "
+
+        self.assertEqual(EXPECTED, Parser().feed(stream))
+
+    def test_split_at_every_offset(self):
+        stream = b"before" + PLAIN + b"\x1b[K" + TMUX + b"after"
+
+        for split in range(len(stream) + 1):
+            with self.subTest(split=split):
+                p = Parser()
+                self.assertEqual(EXPECTED, p.feed(stream[:split]) + p.feed(stream[split:]))
+
+    def test_byte_at_a_time(self):
+        p = Parser()
+        found = []
+
+        for b in PLAIN + TMUX:
+            found += p.feed(bytes([b]))
+
+        self.assertEqual(EXPECTED, found)
+
+    def test_string_terminator(self):
+        self.assertEqual([CustomSequence("FOO_ID", "notify,bWVzc2FnZQ==,dGl0bGU=")],
+                         Parser().feed(b"\x1b]1337;Custom=id=FOO_ID:notify,bWVzc2FnZQ==,dGl0bGU=\x1b\\"))
+
+    def test_filters_by_identity(self):
+        stream = b"\x1b]1337;Custom=id=OTHER:notify,YQ==,Yg==\x07" + PLAIN
+
+        self.assertEqual(EXPECTED[:1], Parser("FOO_ID").feed(stream))
+
+    def test_ignores_other_sequences(self):
+        stream = b"\x1b]1337;SetUserVar=foo=YmFy\x07\x1bP+q544e\x1b\\\x1b]1337;Custom=id=no-colon\x07"
+
+        self.assertEqual([], Parser().feed(stream))
+
+    def test_abandoned_sequence(self):
+        # an ESC that isn't a string terminator ends the sequence it's in
+        self.assertEqual(EXPECTED[:1], Parser().feed(b"\x1b]1337;Custom=id=FOO_ID:truncated\x1b" + PLAIN))
+
+    def test_drops_long_sequences(self):
+        p = Parser(max_length=64)
+        long = b"\x1b]1337;Custom=id=FOO_ID:" + b"x" * 100 + b"\x07"
+
+        self.assertEqual(EXPECTED[:1], p.feed(long[:50]) + p.feed(long[50:]) + p.feed(PLAIN))
+        self.assertEqual(1, p.dropped)
+
+        self.assertEqual([], p.feed(b"\x1bPtmux;" + long.replace(b"\x1b", b"\x1b\x1b") + b"\x1b\\"))
+        self.assertEqual(2, p.dropped)
+
+
+@skipIf(shutil.which('bash') is None, "bash is not installed")
+class TestParserOnInitScript(TestCase):
+    def test_with_and_without_tmux(self):
+        with NamedTemporaryFile('w', suffix='-iterm-notify-id') as tmp:
+            tmp.write("FOO_ID\n")
+            tmp.flush()
+
+            for tmux in ['', '/tmp/tmux-1000/default,1,0']:
+                with self.subTest(tmux=tmux):
+                    env = dict(environ, ITERM_NOTIFY_IDENTITY_FILE=tmp.name, TMUX=tmux)
+                    result = run(['bash', '-c', "source init.sh; iterm-notify send title 'a message ✓'"],
+                                 capture_output=True, env=env, check=True)
+
+                    sequences = Parser("FOO_ID").feed(result.stdout)
+
+                    self.assertEqual(1, len(sequences))
+
+                    message = wire.decode(sequences[0].payload)
+                    self.assertEqual("notify", message.selector)
+                    self.assertEqual(["a message ✓", "title"], message.args)
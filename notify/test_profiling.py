@@ -0,0 +1,142 @@
+import logging
+import pstats
+import stat
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+
+from notify.dispatcher import Dispatcher
+from notify.handlers import Profile
+from notify.profiling import Profiler
+
+
+def busy():
+    return sorted(range(1000))
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.scheduled = []
+
+    def __call__(self, delay, callback):
+        self.scheduled.append((delay, callback))
+
+    def fire(self):
+        delay, callback = self.scheduled.pop()
+        callback()
+
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scheduler = FakeScheduler()
+        self.profiles = Path(self.directory.name, 'profiles')
+        self.profiler = Profiler(logging.getLogger(__name__), directory=self.profiles,
+                                 schedule=self.scheduler, clock=lambda: 1572889271.5)
+
+    def tearDown(self):
+        self.profiler.stop()
+        self.directory.cleanup()
+
+    def test_cprofile(self):
+        path = self.profiler.start('cprofile', 30)
+
+        self.assertEqual(self.profiles.joinpath('profile-1572889271.pstats'), path)
+        self.assertEqual(0o700, stat.S_IMODE(self.profiles.stat().st_mode))
+        self.assertEqual(30, self.scheduler.scheduled[0][0])
+
+        busy()
+        self.scheduler.fire()
+
+        self.assertIsNone(self.profiler.mode)
+        self.assertTrue(any(name == 'busy' for _, _, name in pstats.Stats(str(path)).stats))
+        self.assertEqual(0o600, stat.S_IMODE(path.stat().st_mode))
+
+    def test_sample(self):
+        path = self.profiler.start('sample', 1, 'profile.folded')
+        self.assertEqual(self.profiles.joinpath('profile.folded'), path)
+
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+
+        self.assertEqual(path, self.profiler.stop())
+
+        lines = path.read_text().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        self.assertTrue(any('test_sample' in line for line in lines))
+
+    def test_trace(self):
+        d = Dispatcher(tracer=self.profiler.trace)
+        d.register_handler("foo", lambda: None)
+
+        d.dispatch("foo", [])
+        path = self.profiler.start('trace', 10)
+        d.dispatch("foo", [])
+        d.dispatch("foo", [])
+        self.profiler.stop()
+        d.dispatch("foo", [])
+
+        lines = [line.split('\t') for line in path.read_text().splitlines()]
+        self.assertEqual([['1572889271.500000', 'foo'], ['1572889271.500000', 'foo']], [line[:2] for line in lines])
+
+    def test_one_at_a_time(self):
+        self.profiler.start('trace', 10)
+
+        with self.assertRaises(RuntimeError):
+            self.profiler.start('cprofile', 10)
+
+    def test_names_stay_in_the_directory(self):
+        for name in ['../../.zshrc', '/etc/passwd', '~/trace.tsv']:
+            with self.subTest(name=name):
+                path = self.profiler.start('trace', 10, name)
+                self.assertEqual(self.profiles, path.parent)
+                self.profiler.stop()
+
+        with self.assertRaises(ValueError):
+            self.profiler.start('trace', 10, '..')
+
+    def test_existing_files_are_not_replaced(self):
+        self.profiles.mkdir()
+        self.profiles.joinpath('trace.tsv').write_text('keep me')
+
+        with self.assertRaises(FileExistsError):
+            self.profiler.start('trace', 10, 'trace.tsv')
+
+        self.assertIsNone(self.profiler.mode)
+
+        # created while profiling
+        path = self.profiler.start('trace', 10, 'late.tsv')
+        path.write_text('keep me')
+
+        with self.assertRaises(FileExistsError):
+            self.profiler.stop()
+
+        self.assertIsNone(self.profiler.mode)
+        self.assertEqual('keep me', path.read_text())
+        self.assertEqual('keep me', self.profiles.joinpath('trace.tsv').read_text())
+
+    def test_invalid_arguments(self):
+        for mode, seconds in [('nope', 10), ('trace', 0), ('trace', 3600)]:
+            with self.subTest(mode=mode, seconds=seconds):
+                with self.assertRaises(ValueError):
+                    self.profiler.start(mode, seconds)
+
+        self.assertIsNone(self.profiler.mode)
+
+    def test_handler(self):
+        handler = Profile()
+        state = SimpleNamespace(profiler=self.profiler)
+
+        handler.profiling_handler(state, 'trace')
+        self.assertEqual('trace', self.profiler.mode)
+        self.assertEqual(10, self.scheduler.scheduled[0][0])
+
+        handler.profiling_handler(state, 'off')
+        self.assertIsNone(self.profiler.mode)
+
+        with self.assertRaises(RuntimeError):
+            handler.profiling_handler(SimpleNamespace(profiler=None), 'trace')
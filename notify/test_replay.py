@@ -0,0 +1,128 @@
+import gzip
+import json
+import os
+import stat
+import tempfile
+from unittest import TestCase
+
+from notify.dispatcher import Dispatcher
+from notify.replay import Event, Recorder, read, replay
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class TestRecorder(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self, path: str) -> FakeClock:
+        clock = FakeClock(1572889200.0)
+        recorder = Recorder(path, clock=clock)
+
+        foo, bar = Dispatcher(), Dispatcher()
+        for d, session_id in [(foo, "foo"), (bar, "bar")]:
+            d.register_handler("notify", lambda *args: None)
+            d.on_dispatch += recorder.for_session(session_id)
+
+        foo.dispatch("notify", ["message", "title"])
+        clock.now += 1.5
+        bar.dispatch("notify", ["ünïcode", "title"], sent_at=1572889201.25)
+
+        with self.assertRaises(RuntimeError):
+            bar.dispatch("unknown", [])
+
+        recorder.close()
+        recorder.record("foo", "notify", [])  # ignored once closed
+
+        self.assertEqual(3, recorder.events)
+        return clock
+
+    def test_round_trip(self):
+        for name in ['events.jsonl', 'events.jsonl.gz']:
+            with self.subTest(name):
+                path = os.path.join(self.directory.name, name)
+                self.record(path)
+
+                started_at, events = read(path)
+
+                self.assertEqual(1572889200.0, started_at)
+                self.assertEqual([Event(0.0, "foo", "notify", ["message", "title"]),
+                                  Event(1.5, "bar", "notify", ["ünïcode", "title"], 1572889201.25),
+                                  Event(1.5, "bar", "unknown", [])], list(events))
+
+    def test_only_readable_by_the_user(self):
+        path = os.path.join(self.directory.name, 'events.jsonl')
+        self.record(path)
+
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+
+    def test_readable_before_closed(self):
+        for name in ['events.jsonl', 'events.jsonl.gz']:
+            with self.subTest(name):
+                path = os.path.join(self.directory.name, name)
+                recorder = Recorder(path, clock=FakeClock(1572889200.0))
+                recorder.record("foo", "notify", ["message"])
+
+                try:
+                    self.assertEqual([Event(0.0, "foo", "notify", ["message"])], list(read(path)[1]))
+                finally:
+                    recorder.close()
+
+    def test_compressed(self):
+        path = os.path.join(self.directory.name, 'events.jsonl.gz')
+        self.record(path)
+
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual('iterm-notify-recording', json.loads(f.readline())['format'])
+
+    def test_not_a_recording(self):
+        path = os.path.join(self.directory.name, 'other.json')
+        with open(path, 'w') as f:
+            f.write('{"some": "json"}\n')
+
+        with self.assertRaises(ValueError):
+            read(path)
+
+
+class TestReplay(TestCase):
+    def events(self):
+        # a slow command in foo, a fast one in bar, then a notification from a script
+        return [
+            Event(0.0, "foo", "before-command", ["make"], 1572889200.0),
+            Event(0.5, "bar", "before-command", ["ls"]),
+            Event(0.6, "bar", "after-command", ["0"]),
+            Event(30.0, "foo", "after-command", ["0"], 1572889230.0),
+            Event(31.0, "ingest", "notify", ["deployed", "CD"]),
+            Event(31.0, "ingest", "unknown", []),
+        ]
+
+    def test_as_fast_as_possible(self):
+        sleep = FakeClock(0)
+        result = replay(1572889200.0, iter(self.events()), speed=None, sleep=sleep.sleep)
+
+        self.assertEqual(0, sleep.now)
+        self.assertEqual(6, result.events)
+        self.assertEqual(3, result.sessions)
+
+        # commands are timed as recorded, not as replayed
+        self.assertEqual([("foo", "osascript", "#win (0:00:30)", "make"), ("ingest", "osascript", "CD", "deployed")],
+                         [(s, b, n.title, n.message) for s, b, n in result.notifications])
+
+    def test_accelerated(self):
+        clock = FakeClock(0)
+        result = replay(1572889200.0, iter(self.events()), speed=10, sleep=clock.sleep, clock=clock)
+
+        self.assertAlmostEqual(3.1, result.elapsed)
+        self.assertEqual(2, len(result.notifications))
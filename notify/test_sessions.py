@@ -0,0 +1,55 @@
+import logging
+from unittest import TestCase
+from unittest.mock import Mock
+
+from notify.config import Stack, create_default
+from notify.dispatcher import Dispatcher
+from notify.sessions import SessionRegistry
+
+
+class TestSessionRegistry(TestCase):
+    def test_get_or_create(self):
+        registry = SessionRegistry()
+        create_logger = Mock(side_effect=logging.getLogger)
+
+        foo = registry.get_or_create("test-registry-foo", create_logger)
+        self.assertIs(foo, registry.get_or_create("test-registry-foo", create_logger))
+
+        create_logger.assert_called_once_with("test-registry-foo")
+        self.assertIn("test-registry-foo", registry)
+        self.assertEqual(1, len(registry))
+
+    def test_evict_releases_session(self):
+        registry = SessionRegistry()
+
+        session = registry.get_or_create("test-registry-evicted", logging.getLogger)
+        session.logger.addHandler(logging.NullHandler())
+        session.dispatcher = Dispatcher()
+        session.stack = Stack([create_default("foo")])
+
+        self.assertTrue(registry.evict("test-registry-evicted"))
+        self.assertFalse(registry.evict("test-registry-evicted"))
+
+        self.assertNotIn("test-registry-evicted", registry)
+        self.assertNotIn("test-registry-evicted", logging.Logger.manager.loggerDict)
+        self.assertEqual([], session.logger.handlers)
+        self.assertIsNone(session.dispatcher)
+        self.assertIsNone(session.stack)
+
+    def test_report(self):
+        registry = SessionRegistry()
+
+        foo = registry.get_or_create("test-registry-foo", logging.getLogger)
+        foo.dispatcher = Dispatcher()
+        foo.stack = Stack([create_default("foo")])
+        foo.stack.push()
+
+        registry.get_or_create("test-registry-bar", logging.getLogger)
+
+        report = registry.report()
+
+        self.assertEqual(2, report.live_sessions)
+        self.assertEqual(1, report.dispatchers)
+        self.assertEqual(2, report.stack_frames)
+        self.assertGreater(report.approximate_size, 0)
+        self.assertGreater(report.max_rss, 0)
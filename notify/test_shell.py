@@ -1,3 +1,5 @@
+import re
+import time
 from os import environ
 from subprocess import run
 from tempfile import NamedTemporaryFile
@@ -8,7 +10,16 @@ class TestShellScripts(TestCase):
     pass
 
 
-def create_test_func(shell_name: str, init_file: str, command: str, expected: str, input_text=None):
+# stands for the timestamp field in expected v2 payloads
+TS = '{ts}'
+TS_REGEX = r'\d+:(\d+(?:\.\d+)?)'
+
+
+def expect_timestamps(expected: str) -> str:
+    return TS_REGEX.join(re.escape(part) for part in expected.split(TS))
+
+
+def create_test_func(shell_name: str, init_file: str, command: str, expected: str, input_text=None, wire=None):
     def f(self):
         tmp = NamedTemporaryFile('w', suffix='-iterm-notify-id')
         tmp.write("FOO_ID\n")
@@ -16,6 +27,10 @@ def create_test_func(shell_name: str, init_file: str, command: str, expected: st
 
         env = environ.copy()
         env['ITERM_NOTIFY_IDENTITY_FILE'] = tmp.name
+        if wire is None:
+            env.pop('ITERM_NOTIFY_WIRE', None)
+        else:
+            env['ITERM_NOTIFY_WIRE'] = wire
 
         result = run(
             [
@@ -32,17 +47,60 @@ def create_test_func(shell_name: str, init_file: str, command: str, expected: st
 
         self.assertEqual(0, result.returncode)
         self.assertIn("Custom=id=FOO_ID:", out)
-        self.assertIn(expected, out)
+
+        if TS in expected:
+            self.assertRegex(out, expect_timestamps(expected))
+            self.assertAlmostEqual(time.time(), float(re.search(TS_REGEX, out).group(1)), delta=5)
+        else:
+            self.assertIn(expected, out)
+
+    return f
+
+
+def create_no_external_commands_test(shell_name: str, init_file: str):
+    def f(self):
+        tmp = NamedTemporaryFile('w', suffix='-iterm-notify-id')
+        tmp.write("  FOO_ID \n")
+        tmp.flush()
+
+        env = environ.copy()
+        env['ITERM_NOTIFY_IDENTITY_FILE'] = tmp.name
+        env['ITERM_NOTIFY_WIRE'] = '2'
+        env.pop('TMUX', None)
+
+        # with an empty PATH any external command the hooks run fails
+        result = run(
+            [
+                shell_name,
+                '-c',
+                "source {}; PATH=; "
+                "_iterm_notify_before_command_hook 'ls -l'; _iterm_notify_after_command_hook".format(init_file)
+            ],
+            capture_output=True,
+            env=env
+        )
+
+        self.assertEqual(b"", result.stderr)
+        self.assertRegex(
+            result.stdout.decode('UTF-8'),
+            "^" + expect_timestamps("\033]1337;Custom=id=FOO_ID:@2,14:before-command{ts}5:ls -l\a"
+                                    "\033]1337;Custom=id=FOO_ID:@2,13:after-command{ts}1:0\a") + "$")
 
     return f
 
 
+# version 1 of the payload, sent by default
 tests = [
     {
         'name': 'before-command',
         'call': 'before-command "ls -l"',
         'expect': 'before-command,bHMgLWw=',
     },
+    {
+        'name': 'before-command-utf8',
+        'call': 'before-command "echo héllo ✓"',
+        'expect': 'before-command,ZWNobyBow6lsbG8g4pyT\a',
+    },
     {
         'name': 'after-command',
         'call': 'after-command 0',
@@ -63,6 +121,47 @@ tests = [
         'name': 'config-set',
         'call': 'config-set FOO BAR',
         'expect': 'set-FOO,QkFS',
+    },
+    {
+        'name': 'config-set-many',
+        'call': 'config-set -',
+        'expect': 'set-many,Rk9PIEJBUg==,QkFaIHF1eA==\a',
+        'input': b'FOO BAR\n\nBAZ qux',
+    }
+]
+
+tests_v2 = [
+    {
+        'name': 'before-command',
+        'call': 'before-command "ls -l"',
+        'expect': ':@2,14:before-command{ts}5:ls -l\a',
+    },
+    {
+        'name': 'before-command-utf8',
+        'call': 'before-command "echo 100% héllo ✓"',
+        'expect': ':@2,14:before-command{ts}32:echo 100%25 h%C3%A9llo %E2%9C%93\a',
+    },
+    {
+        'name': 'after-command',
+        'call': 'after-command 0',
+        'expect': ':@2,13:after-command{ts}1:0\a',
+    },
+    {
+        'name': 'notify',
+        'call': 'send title',
+        'expect': ':@2,6:notify{ts}7:message5:title\a',
+        'input': b'message',
+    },
+    {
+        'name': 'config-set',
+        'call': 'config-set notifications-backend osascript worker',
+        'expect': ':@2,25:set-notifications-backend{ts}9:osascript6:worker\a',
+    },
+    {
+        'name': 'config-set-many',
+        'call': 'config-set -',
+        'expect': ':@2,8:set-many{ts}7:FOO BAR7:BAZ qux\a',
+        'input': b'FOO BAR\n\nBAZ qux',
     }
 ]
 
@@ -82,3 +181,18 @@ for shell in shells:
                     test['call'],
                     test['expect'],
                     test['input'] if 'input' in test else None))
+
+    for test in tests_v2:
+        setattr(TestShellScripts,
+                "test_{shell}_v2_{command}".format(shell=shell, command=test['name']),
+                create_test_func(
+                    shell,
+                    init,
+                    test['call'],
+                    test['expect'],
+                    test['input'] if 'input' in test else None,
+                    wire="2"))
+
+    setattr(TestShellScripts,
+            "test_{shell}_hooks_run_no_external_commands".format(shell=shell),
+            create_no_external_commands_test(shell, init))
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import socket
+import stat
+import tempfile
+from unittest import TestCase
+
+from notify import sockets
+
+
+async def ignore(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    writer.close()
+
+
+class TestStartUnixServer(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.sock')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_only_the_user_can_connect(self):
+        async def run():
+            server = await sockets.start_unix_server(ignore, self.path)
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(run())
+
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    def test_replaces_a_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+
+        async def run():
+            server = await sockets.start_unix_server(ignore, self.path)
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(run())
+
+    def test_refuses_a_socket_in_use(self):
+        live = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        live.bind(self.path)
+        live.listen()
+
+        try:
+            with self.assertRaises(OSError):
+                asyncio.run(sockets.start_unix_server(ignore, self.path))
+
+            self.assertTrue(stat.S_ISSOCK(os.stat(self.path).st_mode))
+        finally:
+            live.close()
+
+    def test_refuses_to_replace_a_file(self):
+        with open(self.path, 'w') as f:
+            f.write('keep me')
+
+        with self.assertRaises(FileExistsError):
+            asyncio.run(sockets.start_unix_server(ignore, self.path))
+
+        with open(self.path) as f:
+            self.assertEqual('keep me', f.read())
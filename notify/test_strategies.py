@@ -1,9 +1,11 @@
+import asyncio
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 from typing import Union
 from unittest import TestCase
 
 from notify.commands import Command
-from notify.strategies import WhenInactive, WhenSlow
+from notify.strategies import FocusTracker, WhenInactive, WhenSlow
 
 
 class MockApp:
@@ -116,3 +118,77 @@ class TestIfInactive(TestCase):
         complete_command = command.complete(1, self.started_at + timedelta(seconds=4))
 
         self.assertFalse(s.should_notify(complete_command))
+
+
+class FakeFocusUpdates:
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def put(self, application_active=None, session_id=None, tab_id=None):
+        self.queue.put_nowait(SimpleNamespace(
+            application_active=SimpleNamespace(application_active=application_active)
+            if application_active is not None else None,
+            active_session_changed=SimpleNamespace(session_id=session_id) if session_id is not None else None,
+            selected_tab_changed=SimpleNamespace(tab_id=tab_id) if tab_id is not None else None,
+            window_changed=None,
+        ))
+
+    async def async_get_next_update(self):
+        return await self.queue.get()
+
+
+class TestFocusTracker(TestCase):
+    def test_falls_back_when_not_tracking(self):
+        tracker = FocusTracker(MockApp(active=True, current_session_id="foo"))
+
+        self.assertTrue(tracker.active)
+        self.assertEqual("foo", tracker.current_session_id)
+        self.assertEqual("foo", tracker.current_session_id)
+        self.assertEqual(2, tracker.scans)
+
+    def test_tracks_focus_updates(self):
+        app = MockApp(active=True, current_session_id="foo")
+        tracker = FocusTracker(app)
+
+        async def run():
+            # the queue must be created in the loop that runs the test (on Python < 3.10 it binds to one when created)
+            updates = FakeFocusUpdates()
+            task = asyncio.create_task(tracker.track(updates))
+            await asyncio.sleep(0)
+
+            self.assertEqual("foo", tracker.current_session_id)
+            self.assertEqual("foo", tracker.current_session_id)
+            self.assertEqual(1, tracker.scans)
+
+            updates.put(application_active=False)
+            updates.put(session_id="bar")
+            await asyncio.sleep(0)
+
+            self.assertFalse(tracker.active)
+            self.assertEqual("bar", tracker.current_session_id)
+            self.assertEqual(1, tracker.scans)
+
+            app._current_session_id = "baz"
+            updates.put(tab_id="some-tab")
+            await asyncio.sleep(0)
+
+            self.assertEqual("baz", tracker.current_session_id)
+            self.assertEqual(2, tracker.scans)
+
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(run())
+
+        self.assertTrue(tracker.active)
+
+    def test_shared_by_strategies(self):
+        tracker = FocusTracker(MockApp(active=True, current_session_id="foo"))
+        started_at = datetime.now()
+        complete_command = Command(started_at, "ls").complete(1, started_at + timedelta(seconds=4))
+
+        foo = WhenInactive(app=tracker, session_id="foo", when_slow=WhenSlow(timeout=2))
+        bar = WhenInactive(app=tracker, session_id="bar", when_slow=WhenSlow(timeout=2))
+
+        self.assertFalse(foo.should_notify(complete_command))
+        self.assertTrue(bar.should_notify(complete_command))
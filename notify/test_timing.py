@@ -0,0 +1,17 @@
+from unittest import TestCase
+
+from notify.timing import StartupTimer
+
+
+class TestStartupTimer(TestCase):
+    def test_phases(self):
+        ticks = iter([1.5, 2.0, 2.25])
+        timer = StartupTimer(started_at=1.0, clock=lambda: next(ticks))
+
+        self.assertEqual(0.5, timer.mark("imports"))
+        timer.mark("get app")
+        timer.mark("load state")
+
+        self.assertEqual([("imports", 0.5), ("get app", 0.5), ("load state", 0.25)], timer.phases)
+        self.assertEqual(1.25, timer.total)
+        self.assertEqual("startup took 1250.0ms: imports 500.0ms, get app 500.0ms, load state 250.0ms", str(timer))
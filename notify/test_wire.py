@@ -0,0 +1,40 @@
+import re
+from unittest import TestCase
+
+from notify.wire import PAYLOAD_REGEX, Message, decode, encode
+
+
+class TestDecode(TestCase):
+    def test_v1(self):
+        self.assertEqual(Message("before-command", ["ls -l"]), decode("before-command,bHMgLWw="))
+        self.assertEqual(Message("notify", ["message", "title"]), decode("notify,bWVzc2FnZQ==,dGl0bGU="))
+
+    def test_v2(self):
+        self.assertEqual(Message("before-command", ["ls -l"]), decode("@2,14:before-command0:5:ls -l"))
+        self.assertEqual(Message("after-command", ["0"], 1572889271.5),
+                         decode("@2,13:after-command12:1572889271.51:0"))
+        self.assertEqual(Message("notify", ["", "a:b,c"]), decode("@2,6:notify0:0:5:a:b,c"))
+
+    def test_v2_percent_encoded(self):
+        self.assertEqual(Message("notify", ["héllo ✓ 100%"]), decode("@2,6:notify0:27:h%C3%A9llo %E2%9C%93 100%25"))
+
+    def test_round_trip(self):
+        for args, sent_at in [([], None), (["ls -l"], 1.25), (["a\nb\tc\x1b\x07", "", "✓ 50%"], 1572889271.123456)]:
+            for version in [1, 2]:
+                if version == 1 and (not args or sent_at is not None or "" in args):
+                    continue
+
+                with self.subTest(args=args, version=version):
+                    payload = encode("selector", args, sent_at=sent_at, version=version)
+
+                    self.assertTrue(payload.isascii() and payload.isprintable())
+                    self.assertRegex(payload, re.compile(PAYLOAD_REGEX))
+                    self.assertEqual(Message("selector", args, sent_at), decode(payload))
+
+    def test_malformed(self):
+        for payload in ["", "no-comma", "@2,", "@2,14:before-command", "@2,99:before-command0:",
+                        "@2,x:before-command0:", "@2,+4:abcd0:", "@2,0:0:", "@2,3:foo4:soon",
+                        "@2,3:foo0:2:%C3"]:
+            with self.subTest(payload):
+                with self.assertRaises(ValueError):
+                    decode(payload)
@@ -0,0 +1,33 @@
+import time
+from typing import Callable, List, Optional, Tuple
+
+
+class StartupTimer:
+    """Splits the time since started_at into named phases, each ending when mark() is called with its name."""
+
+    def __init__(self, started_at: Optional[float] = None, clock: Callable[[], float] = time.perf_counter):
+        self.__clock = clock
+        self.__started_at = started_at if started_at is not None else clock()
+        self.__last = self.__started_at
+        self.__phases: List[Tuple[str, float]] = []
+
+    @property
+    def phases(self) -> List[Tuple[str, float]]:
+        return list(self.__phases)
+
+    @property
+    def total(self) -> float:
+        return self.__last - self.__started_at
+
+    def mark(self, phase: str) -> float:
+        now = self.__clock()
+        elapsed = now - self.__last
+
+        self.__phases.append((phase, elapsed))
+        self.__last = now
+
+        return elapsed
+
+    def __str__(self):
+        return "startup took {:.1f}ms: {}".format(
+            self.total * 1000, ", ".join("{} {:.1f}ms".format(name, t * 1000) for name, t in self.__phases))
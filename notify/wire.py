@@ -0,0 +1,87 @@
+"""
+Payloads of the iTerm2 custom control sequences sent by init.sh.
+
+Version 1 is the selector followed by comma separated, base64 encoded arguments:
+
+    before-command,bHMgLWw=
+
+Version 2 starts with "@2," and is a sequence of length-prefixed fields: the selector, the time the shell sent the
+sequence (seconds since the epoch, possibly empty), then the arguments. Field data is percent-encoded so that the
+payload is printable ASCII and safe to pass through an escape sequence; the length is that of the encoded data:
+
+    @2,14:before-command0:5:ls -l
+
+Both versions match PAYLOAD_REGEX, so the same monitor receives clients of either version.
+"""
+
+import re
+from base64 import b64decode, b64encode
+from dataclasses import dataclass, field
+from typing import List, Optional
+from urllib.parse import quote, unquote
+
+PAYLOAD_REGEX = r'^([^,]+),(.+)$'
+
+V2_PREFIX = '@2,'
+
+# everything printable in ASCII but %, which starts an escape
+_SAFE = ''.join(chr(c) for c in range(0x20, 0x7f) if chr(c) != '%')
+
+_v1_payload = re.compile(PAYLOAD_REGEX)
+
+
+@dataclass(frozen=True)
+class Message:
+    selector: str
+    args: List[str] = field(default_factory=list)
+    sent_at: Optional[float] = None
+
+
+def encode(selector: str, args: List[str], sent_at: Optional[float] = None, version: int = 2) -> str:
+    if version == 1:
+        return ",".join([selector] + [b64encode(a.encode('utf-8')).decode('ascii') for a in args])
+
+    fields = [selector, "" if sent_at is None else repr(sent_at)] + list(args)
+    encoded = [quote(f, safe=_SAFE) for f in fields]
+    return V2_PREFIX + "".join("{}:{}".format(len(f), f) for f in encoded)
+
+
+def decode(payload: str) -> Message:
+    if not payload.startswith(V2_PREFIX):
+        return _decode_v1(payload)
+
+    fields = []
+
+    pos = len(V2_PREFIX)
+    end = len(payload)
+    find = payload.find
+
+    while pos < end:
+        colon = find(':', pos)
+        length = payload[pos:colon]
+
+        if colon < 0 or not length.isdigit() or not length.isascii():
+            raise ValueError("malformed field length at offset {}".format(pos))
+
+        start = colon + 1
+        pos = start + int(length)
+
+        if pos > end:
+            raise ValueError("truncated field at offset {}".format(start))
+
+        data = payload[start:pos]
+        fields.append(unquote(data, errors='strict') if '%' in data else data)
+
+    if len(fields) < 2 or not fields[0]:
+        raise ValueError("missing selector or timestamp")
+
+    return Message(selector=fields[0], args=fields[2:], sent_at=float(fields[1]) if fields[1] else None)
+
+
+def _decode_v1(payload: str) -> Message:
+    matches = _v1_payload.match(payload)
+    if not matches:
+        raise ValueError("not a control sequence payload: {!r}".format(payload))
+
+    return Message(selector=matches.group(1),
+                   args=[b64decode(s).decode('utf-8') for s in matches.group(2).split(",")])